@@ -0,0 +1,298 @@
+'''
+Benchmarks
+==========
+
+Time the format writers, :func:`pygeomag.data.formats.lib.order_stream` and
+:meth:`pygeomag.data.stream.Stream.merge_by_location` on synthetic XYZF
+streams at 1/60 Hz, 1 Hz and 8 Hz and save the results as JSON.
+
+The startup of the command line (import and --help) is timed in a new
+interpreter, next to an empty interpreter (import/python) as reference.
+
+The synthetic streams contain a day of data of two locations (R0 and R1)
+with gaps and masked samples, no network access is needed.
+
+Each case reports the best time over the repeats, the throughput in rows
+(samples per channel) per second and the peak memory allocated during
+a call (traced by tracemalloc in a separate run).
+
+Usage::
+
+    python benchmarks/run.py --output baseline.json
+    python benchmarks/run.py --output results.json --baseline baseline.json
+
+With a baseline, the cases slower than the threshold are listed and the
+exit code is 1.
+
+..  codeauthor:: Charles Blais
+'''
+import os
+import sys
+import json
+import timeit
+import fnmatch
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+
+# Third-party library
+import numpy as np
+import obspy
+from obspy import Trace, UTCDateTime
+
+# the benchmarks run from the source tree
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# User-contributed library
+from pygeomag.data.stream import Stream  # noqa: E402
+from pygeomag.data.formats import lib  # noqa: E402
+
+
+# constants
+# sampling rates by name with the band code of their channels
+SAMPLING_RATES = {
+    'minute': (1 / 60., 'U'),
+    '1hz': (1., 'L'),
+    '8hz': (8., 'M'),
+}
+LOCATIONS = ['R0', 'R1']
+# gap (start and end hours) of each location
+GAPS = {'R0': (6, 7), 'R1': (18, 19)}
+# fraction of the samples masked in R0 (in short runs)
+MASKED_FRACTION = 0.01
+STARTTIME = UTCDateTime(2020, 1, 19)
+# writers with the sampling rates they support
+WRITERS = {
+    'iaga2002': None,
+    'internet': None,
+    'imfv122': ['minute'],
+}
+# code run in a new interpreter for the startup cases
+IMPORTS = {
+    'python': 'pass',
+    'command_line': 'import pygeomag.command_line',
+    'help': 'import sys, pygeomag.command_line; sys.argv = ["fdsnws2geomag", "--help"]; pygeomag.command_line.fdsnws2geomag()',
+    'iaga2002': 'import pygeomag.data.formats.iaga2002',
+}
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 0.2
+
+
+def build_stream(sampling_rate, band_code, days=1, seed=0):
+    '''
+    Build a synthetic XYZF stream of the locations
+
+    Each location has a gap of an hour (the channels are split in two traces)
+    and R0 has masked samples.
+
+    :type sampling_rate: float
+    :param sampling_rate: sampling rate of the channels
+
+    :type band_code: str
+    :param band_code: band code of the channels
+
+    :type days: int
+    :param days: number of days
+
+    :type seed: int
+    :param seed: seed of the random samples
+
+    :return: :class:`pygeomag.data.stream.Stream`
+    '''
+    rng = np.random.default_rng(seed)
+    npts = int(round(days * 86400 * sampling_rate))
+    stream = Stream()
+    for location in LOCATIONS:
+        columns = [
+            base + np.cumsum(rng.normal(0, 0.1, npts))
+            for base in [17200., -4900., 49970.]
+        ]
+        columns.append(np.sqrt(np.sum(np.square(columns), axis=0)))
+        if location == 'R0':
+            mask = np.zeros(npts, dtype=bool)
+            run = max(npts // 2000, 1)
+            for start in rng.integers(0, npts - run, int(npts * MASKED_FRACTION / run)):
+                mask[start:start + run] = True
+        else:
+            mask = None
+        gap = [int(round(hour * 3600 * sampling_rate)) for hour in GAPS[location]]
+        for component, data in zip('XYZF', columns):
+            if mask is not None:
+                data = np.ma.masked_array(data, mask=mask)
+            for start, stop in [(0, gap[0]), (gap[1], npts)]:
+                stream.append(Trace(data=data[start:stop], header={
+                    'network': 'C2',
+                    'station': 'BNC',
+                    'location': location,
+                    'channel': band_code + 'F' + component,
+                    'sampling_rate': sampling_rate,
+                    'starttime': STARTTIME + start / sampling_rate,
+                }))
+    return stream
+
+
+def get_cases(directory, days=1):
+    '''
+    Get the benchmark cases for each sampling rate
+
+    :type directory: str
+    :param directory: directory of the written files
+
+    :type days: int
+    :param days: number of days of the synthetic streams
+
+    :return: list of (name, rows, callable), rows is None for the startup cases
+    '''
+    cases = [
+        ('import/%s' % name, None, lambda code=code: subprocess.run(
+            [sys.executable, '-c', code], cwd=ROOT, check=True, stdout=subprocess.DEVNULL))
+        for name, code in IMPORTS.items()
+    ]
+    for rate_name, (sampling_rate, band_code) in SAMPLING_RATES.items():
+        stream = build_stream(sampling_rate, band_code, days=days)
+        merged = stream.merge_by_location()
+        rows = int(round(days * 86400 * sampling_rate))
+        # the writers order the components, start from the reversed order
+        shuffled = Stream(merged[::-1])
+        cases.extend([
+            ('merge_by_location/%s' % rate_name, rows, stream.merge_by_location),
+            ('merge_by_location_fill/%s' % rate_name, rows, lambda stream=stream: stream.merge_by_location(fill=True)),
+            ('order_stream/%s' % rate_name, rows, lambda stream=shuffled: lib.order_stream(stream)),
+        ])
+        for writer, rate_names in WRITERS.items():
+            if rate_names is not None and rate_name not in rate_names:
+                continue
+            filename = os.path.join(directory, '%s.%s' % (rate_name, writer))
+            cases.append((
+                '%s/%s' % (writer, rate_name), rows,
+                lambda stream=shuffled, filename=filename, writer=writer: stream.write(filename, format=writer)))
+    return cases
+
+
+def measure(function, repeat=DEFAULT_REPEAT):
+    '''
+    Time a function (best of the repeats) and trace its peak memory
+
+    :return: dict with the seconds per call, the number of calls per repeat
+        and the peak memory in bytes
+    '''
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    seconds = min(timer.repeat(repeat=repeat, number=number)) / number
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'seconds': seconds, 'number': number, 'peak_memory': peak}
+
+
+def get_environment():
+    '''Versions of the interpreter and libraries of the run'''
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'obspy': obspy.__version__,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+    }
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    '''
+    Compare the results to a baseline
+
+    :type threshold: float
+    :param threshold: fraction of the baseline time above which a case is
+        a regression
+
+    :return: list of (name, ratio of the times, regression)
+    '''
+    comparison = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        ratio = result['seconds'] / baseline[name]['seconds']
+        comparison.append((name, ratio, ratio > 1 + threshold))
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the format writers and the merge path on synthetic streams')
+    parser.add_argument(
+        '--output',
+        help='JSON file of the results')
+    parser.add_argument(
+        '--baseline',
+        help='JSON file of previous results to compare to')
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help='Slowdown (fraction of the baseline time) reported as a regression (default: %s)' % DEFAULT_THRESHOLD)
+    parser.add_argument(
+        '--cases',
+        nargs='+',
+        default=['*'],
+        help='Cases to run (wildcards, e.g. iaga2002/*, default: all)')
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=DEFAULT_REPEAT,
+        help='Number of repeats of each case, the best is kept (default: %d)' % DEFAULT_REPEAT)
+    parser.add_argument(
+        '--days',
+        type=int,
+        default=1,
+        help='Number of days of the synthetic streams (default: 1)')
+    parser.add_argument(
+        '-v', '--verbose',
+        action='store_true',
+        help='Verbosity')
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)s: %(message)s',
+        level=logging.INFO if args.verbose else logging.WARNING)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name, rows, function in get_cases(directory, days=args.days):
+            if not any([fnmatch.fnmatch(name, pattern) for pattern in args.cases]):
+                continue
+            logging.info("Running %s", name)
+            result = measure(function, repeat=args.repeat)
+            result['rows'] = rows
+            result['rows_per_second'] = None if rows is None else rows / result['seconds']
+            results[name] = result
+            print("%-32s %12.6f s %14s rows/s %10.1f MiB" % (
+                name, result['seconds'],
+                '-' if rows is None else '%.0f' % result['rows_per_second'],
+                result['peak_memory'] / 2.**20))
+
+    if args.output:
+        with open(args.output, 'w') as resource:
+            json.dump({
+                'created': str(UTCDateTime()),
+                'environment': get_environment(),
+                'results': results,
+            }, resource, indent=2, sort_keys=True)
+
+    if not args.baseline:
+        return 0
+    with open(args.baseline) as resource:
+        baseline = json.load(resource)['results']
+    comparison = compare(results, baseline, threshold=args.threshold)
+    for name, ratio, regression in comparison:
+        print("%-32s %6.2fx%s" % (name, ratio, ' REGRESSION' if regression else ''))
+    return 1 if any([regression for _, _, regression in comparison]) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,198 @@
+'''
+Waveform cache
+==============
+
+Local on-disk cache of the FDSN-WS waveform responses.
+
+The raw responses are stored as miniSEED by network, station, location,
+channel and day (see tests/example/20200119.C2.OTT.mseed for the shape of the
+content).  A small JSON manifest per query and day records when the query was
+fetched and which NSLC were returned (possibly none) so that queries with
+wildcards can be served from disk.
+
+Freshness: a day is considered complete ``latency`` seconds after its end.
+A day fetched before it was complete (e.g. today's still-growing day) is
+refetched, past days are served from the cache.
+
+The size of the cache is bounded, the least recently used miniSEED files
+are evicted.
+
+The StationXML inventories are cached in the same directory (stations/) and
+are refetched after a time-to-live.
+
+..  codeauthor:: Charles Blais
+'''
+import os
+import json
+import glob
+import hashlib
+import logging
+
+# Third-party library
+from obspy import read, read_inventory, UTCDateTime
+
+# User-contributed library
+from pygeomag.clients.defaults import DEFAULT_MAX_SIZE, DEFAULT_INVENTORY_TTL
+from pygeomag.data.stream import Stream
+
+# constants
+DEFAULT_LATENCY = 3600
+
+
+class WaveformCache(object):
+    '''
+    Cache of the waveforms by NSLC and day
+    '''
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE, latency=DEFAULT_LATENCY):
+        '''
+        :type directory: str
+        :param directory: directory of the cache
+
+        :type max_size: int
+        :param max_size: maximum size of the miniSEED files in bytes
+
+        :type latency: float
+        :param latency: seconds after the end of a day when its data is complete
+        '''
+        self.directory = directory
+        self.max_size = max_size
+        self.latency = latency
+
+    def get(self, network, station, location, channel, day):
+        '''
+        Get the waveforms of a query for a day
+
+        :type day: :class:`obspy.UTCDateTime`
+        :param day: start of the day
+
+        :return: :class:`pygeomag.data.stream.Stream` or None if the day is not
+            in the cache or is not fresh
+        '''
+        manifest = self._get_manifest_path(network, station, location, channel, day)
+        try:
+            with open(manifest) as resource:
+                content = json.load(resource)
+        except (IOError, ValueError):
+            return None
+
+        if UTCDateTime(content['fetched']) < day + 86400 + self.latency:
+            logging.info("Cached %s for %s is not complete, refetching", content['query'], day.date)
+            return None
+
+        stream = Stream()
+        for seed_id in content['ids']:
+            filename = self._get_path(seed_id, day)
+            try:
+                stream += read(filename, format='MSEED')
+            except (IOError, OSError):
+                # evicted
+                return None
+            # mark as recently used
+            os.utime(filename)
+        logging.info("Serving %s for %s from cache", content['query'], day.date)
+        return stream
+
+    def put(self, network, station, location, channel, day, stream, fetched=None):
+        '''
+        Store the waveforms of a query for a day
+
+        :type day: :class:`obspy.UTCDateTime`
+        :param day: start of the day
+
+        :type stream: :class:`obspy.Stream`
+        :param stream: raw response of the query (only the day is stored)
+
+        :type fetched: :class:`obspy.UTCDateTime`
+        :param fetched: time of the request (default: now)
+        '''
+        stream = stream.slice(day, day + 86400 - 0.000001, nearest_sample=False)
+        ids = sorted(set([trace.id for trace in stream]))
+        for seed_id in ids:
+            filename = self._get_path(seed_id, day)
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            stream.select(id=seed_id).write(filename, format='MSEED')
+
+        manifest = self._get_manifest_path(network, station, location, channel, day)
+        os.makedirs(os.path.dirname(manifest), exist_ok=True)
+        with open(manifest, 'w') as resource:
+            json.dump({
+                'query': '.'.join([network, station, location, channel]),
+                'fetched': str(fetched or UTCDateTime()),
+                'ids': ids
+            }, resource)
+        self.evict()
+
+    def evict(self):
+        '''
+        Remove the least recently used miniSEED files until the cache fits its size
+        '''
+        files = []
+        for filename in glob.glob(os.path.join(self.directory, '*', '*.mseed')):
+            stat = os.stat(filename)
+            files.append((stat.st_mtime, stat.st_size, filename))
+        size = sum([entry[1] for entry in files])
+        for _, file_size, filename in sorted(files):
+            if size <= self.max_size:
+                break
+            logging.info("Evicting %s from cache", filename)
+            os.remove(filename)
+            size -= file_size
+
+    def _get_path(self, seed_id, day):
+        '''Path of the miniSEED of a NSLC for a day'''
+        return os.path.join(self.directory, day.strftime('%Y'), '%s.%s.mseed' % (day.strftime('%Y%m%d'), seed_id))
+
+    def _get_manifest_path(self, network, station, location, channel, day):
+        '''Path of the manifest of a query for a day'''
+        query = '.'.join([network, station, location, channel])
+        return os.path.join(
+            self.directory, day.strftime('%Y'),
+            '%s.%s.json' % (day.strftime('%Y%m%d'), hashlib.md5(query.encode()).hexdigest()))
+
+
+class InventoryCache(object):
+    '''
+    Cache of the StationXML inventories by query
+    '''
+    def __init__(self, directory, ttl=DEFAULT_INVENTORY_TTL):
+        '''
+        :type directory: str
+        :param directory: directory of the cache
+
+        :type ttl: float
+        :param ttl: seconds an inventory is served from the cache
+        '''
+        self.directory = directory
+        self.ttl = ttl
+
+    def get(self, network, station, level):
+        '''
+        Get the inventory of a query
+
+        :return: :class:`obspy.Inventory` or None if the query is not in the
+            cache or is expired
+        '''
+        filename = self._get_path(network, station, level)
+        try:
+            if os.path.getmtime(filename) + self.ttl < UTCDateTime().timestamp:
+                logging.info("Cached inventory %s is expired, refetching", filename)
+                return None
+            inventory = read_inventory(filename, format='STATIONXML')
+        except (IOError, OSError, ValueError):
+            return None
+        logging.info("Serving inventory from %s", filename)
+        return inventory
+
+    def put(self, network, station, level, inventory):
+        '''
+        Store the inventory of a query
+        '''
+        filename = self._get_path(network, station, level)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        inventory.write(filename, format='STATIONXML')
+
+    def _get_path(self, network, station, level):
+        '''Path of the StationXML of a query'''
+        query = '.'.join([network, station, level])
+        return os.path.join(
+            self.directory, 'stations', '%s.xml' % hashlib.md5(query.encode()).hexdigest())
@@ -0,0 +1,23 @@
+'''
+Client defaults
+===============
+
+Default settings of the clients.
+
+The module has no dependency so that the command line can build its
+arguments (e.g. --help) without importing obspy.
+
+..  codeauthor:: Charles Blais
+'''
+
+# FDSN-WS client (see pygeomag.clients.fdsn)
+DEFAULT_CONCURRENCY = 1
+DEFAULT_RETRIES = 2
+DEFAULT_TIMEOUT = 120
+
+# waveform and inventory cache (see pygeomag.clients.cache)
+DEFAULT_MAX_SIZE = 1024 * 1024 * 1024
+DEFAULT_INVENTORY_TTL = 86400
+
+# SeedLink client (see pygeomag.clients.seedlink)
+DEFAULT_BUFFER_SECONDS = 86400
@@ -0,0 +1,314 @@
+'''
+FDSN-WS client
+==============
+
+Wrapper for an obspy FDSN-WS client that splits the waveform requests.
+
+A single request for a whole network (--station '*') or for several days is
+one huge request that a single slow shard can stall.  The requests are split
+by station and time window and run concurrently on a bounded thread pool
+(or grouped per time window through the bulk dataselect endpoint).  Each
+request is retried on a transient failure (timeout, connection error,
+server error or rate limiting) and the responses are reassembled in a
+single stream.
+
+Optionally, the responses are stored by day in a local cache (see
+pygeomag.clients.cache) and repeated requests are served from disk.
+
+The inventories used by the formats are kept in memory for the life of the
+client and optionally on disk with a time-to-live.
+
+The bytes downloaded by all the requests are counted (bytes_downloaded).
+
+..  codeauthor:: Charles Blais
+'''
+import logging
+import time
+import http.client
+import itertools
+import threading
+import concurrent.futures
+
+# Third-party library
+from obspy import UTCDateTime
+from obspy.clients.fdsn.client import Client as ObspyClient
+from obspy.clients.fdsn.header import (
+    FDSNException, FDSNNoDataException, FDSNTimeoutException, FDSNTooManyRequestsException,
+    FDSNInternalServerException, FDSNBadGatewayException, FDSNServiceUnavailableException)
+
+# User-contributed library
+from pygeomag.clients.defaults import DEFAULT_CONCURRENCY, DEFAULT_RETRIES, DEFAULT_TIMEOUT
+from pygeomag.data.stream import Stream
+
+# constants
+# length of the time windows of the split requests
+DEFAULT_WINDOW = 86400
+# errors of the requests that are retried, the other errors (e.g. a bad
+# request or an authentication error) are raised at once
+TRANSIENT_EXCEPTIONS = (
+    FDSNTimeoutException, FDSNTooManyRequestsException, FDSNInternalServerException,
+    FDSNBadGatewayException, FDSNServiceUnavailableException,
+    ConnectionError, TimeoutError, http.client.HTTPException)
+
+
+class Client(ObspyClient):
+    '''
+    Overwrite Client get_waveforms routine to split the requests
+    '''
+    def __init__(self, base_url, concurrency=DEFAULT_CONCURRENCY, retries=DEFAULT_RETRIES,
+                 timeout=DEFAULT_TIMEOUT, window=DEFAULT_WINDOW, bulk=False, retry_wait=1.0,
+                 cache=None, inventory_cache=None, **kwargs):
+        '''
+        :type base_url: str
+        :param base_url: FDSN-WS URL
+
+        :type concurrency: int
+        :param concurrency: maximum number of requests running at once
+
+        :type retries: int
+        :param retries: number of times a failed request is retried
+
+        :type timeout: float
+        :param timeout: timeout of each request in seconds
+
+        :type window: float
+        :param window: length of the time windows of the requests in seconds
+
+        :type bulk: bool
+        :param bulk: request all the stations of a time window in a single bulk request
+
+        :type retry_wait: float
+        :param retry_wait: seconds to wait before retrying a failed request
+
+        :type cache: :class:`pygeomag.clients.cache.WaveformCache`
+        :param cache: cache of the waveforms by day (default: no cache)
+
+        :type inventory_cache: :class:`pygeomag.clients.cache.InventoryCache`
+        :param inventory_cache: cache of the inventories (default: memory only)
+
+        See :class:`obspy.clients.fdsn.client.Client` for the other keywords.
+        '''
+        # the services are discovered (downloaded) by the obspy client
+        self.bytes_downloaded = 0
+        self._lock = threading.Lock()
+        super(Client, self).__init__(base_url, timeout=timeout, **kwargs)
+        self.concurrency = max(concurrency, 1)
+        self.retries = max(retries, 0)
+        self.window = window
+        self.bulk = bulk
+        self.retry_wait = retry_wait
+        self.cache = cache
+        self.inventory_cache = inventory_cache
+        self._inventories = {}
+
+    def get_waveforms(self, network, station, location, channel, starttime, endtime,
+                      filename=None, **kwargs):
+        '''
+        Query the dataselect service of the client by splitting the request by
+        station and time window when the requests run concurrently or in bulk.
+
+        Station wildcards are then expanded with the station service.
+
+        With a cache, the days found in the cache are not requested.
+
+        See :meth:`obspy.clients.fdsn.client.Client.get_waveforms` for the keywords.
+
+        :return: :class:`pygeomag.data.stream.Stream`
+        '''
+        if filename is not None:
+            return super(Client, self).get_waveforms(
+                network, station, location, channel, starttime, endtime, filename=filename, **kwargs)
+        if self.cache is None:
+            return self._get_waveforms(network, station, location, channel, starttime, endtime, **kwargs)
+
+        # The cache is by day, we serve the days found in the cache and request
+        # the missing ones with a request per range of consecutive days
+        stream = Stream()
+        missing = []
+        for day in _get_days(starttime, endtime):
+            cached = self.cache.get(network, station, location, channel, day)
+            if cached is None:
+                if missing and missing[-1][-1] + 86400 == day:
+                    missing[-1].append(day)
+                else:
+                    missing.append([day])
+            else:
+                stream += cached
+        for days in missing:
+            fetched = UTCDateTime()
+            response = self._get_waveforms(
+                network, station, location, channel, days[0], days[-1] + 86400 - 0.000001, **kwargs)
+            for day in days:
+                self.cache.put(network, station, location, channel, day, response, fetched=fetched)
+            stream += response
+        # The days are merged back together
+        stream = stream.slice(starttime, endtime, nearest_sample=False)
+        stream.merge(method=-1)
+        stream.sort()
+        return stream
+
+    def _get_waveforms(self, network, station, location, channel, starttime, endtime, **kwargs):
+        '''
+        See get_waveforms, request the waveforms without the cache
+        '''
+        if self.concurrency == 1 and not self.bulk:
+            # Nothing runs concurrently, splitting would only add requests
+            requests = [[(network, station, location, channel, starttime, endtime)]]
+        else:
+            stations = station.split(',')
+            if any([_is_wildcard(code) for code in stations]):
+                stations = self._get_station_codes(network, station, starttime, endtime)
+            requests = [
+                [(network, code, location, channel, window_start, window_end) for code in stations]
+                for window_start, window_end in get_windows(starttime, endtime, self.window)
+            ]
+            if not self.bulk:
+                requests = [[bulk] for bulk in itertools.chain.from_iterable(requests)]
+            requests = [bulk for bulk in requests if bulk]
+
+        logging.info("Requesting waveforms in %d requests", len(requests))
+        stream = Stream()
+        if self.concurrency == 1 or len(requests) == 1:
+            for bulk in requests:
+                stream += self._request(bulk, **kwargs)
+        else:
+            with concurrent.futures.ThreadPoolExecutor(self.concurrency) as executor:
+                for response in executor.map(lambda bulk: self._request(bulk, **kwargs), requests):
+                    stream += response
+        # The windows share their boundary samples, identical overlaps and
+        # adjacent traces are merged back together
+        if len(requests) > 1:
+            stream.merge(method=-1)
+        stream.sort()
+        return stream
+
+    def _request(self, bulk, **kwargs):
+        '''
+        Run a single request (a list of bulk lines) with retries
+
+        :return: :class:`obspy.Stream`, empty if no data is available
+        '''
+        for attempt in range(self.retries + 1):
+            try:
+                if len(bulk) == 1:
+                    return super(Client, self).get_waveforms(*bulk[0], **kwargs)
+                return self.get_waveforms_bulk(bulk, **kwargs)
+            except FDSNNoDataException:
+                return Stream()
+            except Exception as err:
+                if attempt == self.retries or not is_transient(err):
+                    raise
+                logging.warning(
+                    "Request %s failed (%s), retrying (%d/%d)",
+                    ".".join(bulk[0][:4]), err, attempt + 1, self.retries)
+                time.sleep(self.retry_wait)
+
+    def _download(self, url, **kwargs):
+        '''
+        Count the bytes of the responses (decompressed) of all the requests
+
+        See :meth:`obspy.clients.fdsn.client.Client._download`
+        '''
+        data = super(Client, self)._download(url, **kwargs)
+        size = len(data) if isinstance(data, bytes) else data.getbuffer().nbytes
+        with self._lock:
+            self.bytes_downloaded += size
+        return data
+
+    def get_inventory(self, network, station, level='station'):
+        '''
+        Get the inventory of the stations, the formats only read the station
+        coordinates and names so the station level is sufficient.
+
+        The inventory is cached in memory and in the inventory cache.
+
+        :return: :class:`obspy.Inventory` or None if no station is found
+        '''
+        key = (network, station, level)
+        if key in self._inventories:
+            return self._inventories[key]
+        inventory = None
+        if self.inventory_cache is not None:
+            inventory = self.inventory_cache.get(network, station, level)
+        if inventory is None:
+            try:
+                inventory = self.get_stations(network=network, station=station, level=level)
+            except FDSNNoDataException:
+                logging.warning("No inventory found for %s.%s", network, station)
+                inventory = None
+            if inventory is not None and self.inventory_cache is not None:
+                self.inventory_cache.put(network, station, level, inventory)
+        self._inventories[key] = inventory
+        return inventory
+
+    def _get_station_codes(self, network, station, starttime, endtime):
+        '''
+        Get the list of station codes matching the station query
+        '''
+        try:
+            inventory = self.get_stations(
+                network=network, station=station,
+                starttime=starttime, endtime=endtime, level='station')
+        except FDSNNoDataException:
+            return []
+        return sorted(set([
+            station.code for network in inventory.networks for station in network.stations]))
+
+
+def get_windows(starttime, endtime, window):
+    '''
+    Split the time range in windows of the given length
+
+    The windows share their boundary since FDSN-WS time ranges are inclusive.
+
+    :type starttime: :class:`obspy.UTCDateTime`
+    :param starttime: start of the range
+
+    :type endtime: :class:`obspy.UTCDateTime`
+    :param endtime: end of the range
+
+    :type window: float
+    :param window: length of the windows in seconds (None for a single window)
+
+    :return: list of (starttime, endtime)
+    '''
+    if not window or endtime - starttime <= window:
+        return [(starttime, endtime)]
+    windows = []
+    window_start = starttime
+    while window_start < endtime:
+        windows.append((window_start, min(window_start + window, endtime)))
+        window_start += window
+    return windows
+
+
+def _get_days(starttime, endtime):
+    '''Get the start of the days of a time range'''
+    day = UTCDateTime(starttime.date)
+    days = []
+    while day <= endtime:
+        days.append(day)
+        day += 86400
+    return days
+
+
+def _is_wildcard(code):
+    '''Check if the code contains FDSN wildcards'''
+    return '*' in code or '?' in code
+
+
+def is_transient(err):
+    '''
+    Verify that the error of a request is transient (it may succeed if retried)
+
+    obspy raises the errors without an HTTP response (e.g. a refused
+    connection) as an unknown FDSNException.
+
+    :type err: Exception
+    :param err: error of the request
+
+    :return: True or False
+    '''
+    if isinstance(err, TRANSIENT_EXCEPTIONS):
+        return True
+    return type(err) is FDSNException and str(err).startswith('Unknown Error')
@@ -0,0 +1,88 @@
+'''
+Filesystem client
+=================
+
+Client serving the waveforms of local miniSEED files (e.g. the archive of an
+acquisition node) with the same interface as the FDSN-WS client.
+
+The headers of the files are read first (no data is decoded) and only the
+files with traces matching the query are read, trimmed to the query.
+
+..  codeauthor:: Charles Blais
+'''
+import glob
+import fnmatch
+import logging
+
+# Third-party library
+from obspy import read
+
+# User-contributed library
+from pygeomag.data.stream import Stream
+
+
+class Client(object):
+    '''
+    Query local miniSEED files like a FDSN-WS dataselect
+    '''
+    def __init__(self, pattern):
+        '''
+        :type pattern: str
+        :param pattern: glob pattern of the miniSEED files
+        '''
+        self.pattern = pattern
+
+    def get_waveforms(self, network, station, location, channel, starttime, endtime, **kwargs):
+        '''
+        Get the waveforms matching the query, the codes are comma separated
+        lists of FDSN wildcards.
+
+        :return: :class:`pygeomag.data.stream.Stream`
+        '''
+        stream = Stream()
+        filenames = sorted(glob.glob(self.pattern, recursive=True))
+        logging.info("Scanning %d files matching %s", len(filenames), self.pattern)
+        for filename in filenames:
+            try:
+                headers = read(filename, format='MSEED', headonly=True)
+            except Exception as err:
+                logging.warning("Unable to read %s (%s), skipping", filename, err)
+                continue
+            if not any([_is_selected(trace.stats, network, station, location, channel, starttime, endtime)
+                        for trace in headers]):
+                continue
+            logging.info("Reading %s", filename)
+            extract = read(filename, format='MSEED', starttime=starttime, endtime=endtime)
+            stream.extend([
+                trace for trace in extract
+                if _is_selected(trace.stats, network, station, location, channel, starttime, endtime)
+            ])
+        stream = stream.trim(starttime, endtime, nearest_sample=False)
+        # Files may overlap (e.g. the example file overlaps on the next day)
+        stream.merge(method=-1)
+        stream.sort()
+        return Stream([trace for trace in stream if trace.stats.npts])
+
+    def get_inventory(self, network, station, level='station'):
+        '''
+        No station information is available in the files
+
+        :return: None
+        '''
+        return None
+
+
+def _is_selected(stats, network, station, location, channel, starttime, endtime):
+    '''
+    Check if a trace matches the query codes and overlaps the time range
+    '''
+    codes = [stats.network, stats.station, stats.location, stats.channel]
+    if not all([_match(code, patterns) for code, patterns in zip(codes, [network, station, location, channel])]):
+        return False
+    return stats.starttime <= endtime and stats.endtime >= starttime
+
+
+def _match(code, patterns):
+    '''Check if the code matches any of the comma separated wildcards (-- for empty)'''
+    return any([
+        fnmatch.fnmatchcase(code, '' if pattern == '--' else pattern) for pattern in patterns.split(',')])
@@ -0,0 +1,218 @@
+'''
+SeedLink client
+===============
+
+Real-time ingestion of the SeedLink packets of the stations.
+
+The packets are accumulated in a ring buffer per channel of each station.
+The buffers are aligned on the sampling grid of their channel and hold the
+last ``buffer_seconds`` of samples (one day by default), a late packet is
+written in place and older samples are overwritten.
+
+On a schedule (every ``interval`` seconds), the samples received since the
+previous flush of each station are handed to a flush callback, e.g. writing
+them through :meth:`pygeomag.data.stream.Stream.write`.
+
+..  codeauthor:: Charles Blais
+'''
+import time
+import logging
+
+# Third-party library
+import numpy as np
+from obspy import Trace
+from obspy.clients.seedlink.easyseedlink import EasySeedLinkClient
+from obspy.clients.seedlink.client.seedlinkconnection import SeedLinkConnection
+
+# User-contributed library
+from pygeomag.clients.defaults import DEFAULT_BUFFER_SECONDS
+from pygeomag.data.stream import Stream
+
+# constants
+DEFAULT_INTERVAL = 60
+DEFAULT_TIMEOUT = 30
+
+
+class RingBuffer(object):
+    '''
+    Ring buffer of the samples of a channel on its sampling grid
+    '''
+    def __init__(self, stats, buffer_seconds=DEFAULT_BUFFER_SECONDS):
+        '''
+        :type stats: :class:`obspy.core.trace.Stats`
+        :param stats: stats of the first packet, its starttime is the origin
+            of the sampling grid
+
+        :type buffer_seconds: float
+        :param buffer_seconds: length of the buffer in seconds
+        '''
+        self.stats = stats.copy()
+        self.stats.npts = 0
+        self.capacity = max(int(round(buffer_seconds * stats.sampling_rate)), 1)
+        self.data = np.zeros(self.capacity, dtype=np.float64)
+        self.valid = np.zeros(self.capacity, dtype=bool)
+        # index (from the origin) of the sample after the last sample
+        self.end = 0
+
+    def _get_index(self, time):
+        '''Index of a time on the sampling grid'''
+        return int(round((time - self.stats.starttime) * self.stats.sampling_rate))
+
+    def append(self, trace):
+        '''
+        Write the samples of a packet in the buffer
+
+        :type trace: :class:`obspy.Trace`
+        :param trace: packet of the channel
+        '''
+        start = self._get_index(trace.stats.starttime)
+        stop = start + trace.stats.npts
+        if stop > self.end:
+            # the samples between the last sample and the packet are unknown
+            self.valid[np.arange(max(self.end, stop - self.capacity), stop) % self.capacity] = False
+            self.end = stop
+        # samples older than the buffer are dropped
+        first = max(start, self.end - self.capacity)
+        if first >= stop:
+            return
+        positions = np.arange(first, stop) % self.capacity
+        values = trace.data[first - start:]
+        self.data[positions] = np.ma.getdata(values)
+        self.valid[positions] = ~np.ma.getmaskarray(values)
+
+    def get_trace(self, starttime=None):
+        '''
+        Get the samples of the buffer from starttime
+
+        :type starttime: :class:`obspy.UTCDateTime`
+        :param starttime: time of the first sample (default: oldest sample)
+
+        :return: :class:`obspy.Trace` with the missing samples masked or None
+            if there is no sample
+        '''
+        first = max(self.end - self.capacity, 0)
+        if starttime is not None:
+            first = max(first, self._get_index(starttime))
+        positions = np.arange(first, max(self.end, first)) % self.capacity
+        valid = np.flatnonzero(self.valid[positions])
+        if not len(valid):
+            return None
+        positions = positions[valid[0]:valid[-1] + 1]
+        data = self.data[positions]
+        if not self.valid[positions].all():
+            data = np.ma.masked_array(data, mask=~self.valid[positions])
+        stats = self.stats.copy()
+        stats.starttime = self.stats.starttime + (first + valid[0]) * self.stats.delta
+        stats.npts = len(data)
+        return Trace(data=data, header=stats)
+
+
+class Connection(SeedLinkConnection):
+    '''
+    SeedLink connection with a timeout of the socket connection only
+
+    The timeout of :class:`SeedLinkConnection` also terminates a collect()
+    taking longer than the timeout, i.e. the stream would end after a pause
+    of the server longer than the timeout.
+    '''
+    def __init__(self, connect_timeout=DEFAULT_TIMEOUT):
+        '''
+        :type connect_timeout: float
+        :param connect_timeout: timeout of the socket connection in seconds
+        '''
+        super(Connection, self).__init__()
+        self.connect_timeout = connect_timeout
+
+    def connect(self):
+        '''
+        Connect to the server (also called by collect() to reconnect)
+        '''
+        self.timeout = self.connect_timeout
+        try:
+            return super(Connection, self).connect()
+        finally:
+            self.timeout = None
+
+
+class Client(EasySeedLinkClient):
+    '''
+    Accumulate the SeedLink packets in ring buffers per station and flush
+    them on a schedule
+    '''
+    def __init__(self, server_url, flush, interval=DEFAULT_INTERVAL,
+                 buffer_seconds=DEFAULT_BUFFER_SECONDS, timeout=DEFAULT_TIMEOUT, autoconnect=True):
+        '''
+        :type server_url: str
+        :param server_url: SeedLink server (host:port)
+
+        :type flush: callable
+        :param flush: called with the :class:`pygeomag.data.stream.Stream` of
+            the samples of a station received since its previous flush
+
+        :type interval: float
+        :param interval: seconds between the flushes
+
+        :type buffer_seconds: float
+        :param buffer_seconds: length of the ring buffers in seconds
+
+        :type timeout: float
+        :param timeout: timeout of the socket connection in seconds
+
+        :type autoconnect: bool
+        :param autoconnect: connect to the server
+        '''
+        super(Client, self).__init__(server_url, autoconnect=False)
+        # the connection of the easy client has no timeout (it can not connect)
+        address = self.conn.get_sl_address()
+        self.conn = Connection(timeout)
+        self.conn.set_sl_address(address)
+        if autoconnect:
+            self.connect()
+        self.flush_callback = flush
+        self.interval = interval
+        self.buffer_seconds = buffer_seconds
+        # ring buffers by station and channel
+        self.buffers = {}
+        # time of the oldest sample received since the flush by station
+        self.pending = {}
+        self._next_flush = time.time() + interval
+
+    def on_data(self, trace):
+        '''
+        Accumulate a packet in the buffer of its channel
+        '''
+        key = (trace.stats.network, trace.stats.station)
+        buffers = self.buffers.setdefault(key, {})
+        if trace.id not in buffers:
+            buffers[trace.id] = RingBuffer(trace.stats, self.buffer_seconds)
+        buffers[trace.id].append(trace)
+        self.pending[key] = min(self.pending.get(key, trace.stats.starttime), trace.stats.starttime)
+        if time.time() >= self._next_flush:
+            self.flush()
+
+    def on_terminate(self):
+        '''
+        Flush the samples received when the connection is terminated
+        '''
+        self.flush()
+
+    def flush(self):
+        '''
+        Flush the samples received since the previous flush of each station
+        '''
+        pending = self.pending
+        self.pending = {}
+        self._next_flush = time.time() + self.interval
+        for key in sorted(pending):
+            stream = Stream([
+                trace for trace in [
+                    ring.get_trace(pending[key]) for ring in self.buffers[key].values()
+                ] if trace is not None
+            ])
+            if not stream:
+                continue
+            logging.info("Flushing %d traces of %s", len(stream), ".".join(key))
+            try:
+                self.flush_callback(stream)
+            except Exception:
+                logging.exception("Unable to flush %s", ".".join(key))
@@ -3,10 +3,27 @@
 Query the FDSN-WS for geomagnetic data and convert to geomagnetic standard formats.
 
 Geomagnetic data standard are in daily format so queries are limited per day (--date).
+Several formats can be written from a single fetch (--format iaga2002 imfv122),
+the formats are written concurrently from the same merged stream.
+The directory structure (fdsnws2directory) can be generated for a range of days
+(--starttime/--endtime or --days) from a single query and kept up to date
+by polling for the new samples (--follow).
+
+Local miniSEED files can be converted without the FDSN-WS (--input).
+
+The directory structure can also be fed in real-time by a SeedLink server
+(seedlink2directory).
+
+Many conversions (jobs) of a job file can be run in one process with a
+single fetch of the overlapping requests (fdsnws2batch).
+
+The wall time of the stages (fetch, merge, trim and write) and the counts of
+bytes, traces, samples and rows of each run can be written as JSON lines or a
+prometheus textfile (--metrics).
 
 It is important to note that some geomagnetic data formats contain stats information about
 the stations.  The program may query the FDSN-WS for the StationXML response or get the
-information from a file.  It is highly recommended to include a file for certain formats
+information from a file (--inventory).  It is highly recommended to include a file for certain formats
 as their output result may be incompatible.
 
 For more information on each format, look under:
@@ -20,20 +37,19 @@ import logging
 import datetime
 import sys
 import os
+import json
+import time
+import fnmatch
+import itertools
 import pathlib
-
-# Client required to query FDSN-WS for conversion
-from obspy.clients.fdsn.client import Client
-from obspy import UTCDateTime
-
-# For parsing datetime (smart)
-import dateutil
+import contextlib
+import concurrent.futures
 
 # User-contributed library
-from pygeomag.data.stream import Stream
-# used for generating filenames
-import pygeomag.data.formats.iaga2002
-import pygeomag.data.formats.imfv122
+# obspy, the clients and the formats are imported when they are used so
+# that the arguments are parsed (e.g. --help) without importing obspy
+import pygeomag.clients.defaults
+import pygeomag.metrics
 
 # Constants
 DEFAULT_DATE = datetime.datetime.now().strftime("%Y-%m-%d")
@@ -42,6 +58,21 @@ DEFAULT_FDNWS = 'http://fdsn.seismo.nrcan.gc.ca/'
 DEFAULT_NETWORK = 'C2'
 DEFAULT_LOCATIONS = ['R?']
 DEFAULT_CHANNELS = ['UFX', 'UFY', 'UFZ', 'UFF']
+DEFAULT_INTERVAL = 60
+DEFAULT_SEEDLINK = 'localhost:18000'
+FORMATS = ['internet', 'iaga2002', 'imfv122']
+# formats with station information from the inventory in their output
+INVENTORY_FORMATS = ['iaga2002', 'imfv122']
+# keys of the jobs of fdsnws2batch with their default
+JOB_DEFAULTS = {
+    'date': DEFAULT_DATE,
+    'network': DEFAULT_NETWORK,
+    'location': DEFAULT_LOCATIONS,
+    'channel': DEFAULT_CHANNELS,
+    'format': 'iaga2002',
+    'fill_gaps': False,
+}
+JOB_REQUIRED = ['station', 'output']
 
 
 def fdsnws2geomag():
@@ -54,13 +85,15 @@ def fdsnws2geomag():
         help='FDSN-WS URL (default: %s)' % DEFAULT_FDNWS)
     parser.add_argument(
         '--format',
-        choices=['internet', 'iaga2002', 'imfv122'],
-        default='iaga2002',
-        help="Output format (default: iaga2002)")
+        nargs='+',
+        choices=FORMATS,
+        default=['iaga2002'],
+        help="Output formats (default: iaga2002)")
     parser.add_argument(
         '--output',
-        default=sys.stdout,
-        help='Output file (default: stdout).')
+        nargs='+',
+        default=[sys.stdout],
+        help='Output file of each format (default: stdout).')
     # query specific parameters
     parser.add_argument(
         '--date',
@@ -84,6 +117,12 @@ def fdsnws2geomag():
         nargs='+',
         default=DEFAULT_CHANNELS,
         help='FDSN compliant channel query (default: %s)' % ",".join(DEFAULT_CHANNELS))
+    parser.add_argument(
+        '--fill-gaps',
+        action='store_true',
+        help='Fill the missing samples of a location from the other locations sample by sample')
+    add_client_arguments(parser)
+    add_metrics_arguments(parser)
     parser.add_argument(
         '-v', '--verbose',
         action='store_true',
@@ -97,41 +136,214 @@ def fdsnws2geomag():
         datefmt="%Y-%m-%d %H:%M:%S",
         level=logging.INFO if args.verbose else logging.WARNING)
 
+    if len(args.output) != len(args.format):
+        parser.error("An output is required for each format")
+
+    with pygeomag.metrics.summary('fdsnws2geomag', args.metrics, args.metrics_format) as metrics:
+        return _fdsnws2geomag(args, metrics)
+
+
+def _fdsnws2geomag(args, metrics):
+    '''
+    Convert the fdsnws query of the arguments (see fdsnws2geomag)
+
+    :type metrics: :class:`pygeomag.metrics.Metrics`
+    :param metrics: metrics of the run
+    '''
+    from obspy import UTCDateTime
+    from pygeomag.data.stream import Stream
+
     # Convert date to starttime and endtime
     reftime = UTCDateTime(args.date)
     starttime = UTCDateTime(reftime.datetime.replace(hour=0, minute=0, second=0, microsecond=0))
     endtime = UTCDateTime(reftime.datetime.replace(hour=23, minute=59, second=59, microsecond=999999))
 
     # Create a handler client
-    logging.info("Connecting to %s", args.url)
-    client = Client(args.url)
+    logging.info("Connecting to %s", args.input or args.url)
+    client = get_client(args)
     logging.info(
         "Requesting data for %s.%s.%s.%s from %s to %s",
         args.network, args.station, ",".join(args.location), ",".join(args.channel),
         starttime.isoformat(), endtime.isoformat())
-    stream = Stream(client.get_waveforms(
-        args.network, args.station, ",".join(args.location), ",".join(args.channel),
-        starttime, endtime))
+    with _fetch_stage(metrics, 'waveforms', client):
+        stream = Stream(client.get_waveforms(
+            args.network, args.station, ",".join(args.location), ",".join(args.channel),
+            starttime, endtime))
+    metrics.add_stream('waveform', stream)
     logging.info("Found stream: %s", str(stream.__str__(extended=True)))
-    # Load optional inventory information
-    inventory = client.get_stations(network=args.network, station=args.station)
 
     # Handle if no data was found
     if not stream:
         logging.warning("No data found")
         return 1
 
+    # Load optional inventory information
+    with _fetch_stage(metrics, 'inventory', client):
+        inventory = get_inventory(client, args)
+
     # Before sending the raw data for writing, we need to trim the response
     # from the FDSNWS query to are actual request time.  We also merge by
     # location.
-    logging.info("Writing informtion to %s", str(args.output))
+    logging.info("Writing informtion to %s", ",".join([str(output) for output in args.output]))
+    results = _write_output(
+        stream, starttime, list(zip(args.output, args.format)), inventory, metrics, fill_gaps=args.fill_gaps)
+    if not _count_results(results, metrics):
+        return 1
+
+
+def _write_output(stream, starttime, outputs, inventory, metrics, fill_gaps=False, locations=None):
+    '''
+    Merge by location, trim to the day and write the stream of a station in
+    each output
+
+    The outputs are written concurrently (a thread per output) from the same
+    merged stream, an output that can not be written does not abort the others.
+
+    :type stream: :class:`pygeomag.data.stream.Stream`
+    :param stream: stream of the station
+
+    :type starttime: :class:`obspy.UTCDateTime`
+    :param starttime: start of the day
+
+    :type outputs: list
+    :param outputs: list of (output, format)
+
+    :type metrics: :class:`pygeomag.metrics.Metrics`
+    :param metrics: metrics of the run
+
+    :type locations: list
+    :param locations: location codes by priority (default: all by ascending code)
+
+    :return: list of the results of each output (see _write_station)
+    '''
+    with metrics.stage('merge'):
+        stream = stream.merge_by_location(locations=locations, fill=fill_gaps)
+    metrics.add_stream('merged', stream)
+    if not stream:
+        raise ValueError("No data found for the locations %s" % ",".join(locations or []))
     # Correct the endtime with delta of the first trace
-    endtime = UTCDateTime(reftime.datetime) + 86400 - stream[0].stats.delta
-    stream.merge_by_location().trim(starttime, endtime).write(
-        args.output,
-        format=args.format,
-        inventory=inventory
-    )
+    with metrics.stage('trim'):
+        stream = stream.trim(starttime, starttime + 86400 - stream[0].stats.delta)
+    with metrics.stage('write'):
+        if len(outputs) == 1:
+            return [_write_station(stream, outputs[0][0], outputs[0][1], inventory)]
+        with concurrent.futures.ThreadPoolExecutor(len(outputs)) as executor:
+            return list(executor.map(
+                lambda output: _write_station(stream, output[0], output[1], inventory), outputs))
+
+
+def add_client_arguments(parser):
+    '''
+    Add the arguments of the FDSN-WS client requests to the parser
+    '''
+    parser.add_argument(
+        '--input',
+        help='Glob pattern of local miniSEED files read instead of querying the FDSN-WS')
+    parser.add_argument(
+        '--inventory',
+        help='StationXML file of the stations used instead of querying the FDSN-WS')
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=pygeomag.clients.defaults.DEFAULT_CONCURRENCY,
+        help='Number of concurrent waveform requests split by station and day (default: %d)' % (
+            pygeomag.clients.defaults.DEFAULT_CONCURRENCY))
+    parser.add_argument(
+        '--bulk',
+        action='store_true',
+        help='Request all stations of a day in a single bulk request')
+    parser.add_argument(
+        '--retries',
+        type=int,
+        default=pygeomag.clients.defaults.DEFAULT_RETRIES,
+        help='Number of times a failed request is retried (default: %d)' % pygeomag.clients.defaults.DEFAULT_RETRIES)
+    parser.add_argument(
+        '--timeout',
+        type=float,
+        default=pygeomag.clients.defaults.DEFAULT_TIMEOUT,
+        help='Timeout of each request in seconds (default: %d)' % pygeomag.clients.defaults.DEFAULT_TIMEOUT)
+    parser.add_argument(
+        '--cache',
+        help='Directory of the local waveform cache by day (default: no cache)')
+    parser.add_argument(
+        '--cache-size',
+        type=float,
+        default=pygeomag.clients.defaults.DEFAULT_MAX_SIZE / 1024**2,
+        help='Maximum size of the waveform cache in MB (default: %d)' % (pygeomag.clients.defaults.DEFAULT_MAX_SIZE / 1024**2))
+    parser.add_argument(
+        '--inventory-ttl',
+        type=float,
+        default=pygeomag.clients.defaults.DEFAULT_INVENTORY_TTL,
+        help='Seconds the inventory is served from the cache (default: %d)' % pygeomag.clients.defaults.DEFAULT_INVENTORY_TTL)
+
+
+def add_metrics_arguments(parser):
+    '''
+    Add the arguments of the metrics summary to the parser
+    '''
+    parser.add_argument(
+        '--metrics',
+        help='File of the metrics summary of each run (wall time of the stages, bytes, traces, samples and rows)')
+    parser.add_argument(
+        '--metrics-format',
+        choices=pygeomag.metrics.FORMATS,
+        default='json',
+        help='Format of the metrics summary, a JSON line appended per run or a prometheus textfile (default: json)')
+
+
+@contextlib.contextmanager
+def _fetch_stage(metrics, name, client):
+    '''
+    Time a stage fetching from the client and count the bytes downloaded
+    (only the FDSN-WS client downloads)
+    '''
+    downloaded = getattr(client, 'bytes_downloaded', 0)
+    with metrics.stage(name):
+        yield
+    metrics.add('bytes_downloaded', getattr(client, 'bytes_downloaded', 0) - downloaded)
+
+
+def get_client(args):
+    '''
+    Create the FDSN-WS client from the parsed arguments
+
+    :rtype: :class:`pygeomag.clients.fdsn.Client` or
+        :class:`pygeomag.clients.filesystem.Client` with --input
+    '''
+    import pygeomag.clients.cache
+    import pygeomag.clients.fdsn
+    import pygeomag.clients.filesystem
+
+    if args.input:
+        return pygeomag.clients.filesystem.Client(args.input)
+    cache = None
+    inventory_cache = None
+    if args.cache:
+        cache = pygeomag.clients.cache.WaveformCache(args.cache, max_size=int(args.cache_size * 1024**2))
+        inventory_cache = pygeomag.clients.cache.InventoryCache(args.cache, ttl=args.inventory_ttl)
+    return pygeomag.clients.fdsn.Client(
+        args.url,
+        concurrency=args.concurrency,
+        bulk=args.bulk,
+        retries=args.retries,
+        timeout=args.timeout,
+        cache=cache,
+        inventory_cache=inventory_cache)
+
+
+def get_inventory(client, args):
+    '''
+    Get the inventory of the requested stations if the output format uses it
+
+    :rtype: :class:`obspy.Inventory` or None
+    '''
+    from obspy import read_inventory
+
+    if not any([output_format in INVENTORY_FORMATS for output_format in args.format]):
+        return None
+    if args.inventory:
+        return read_inventory(args.inventory).select(network=args.network, station=args.station)
+    return client.get_inventory(args.network, args.station)
 
 
 def fdsnws2directory():
@@ -153,9 +365,10 @@ def fdsnws2directory():
         help='FDSN-WS URL (default: %s)' % DEFAULT_FDNWS)
     parser.add_argument(
         '--format',
+        nargs='+',
         choices=['iaga2002', 'imfv122'],
-        default='iaga2002',
-        help="Output format (default: iaga2002)")
+        default=['iaga2002'],
+        help="Output formats, each station file is written in every format (default: iaga2002)")
     parser.add_argument(
         '--directory',
         default=DEFAULT_DIRECTORY,
@@ -165,6 +378,18 @@ def fdsnws2directory():
         '--date',
         default=DEFAULT_DATE,
         help='Date of the request (default: %s)' % DEFAULT_DATE)
+    parser.add_argument(
+        '--starttime',
+        help='First date of a multi-day request, overrides --date')
+    range_group = parser.add_mutually_exclusive_group()
+    range_group.add_argument(
+        '--endtime',
+        help='Last date (inclusive) of a multi-day request')
+    range_group.add_argument(
+        '--days',
+        type=int,
+        default=1,
+        help='Number of days requested starting at the date (default: 1)')
     parser.add_argument(
         '--network',
         default=DEFAULT_NETWORK,
@@ -183,6 +408,30 @@ def fdsnws2directory():
         nargs='+',
         default=DEFAULT_CHANNELS,
         help='FDSN compliant channel query (default: %s)' % "," % DEFAULT_CHANNELS)
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='Number of processes formatting and writing the station files (default: 1)')
+    parser.add_argument(
+        '--update',
+        action='store_true',
+        help='Update the existing daily files in place, only the changed and new rows are written (iaga2002 only)')
+    parser.add_argument(
+        '--follow',
+        action='store_true',
+        help='Keep polling for the new samples and append them to the daily files (iaga2002 only)')
+    parser.add_argument(
+        '--interval',
+        type=float,
+        default=DEFAULT_INTERVAL,
+        help='Seconds between the polls of --follow (default: %d)' % DEFAULT_INTERVAL)
+    parser.add_argument(
+        '--fill-gaps',
+        action='store_true',
+        help='Fill the missing samples of a location from the other locations sample by sample')
+    add_client_arguments(parser)
+    add_metrics_arguments(parser)
     parser.add_argument(
         '-v', '--verbose',
         action='store_true',
@@ -196,61 +445,658 @@ def fdsnws2directory():
         datefmt="%Y-%m-%d %H:%M:%S",
         level=logging.INFO if args.verbose else logging.WARNING)
 
-    # Convert date to starttime and endtime
-    reftime = UTCDateTime(args.date)
-    starttime = UTCDateTime(reftime.datetime.replace(hour=0, minute=0, second=0, microsecond=0))
-    endtime = UTCDateTime(reftime.datetime.replace(hour=23, minute=59, second=59, microsecond=999999))
+    if args.follow and args.format != ['iaga2002']:
+        parser.error("--follow is only supported by the iaga2002 format")
+    if args.follow and args.cache:
+        # the cache is by day, the polls of today would refetch the whole day
+        logging.warning("The cache is not used with --follow")
+        args.cache = None
+
+    with pygeomag.metrics.summary('fdsnws2directory', args.metrics, args.metrics_format) as metrics:
+        return _fdsnws2directory(args, metrics)
+
+
+def _fdsnws2directory(args, metrics):
+    '''
+    Write the fdsnws query of the arguments in the directory structure (see fdsnws2directory)
+
+    :type metrics: :class:`pygeomag.metrics.Metrics`
+    :param metrics: metrics of the run
+    '''
+    from pygeomag.data.stream import Stream
+
+    # Convert the dates to the list of days and the range of the request
+    days = get_days(args.starttime or args.date, endtime=args.endtime, days=args.days)
+    if not days:
+        logging.error("No days in the requested range")
+        return 1
+    starttime = days[0]
+    endtime = days[-1] + 86400 - 0.000001
 
     # Create a handler client
-    logging.info("Connecting to %s", args.url)
-    client = Client(args.url)
+    logging.info("Connecting to %s", args.input or args.url)
+    client = get_client(args)
+    # A single request is made for the whole range, the days are split afterward
     logging.info(
         "Requesting data for %s.%s.%s.%s from %s to %s",
         args.network, args.station, ",".join(args.location), ",".join(args.channel),
         starttime.isoformat(), endtime.isoformat())
-    stream = Stream(client.get_waveforms(
-        args.network, args.station, ",".join(args.location), ",".join(args.channel),
-        starttime, endtime))
+    with _fetch_stage(metrics, 'waveforms', client):
+        stream = Stream(client.get_waveforms(
+            args.network, args.station, ",".join(args.location), ",".join(args.channel),
+            starttime, endtime))
+    metrics.add_stream('waveform', stream)
     logging.info("Found stream: %s", str(stream.__str__(extended=True)))
-    # Load optional inventory information
-    inventory = client.get_stations(network=args.network, station=args.station)
 
     # Handle if no data was found
-    if not stream:
+    if not stream and not args.follow:
         logging.warning("No data found")
         return 1
 
-    # Before sending the raw data for writing, we need to trim the response
-    # from the FDSNWS query to are actual request time.  We also merge by
-    # location.
-    # Correct the endtime with delta of the first trace
-    endtime = UTCDateTime(reftime.datetime) + 86400 - stream[0].stats.delta
-    stream = stream.merge_by_location().trim(starttime, endtime)
+    # Load optional inventory information
+    with _fetch_stage(metrics, 'inventory', client):
+        inventory = get_inventory(client, args)
+
+    # Before sending the raw data for writing, we merge by location once
+    # for the whole range.
+    with metrics.stage('merge'):
+        stream = stream.merge_by_location(fill=args.fill_gaps)
+    metrics.add_stream('merged', stream)
+    if args.follow:
+        if stream:
+            _write_days(stream, days, args, inventory, metrics, update=True)
+        # the summary of the initial request is written before the polls
+        metrics.write()
+        return follow(client, args, inventory, _get_last_sample(stream) if stream else starttime)
+
+    # The formatting is CPU bound, the station files can be written by a pool
+    # of processes.  Otherwise, the formats are written concurrently.
+    executor = None
+    if args.workers > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(args.workers)
+    elif len(args.format) > 1:
+        executor = concurrent.futures.ThreadPoolExecutor(len(args.format))
+    try:
+        futures = []
+        for day in days:
+            # Extract the day from the range, we need to trim the response from
+            # the FDSNWS query to are actual request time.
+            # Correct the endtime with delta of the first trace
+            with metrics.stage('trim'):
+                daystream = stream.slice(day, day + 86400 - stream[0].stats.delta)
+            if not daystream:
+                logging.warning("No data found for %s", day.date)
+                continue
+            with metrics.stage('write'):
+                futures.extend(_write_directory(
+                    daystream, day, args.directory, args.format, inventory, executor, update=args.update))
+        # Errors are handled by station, we report if any of them failed
+        with metrics.stage('write'):
+            results = [future.result() for future in futures]
+        if not _count_results(results, metrics):
+            return 1
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+def follow(client, args, inventory, starttime):
+    '''
+    Poll the client for the samples after starttime and append them to the
+    daily files of the directory structure until interrupted
+
+    The client and the inventory are kept for all the polls.  Each poll only
+    requests the samples after the last sample of the slowest station and
+    the new rows are appended to the daily files, a new file is started at
+    midnight UTC.
 
-    # Loop through the list of stream and generate the unique list of station
-    # codes.  We know the network code is constant and its a single sampling rate
-    # request.
-    stations = set([trace.stats.station for trace in stream])
+    The metrics summary is written for each poll.  A poll that fails (e.g.
+    a request error or a file that can not be written) is logged and the
+    samples are requested again at the next poll.
+
+    :type starttime: :class:`obspy.UTCDateTime`
+    :param starttime: time of the last sample already written
+
+    :return: 0 when interrupted
+    '''
+    try:
+        while True:
+            time.sleep(args.interval)
+            try:
+                starttime = _poll(client, args, inventory, starttime)
+            except Exception:
+                logging.exception("Unable to poll the data after %s", starttime.isoformat())
+    except KeyboardInterrupt:
+        logging.info("Stopping to follow")
+    return 0
+
+
+def _poll(client, args, inventory, starttime):
+    '''
+    Request the samples after starttime and write them in the daily files (see follow)
+
+    :return: time of the last sample written, starttime if a file could
+        not be written
+    '''
+    from pygeomag.data.stream import Stream
+
+    with pygeomag.metrics.summary('fdsnws2directory', args.metrics, args.metrics_format) as metrics:
+        endtime = _now()
+        logging.info(
+            "Polling data for %s.%s.%s.%s from %s to %s",
+            args.network, args.station, ",".join(args.location), ",".join(args.channel),
+            starttime.isoformat(), endtime.isoformat())
+        with _fetch_stage(metrics, 'waveforms', client):
+            stream = Stream(client.get_waveforms(
+                args.network, args.station, ",".join(args.location), ",".join(args.channel),
+                starttime, endtime))
+        metrics.add_stream('waveform', stream)
+        if not stream:
+            return starttime
+        with metrics.stage('merge'):
+            stream = stream.merge_by_location(fill=args.fill_gaps)
+        metrics.add_stream('merged', stream)
+        if not _write_days(stream, get_days(starttime, endtime=endtime), args, inventory, metrics, update=True):
+            logging.warning("Unable to write the data after %s, polling again", starttime.isoformat())
+            return starttime
+        return max(starttime, _get_last_sample(stream))
+
+
+def _now():
+    '''Current time of the polls'''
+    from obspy import UTCDateTime
+    return UTCDateTime()
+
+
+def _get_last_sample(stream):
+    '''
+    Get the time of the last sample of the slowest station
+
+    :rtype: :class:`obspy.UTCDateTime`
+    '''
+    return min([
+        max([trace.stats.endtime for trace in extract])
+        for extract in stream.group_by(['station']).values()
+    ])
+
+
+def _write_days(stream, days, args, inventory, metrics, update=False):
+    '''
+    Write the daily files of the stations for each day (sequentially)
+
+    :type metrics: :class:`pygeomag.metrics.Metrics`
+    :param metrics: metrics of the run
+
+    :return: True if all the files were written
+    '''
+    results = []
+    for day in days:
+        with metrics.stage('trim'):
+            daystream = stream.slice(day, day + 86400 - stream[0].stats.delta)
+        if not daystream:
+            continue
+        with metrics.stage('write'):
+            futures = _write_directory(daystream, day, args.directory, args.format, inventory, update=update)
+            results.extend([future.result() for future in futures])
+    return _count_results(results, metrics)
+
+
+def _count_results(results, metrics):
+    '''
+    Count the files and rows written of the results of _write_station
+
+    :return: True if all the files were written
+    '''
+    failed = len([rows for rows in results if rows is None])
+    metrics.add('files_written', len(results) - failed)
+    metrics.add('files_failed', failed)
+    metrics.add('rows_written', sum([rows for rows in results if rows is not None]))
+    return not failed
+
+
+def seedlink2directory():
+    '''
+    Much like fdsnws2directory --follow but the data is received in real-time
+    from a SeedLink server.
+
+    The packets are accumulated in ring buffers per station and the samples
+    received are merged by location and written (updated) in the daily files
+    on a schedule.  The metrics summary is written for each flush of a station.
+    '''
+    parser = argparse.ArgumentParser(
+        description='Receive the SeedLink packets and update the geomagnetic data standards')
+    parser.add_argument(
+        '--server',
+        default=DEFAULT_SEEDLINK,
+        help='SeedLink server (default: %s)' % DEFAULT_SEEDLINK)
+    parser.add_argument(
+        '--format',
+        nargs='+',
+        choices=['iaga2002'],
+        default=['iaga2002'],
+        help="Output formats (default: iaga2002)")
+    parser.add_argument(
+        '--directory',
+        default=DEFAULT_DIRECTORY,
+        help='Output directory with optional datetime parameter as accept by python datetime (default: %s).' % DEFAULT_DIRECTORY)
+    parser.add_argument(
+        '--network',
+        default=DEFAULT_NETWORK,
+        help='Network code (default: DEFAULT_NETWORK)')
+    parser.add_argument(
+        '--station',
+        nargs='+',
+        required=True,
+        help='Station codes')
+    parser.add_argument(
+        '--location',
+        nargs='+',
+        default=DEFAULT_LOCATIONS,
+        help='Data type + source (data type = R - raw, D - definitive, source = 0,1,2,3..., default: %s)' % DEFAULT_LOCATIONS)
+    parser.add_argument(
+        '--channel',
+        nargs='+',
+        default=DEFAULT_CHANNELS,
+        help='Channels (default: %s)' % ",".join(DEFAULT_CHANNELS))
+    parser.add_argument(
+        '--fill-gaps',
+        action='store_true',
+        help='Fill the missing samples of a location from the other locations sample by sample')
+    parser.add_argument(
+        '--inventory',
+        help='StationXML file of the stations')
+    parser.add_argument(
+        '--interval',
+        type=float,
+        default=DEFAULT_INTERVAL,
+        help='Seconds between the writes of the received samples (default: %d)' % DEFAULT_INTERVAL)
+    parser.add_argument(
+        '--buffer',
+        type=float,
+        default=pygeomag.clients.defaults.DEFAULT_BUFFER_SECONDS,
+        help='Seconds of samples kept by channel (default: %d)' % pygeomag.clients.defaults.DEFAULT_BUFFER_SECONDS)
+    add_metrics_arguments(parser)
+    parser.add_argument(
+        '-v', '--verbose',
+        action='store_true',
+        help='Verbosity')
+    args = parser.parse_args()
+
+    # Set the logging level
+    logging.basicConfig(
+        format='%(asctime)s.%(msecs)03d %(levelname)s \
+            %(module)s %(funcName)s: %(message)s',
+        datefmt="%Y-%m-%d %H:%M:%S",
+        level=logging.INFO if args.verbose else logging.WARNING)
+
+    from obspy import read_inventory
+    from pygeomag.clients.seedlink import Client as SeedLinkClient
+
+    inventory = None
+    if args.inventory:
+        inventory = read_inventory(args.inventory).select(network=args.network)
+
+    def flush(stream):
+        '''Merge and write the samples received of a station'''
+        with pygeomag.metrics.summary('seedlink2directory', args.metrics, args.metrics_format) as metrics:
+            metrics.add_stream('waveform', stream)
+            with metrics.stage('merge'):
+                stream = stream.merge_by_location(fill=args.fill_gaps)
+            metrics.add_stream('merged', stream)
+            days = get_days(
+                min([trace.stats.starttime for trace in stream]),
+                endtime=max([trace.stats.endtime for trace in stream]))
+            _write_days(stream, days, args, inventory, metrics, update=True)
+
+    logging.info("Connecting to %s", args.server)
+    client = SeedLinkClient(
+        args.server, flush, interval=args.interval, buffer_seconds=args.buffer)
+    # a selector by location and channel (LLCCC)
+    selectors = " ".join([
+        location + channel for location in args.location for channel in args.channel])
+    for station in args.station:
+        client.select_stream(args.network, station, selectors)
+    try:
+        client.run()
+    except KeyboardInterrupt:
+        logging.info("Stopping, writing the received samples")
+        client.flush()
+    finally:
+        client.close()
+    return 0
+
+
+def fdsnws2batch():
+    '''
+    Run many fdsnws2geomag conversions (jobs) of a job file in one process
+
+    The job file is a JSON list of jobs or an object with the "jobs" and the
+    "defaults" of every job.  A job has the keys of fdsnws2geomag:
+
+        {"station": "OTT", "output": "ott%Y%m%dvmin.min", "date": "2020-01-19",
+         "network": "C2", "location": ["R0", "R1"], "channel": ["UFX", "UFY", "UFZ", "UFF"],
+         "format": "iaga2002", "fill_gaps": false}
+
+    The station and output (with optional datetime parameters) are required.
+    The locations are merged with the priority of their order, the locations
+    matching a wildcard (e.g. the default R?) by ascending location code
+    like fdsnws2geomag.
+
+    A single client is shared by all the jobs.  The jobs of the same network
+    and day are fetched in a single waveform request (the union of their
+    stations, locations and channels) and the inventory of the stations of
+    a network is requested once.  Every output is extracted from the
+    fetched stream and the outputs of a station with the same locations,
+    channels and fill_gaps share the merged stream.
+    '''
+    parser = argparse.ArgumentParser(
+        description='Run the conversions of a job file to the geomagnetic data standards')
+    parser.add_argument(
+        'jobs',
+        help='JSON job file')
+    parser.add_argument(
+        '--url',
+        default=DEFAULT_FDNWS,
+        help='FDSN-WS URL (default: %s)' % DEFAULT_FDNWS)
+    add_client_arguments(parser)
+    add_metrics_arguments(parser)
+    parser.add_argument(
+        '-v', '--verbose',
+        action='store_true',
+        help='Verbosity')
+    args = parser.parse_args()
+
+    # Set the logging level
+    logging.basicConfig(
+        format='%(asctime)s.%(msecs)03d %(levelname)s \
+            %(module)s %(funcName)s: %(message)s',
+        datefmt="%Y-%m-%d %H:%M:%S",
+        level=logging.INFO if args.verbose else logging.WARNING)
+
+    try:
+        jobs = read_jobs(args.jobs)
+    except (OSError, ValueError) as err:
+        parser.error("Invalid job file %s: %s" % (args.jobs, err))
+
+    with pygeomag.metrics.summary('fdsnws2batch', args.metrics, args.metrics_format) as metrics:
+        return _fdsnws2batch(args, jobs, metrics)
+
+
+def read_jobs(filename):
+    '''
+    Read the jobs of a job file (see fdsnws2batch)
+
+    The defaults are applied to every job, the location and channel codes
+    may be comma separated and the identical jobs are removed.
+
+    :type filename: str
+    :param filename: JSON job file
+
+    :return: list of dict of the jobs with the start of their day
+    '''
+    with open(filename) as resource:
+        content = json.load(resource)
+    if isinstance(content, list):
+        content = {'jobs': content}
+    jobs = []
+    for idx, job in enumerate(content.get('jobs', [])):
+        job = dict(JOB_DEFAULTS, **dict(content.get('defaults', {}), **job))
+        unknown = set(job) - set(JOB_DEFAULTS) - set(JOB_REQUIRED)
+        if unknown:
+            raise ValueError("Unknown keys %s in job %d" % (",".join(sorted(unknown)), idx))
+        missing = [key for key in JOB_REQUIRED if key not in job]
+        if missing:
+            raise ValueError("Missing keys %s in job %d" % (",".join(missing), idx))
+        if job['format'] not in FORMATS:
+            raise ValueError("Unknown format %s in job %d" % (job['format'], idx))
+        for key in ['location', 'channel']:
+            if isinstance(job[key], str):
+                job[key] = job[key].split(',')
+        job['day'] = get_days(job['date'])[0]
+        if job not in jobs:
+            jobs.append(job)
+    return jobs
+
+
+def _fdsnws2batch(args, jobs, metrics):
+    '''
+    Run the jobs (see fdsnws2batch)
+
+    :type metrics: :class:`pygeomag.metrics.Metrics`
+    :param metrics: metrics of the run
+
+    :return: 0 if all the outputs were written, 1 otherwise
+    '''
+    from pygeomag.data.stream import Stream
+
+    logging.info("Connecting to %s", args.input or args.url)
+    client = get_client(args)
+
+    # The jobs of a network and day share a single waveform request
+    groups = {}
+    for job in jobs:
+        groups.setdefault((job['network'], job['day'].date), []).append(job)
+    inventories = {}
+
+    results = []
+    for (network, _), group in sorted(groups.items()):
+        day = group[0]['day']
+        stations, locations, channels = [
+            _get_unique([job[key] for job in group]) for key in ['station', 'location', 'channel']]
+        logging.info(
+            "Requesting data of %d jobs for %s.%s.%s.%s on %s",
+            len(group), network, ",".join(stations), ",".join(locations), ",".join(channels), day.date)
+        with _fetch_stage(metrics, 'waveforms', client):
+            stream = Stream(client.get_waveforms(
+                network, ",".join(stations), ",".join(locations), ",".join(channels),
+                day, day + 86400 - 0.000001))
+        metrics.add_stream('waveform', stream)
+
+        # The inventory of all the stations of the network is requested once
+        if network not in inventories and any([job['format'] in INVENTORY_FORMATS for job in group]):
+            with _fetch_stage(metrics, 'inventory', client):
+                inventories[network] = _get_batch_inventory(client, args, network, _get_unique([
+                    job['station'] for job in jobs
+                    if job['network'] == network and job['format'] in INVENTORY_FORMATS]))
+
+        # The jobs of a station differing only by their output and format
+        # share the merged stream
+        merges = {}
+        for job in group:
+            key = (job['station'], tuple(job['location']), tuple(job['channel']), job['fill_gaps'])
+            merges.setdefault(key, []).append(job)
+        for (station, location, channel, fill_gaps), merge in merges.items():
+            outputs = [(day.strftime(job['output']), job['format']) for job in merge]
+            extract = Stream([
+                trace for trace in stream.select(station=station)
+                if any([fnmatch.fnmatch(trace.stats.channel, code) for code in channel])
+            ])
+            if not extract:
+                logging.warning("No data found for %s", ",".join([output for output, _ in outputs]))
+                results.extend([None] * len(outputs))
+                continue
+            inventory = inventories.get(network)
+            if inventory is not None:
+                inventory = inventory.select(station=station)
+            logging.info("Writing magnetic data to %s", ",".join([output for output, _ in outputs]))
+            try:
+                results.extend(_write_output(
+                    extract, day, outputs, inventory, metrics, fill_gaps=fill_gaps,
+                    locations=_get_locations(location, extract)))
+            except Exception:
+                logging.exception("Unable to write magnetic data to %s", ",".join([output for output, _ in outputs]))
+                results.extend([None] * len(outputs))
+    return 0 if _count_results(results, metrics) else 1
+
+
+def _get_unique(values):
+    '''
+    Get the unique codes of a list of codes or lists of codes in their order
+    '''
+    values = itertools.chain.from_iterable([
+        [value] if isinstance(value, str) else value for value in values])
+    return list(dict.fromkeys(values))
+
+
+def _get_locations(locations, stream):
+    '''
+    Get the location codes of the stream by the priority of the locations,
+    the codes matching a wildcard are sorted (ascending location code)
+
+    :type locations: list
+    :param locations: location codes or wildcards by priority
+
+    :return: list of location codes
+    '''
+    codes = sorted(set([trace.stats.location for trace in stream]))
+    return _get_unique([
+        [code for code in codes if fnmatch.fnmatch(code.upper(), location.upper())]
+        for location in locations
+    ])
+
+
+def _get_batch_inventory(client, args, network, stations):
+    '''
+    Get the inventory of the stations of a network for the jobs
+
+    :rtype: :class:`obspy.Inventory` or None
+    '''
+    from obspy import read_inventory
+
+    if args.inventory:
+        return read_inventory(args.inventory).select(network=network)
+    return client.get_inventory(network, ",".join(stations))
+
+
+def get_days(date, endtime=None, days=1):
+    '''
+    Get the list of days (starttime of each day) of a request
+
+    :type date: str
+    :param date: date of the first day
+
+    :type endtime: str
+    :param endtime: date of the last day (inclusive), overrides days
+
+    :type days: int
+    :param days: number of days
+
+    :return: list of :class:`obspy.UTCDateTime`
+    '''
+    from obspy import UTCDateTime
+
+    reftime = UTCDateTime(date)
+    starttime = UTCDateTime(reftime.datetime.replace(hour=0, minute=0, second=0, microsecond=0))
+    if endtime is not None:
+        days = int((UTCDateTime(endtime) - starttime) // 86400) + 1
+    return [starttime + 86400 * day for day in range(days)]
+
+
+def _write_directory(stream, starttime, directory, output_formats, inventory, executor=None, update=False):
+    '''
+    Write the files of each station for a day of data in the directory structure,
+    a file per format
+
+    :type stream: :class:`pygeomag.data.stream.Stream`
+    :param stream: merged stream of a day
+
+    :type starttime: :class:`obspy.UTCDateTime`
+    :param starttime: start of the day
+
+    :type directory: str
+    :param directory: output directory with optional datetime parameter
+
+    :type output_formats: list
+    :param output_formats: output formats
+
+    :type inventory: :class:`obspy.Inventory`
+    :param inventory: inventory of the stations (optional)
+
+    :type executor: :class:`concurrent.futures.Executor`
+    :param executor: executor writing the station files (default: written sequentially)
+
+    :type update: bool
+    :param update: update the existing files in place (see _write_station)
+
+    :return: list of :class:`concurrent.futures.Future` of each station file (see _write_station)
+    '''
+    # used for generating filenames
+    import pygeomag.data.formats.iaga2002
+    import pygeomag.data.formats.imfv122
+
+    # Group the traces of each station in a single pass.  We know the network
+    # code is constant and its a single sampling rate request.
+    stations = stream.group_by(['station'])
 
     # Convert the directory format string to a full path
-    directory = starttime.strftime(args.directory)
+    directory = starttime.strftime(directory)
     logging.info("Creating directory %s if does not exist", directory)
     pathlib.Path(directory).mkdir(parents=True, exist_ok=True)
 
-    for station in stations:
-        # Extract the station I need
-        extract = stream.select(station=station)
-        # Generate its filename (depends on the format)
-        if args.format in ['iaga2002']:
-            filename = pygeomag.data.formats.iaga2002.get_filename(extract[0].stats)
-        elif args.format in ['imfv122']:
-            filename = pygeomag.data.formats.imfv122.get_filename(extract[0].stats)
-        else:
-            raise ValueError("Unable to generate filename for unhandled format %s" % args.format)
-        filename = os.path.join(directory, filename)
-        logging.info("Writing magnetic data to %s", filename)
-        extract.write(
-            filename,
-            format=args.format,
-            inventory=inventory
+    futures = []
+    for (station,), extract in sorted(stations.items()):
+        # Extract the station I need with its inventory
+        station_inventory = None
+        if inventory is not None:
+            station_inventory = inventory.select(network=extract[0].stats.network, station=station)
+        for output_format in output_formats:
+            # Generate its filename (depends on the format)
+            if output_format in ['iaga2002']:
+                filename = pygeomag.data.formats.iaga2002.get_filename(extract[0].stats)
+            elif output_format in ['imfv122']:
+                filename = pygeomag.data.formats.imfv122.get_filename(extract[0].stats)
+            else:
+                raise ValueError("Unable to generate filename for unhandled format %s" % output_format)
+            filename = os.path.join(directory, filename)
+            logging.info("Writing magnetic data to %s", filename)
+            if executor is None:
+                future = concurrent.futures.Future()
+                future.set_result(_write_station(extract, filename, output_format, station_inventory, update))
+            else:
+                future = executor.submit(_write_station, extract, filename, output_format, station_inventory, update)
+            futures.append(future)
+    return futures
+
+
+def _write_station(stream, filename, output_format, inventory, update=False):
+    '''
+    Write the file of a station, any error is logged so that a bad station
+    does not abort the others.
+
+    With update, an existing file is updated in place (iaga2002 only).
+    Otherwise, the file is written to a temporary file of the same directory
+    which replaces the file once written, a file that can not be written is
+    never left partial.
+
+    :return: number of rows of the file written (only the changed and new
+        rows of an update) or None if the file could not be written
+    '''
+    replace = isinstance(filename, str) and not (update and os.path.exists(filename))
+    target = filename + '.tmp' if replace else filename
+    try:
+        rows = stream.write(
+            target,
+            format=output_format,
+            inventory=inventory,
+            update=update
         )
+        if replace:
+            os.replace(target, filename)
+    except Exception:
+        logging.exception("Unable to write magnetic data to %s", filename)
+        if replace and os.path.exists(target):
+            os.remove(target)
+        return None
+    # the iaga2002 writer returns the rows written
+    return _get_rows(stream) if rows is None else rows
+
+
+def _get_rows(stream):
+    '''
+    Get the number of rows (samples per channel) spanned by the traces of a stream
+    '''
+    if not stream:
+        return 0
+    starttime = min([trace.stats.starttime for trace in stream])
+    endtime = max([trace.stats.endtime for trace in stream])
+    return int(round((endtime - starttime) * stream[0].stats.sampling_rate)) + 1
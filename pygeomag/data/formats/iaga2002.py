@@ -42,14 +42,18 @@ Comment with declination base to be hard coded
 
 ..  codeauthor:: Charles Blais
 '''
+import io
+import os
+import mmap
 import logging
 
 # Third-party library
 import numpy as np
-from obspy import UTCDateTime
+from obspy import Trace, UTCDateTime
 
 # User-contributed library
 import pygeomag.data.formats.lib as lib
+from pygeomag.data.stream import Stream
 
 # contants
 DATA_INTERVAL_TYPES = {
@@ -57,6 +61,11 @@ DATA_INTERVAL_TYPES = {
     'L': '1 second',
     'U': '1 minute (00:30-01:29)'
 }
+DATA_INTERVALS = {
+    'M': 0.125,
+    'L': 1.0,
+    'U': 60.0
+}
 DATA_TYPES = {
     'R': 'variation',
     'D': 'definitive'
@@ -72,6 +81,8 @@ DATA_TYPES_FILE = {
 
 NULL_VALUE = 99999.00
 COMPONENTS = ['X', 'Y', 'Z', 'F']
+# width of the rows of the body (with CRLF)
+ROW_WIDTH = 72
 
 
 def get_filename(stats):
@@ -90,7 +101,7 @@ def get_filename(stats):
     )
 
 
-def write(stream, filename, inventory=None, source=None, **kwargs):
+def write(stream, filename, inventory=None, source=None, chunk_seconds=None, update=False, **kwargs):
     '''
     :type stream: :class:`obspy.Stream`
     :param stream: Stream containing traces, expected channels are orientation XYZF
@@ -100,16 +111,29 @@ def write(stream, filename, inventory=None, source=None, **kwargs):
 
     :type inventory: :class:`obspy.Inventory`
     :param inventory: Inventory with Station found in stream presetn
+
+    :type chunk_seconds: float
+    :param chunk_seconds: length of the windows formatted at once (default: lib.CHUNK_SECONDS)
+
+    :type update: bool
+    :param update: update an existing daily file in place (see _update), only
+        the rows of the stream that changed or are new are written.  A file
+        that can not be updated in place is rewritten with its rows merged
+        with the stream (see _merge_rows).
+
+    :return: number of rows written (with update, the rows patched and appended)
     '''
+    # An existing file is updated in place, otherwise the file is written
+    updating = update and not hasattr(filename, "write") and os.path.exists(filename)
 
     # If the filename is a resource with write command
     # then its a file resource that we can write directly too
-    if not hasattr(filename, "write"):
-        file_opened = True
-        resource = open(filename, "w")
-    else:
+    if hasattr(filename, "write"):
         file_opened = False
         resource = filename
+    elif not updating:
+        file_opened = True
+        resource = open(filename, "w")
 
     if not lib.is_common_traces(stream, stats_matches=['network', 'station', 'sampling_rate']):
         raise ValueError(
@@ -127,12 +151,188 @@ def write(stream, filename, inventory=None, source=None, **kwargs):
             network=stream[0].stats.network,
             station=stream[0].stats.station)
 
+    if updating:
+        rows = _update(stream, filename, inv, source, chunk_seconds)
+        if rows is not None:
+            return rows
+        logging.info("Unable to update %s in place, rewriting the file", filename)
+        stream = lib.order_stream(_merge_rows(stream, filename), components=COMPONENTS)
+        file_opened = True
+        resource = open(filename, "w")
+
     _write_header(stream, resource, inv, source)
     # Write the body
-    _write_body(stream, resource)
+    rows = _write_body(stream, resource, chunk_seconds)
 
     if file_opened:
         resource.close()
+    return rows
+
+
+def _update(stream, filename, inventory, source, chunk_seconds=None):
+    '''
+    Update the rows of an existing daily file in place
+
+    The rows of the body are fixed width (ROW_WIDTH with the CRLF) so the
+    position of a row is given by the length of the header and its offset
+    from the begining of the day.  Only the rows in the time span of the
+    stream are considered, the rows of the file that changed (e.g. NULL_VALUE
+    rows filled by late data) are patched in place and the new rows are
+    appended.  If a changed row does not have the same width (e.g. a value
+    wider than its column), the file can not be updated in place and nothing
+    is written.
+
+    The rows of a file that is not fixed width are not patched, only the new
+    rows are appended.
+
+    :return: number of rows patched and appended or None if the header of
+        the file is different or a changed row does not have the same width
+        (the file has to be rewritten)
+    '''
+    header = io.StringIO()
+    _write_header(stream, header, inventory, source)
+    header.write(_get_column_headers(stream[0].stats.station))
+    header = header.getvalue().encode('ascii')
+
+    day = UTCDateTime(stream[0].stats.starttime.date)
+    sampling_rate = stream[0].stats.sampling_rate
+    endtime = max([trace.stats.endtime for trace in stream])
+    if endtime >= day + 86400:
+        raise ValueError("The obspy data stream does not contain data for the same day")
+
+    if not os.path.getsize(filename):
+        return None
+    with open(filename, "r+b") as resource:
+        with mmap.mmap(resource.fileno(), 0, access=mmap.ACCESS_READ) as content:
+            if content[:len(header)] != header:
+                return None
+            rows = lib.split_rows(content, len(header))
+            if rows is not None and _is_regular(rows, day, sampling_rate):
+                npts = len(rows)
+            else:
+                # the number of rows is given by the time of the last row
+                rows = None
+                last = _get_last_row_time(content)
+                npts = 0 if last is None else int(round((last - day) * sampling_rate)) + 1
+            size = len(content)
+
+            # the rows of the time span of the stream (without gap from the last row)
+            first = min([trace.stats.starttime for trace in stream if trace.stats.npts] or [day])
+            first = min(max(int(round((first - day) * sampling_rate)), 0), npts)
+            matrix, _, _ = lib.get_matrix(
+                stream[:4], day + first / sampling_rate, endtime, NULL_VALUE)
+            matrix = lib.get_values(matrix, NULL_VALUE)
+            overlap = min(npts - first, len(matrix))
+            changed = np.zeros(overlap, dtype=bool)
+            if rows is not None and overlap:
+                changed = _get_changed(rows[first:first + overlap], matrix[:overlap])
+            # release the view of the file before it is closed
+            del rows
+
+        # the changed rows are formatted first, the file is not modified
+        # if a row does not have the same width
+        patches = []
+        stops = np.flatnonzero(np.diff(np.concatenate([[False], changed, [False]]).astype(np.int8)))
+        for start, stop in zip(stops[::2], stops[1::2]):
+            text = ''.join(_iter_body(
+                matrix[start:stop], day, sampling_rate, first + start, chunk_seconds)).encode('ascii')
+            if len(text) != (stop - start) * ROW_WIDTH:
+                logging.info("Row width changed in %s at row %d", filename, first + start)
+                return None
+            patches.append((start, text))
+
+        # patch the changed rows in place
+        written = 0
+        for start, text in patches:
+            resource.seek(len(header) + (first + start) * ROW_WIDTH)
+            resource.write(text)
+            written += len(text) // ROW_WIDTH
+        resource.seek(size)
+
+        # append the new rows
+        for text in _iter_body(matrix[overlap:], day, sampling_rate, first + overlap, chunk_seconds):
+            resource.write(text.encode('ascii'))
+    return written + len(matrix) - overlap
+
+
+def _merge_rows(stream, filename):
+    '''
+    Merge the stream with the rows of an existing daily file
+
+    The samples of the stream have the priority, the rows of the file
+    fill the samples missing from the stream (before or after its time
+    span, gaps and masked samples).  This way, the rows already written are
+    not lost when the file is rewritten from a partial stream.
+
+    :return: :class:`pygeomag.data.stream.Stream` with a trace per component
+    '''
+    stats = stream[0].stats
+    existing = read(filename, network=stats.network) if os.path.getsize(filename) else Stream()
+    # the traces of the stream and of the file are merged as two locations
+    merged = Stream()
+    for location, traces in [('0', stream), ('1', existing)]:
+        for trace in traces:
+            merged.append(Trace(data=trace.data, header={
+                'network': stats.network,
+                'station': stats.station,
+                'location': location,
+                'channel': stats.channel[:-1] + trace.stats.channel[-1:],
+                'starttime': trace.stats.starttime,
+                'sampling_rate': trace.stats.sampling_rate,
+            }))
+    return merged.merge_by_location(locations=['0', '1'], replace_location=stats.location, fill=True)
+
+
+def _is_regular(rows, day, sampling_rate):
+    '''
+    Verify the rows are fixed width rows starting at the begining of the day
+    every sampling interval (the first and last rows)
+    '''
+    if not len(rows):
+        return True
+    if rows.shape[1] != ROW_WIDTH:
+        return False
+    try:
+        times = _parse_times(rows[[0, -1]])
+    except ValueError:
+        return False
+    expected = lib.get_times(day, sampling_rate, 1, offset=len(rows) - 1)
+    return times[0] == np.datetime64(day.ns // 1000, 'us') and times[1] == expected[0]
+
+
+def _get_changed(rows, matrix):
+    '''
+    Get the rows of the file that changed
+
+    The values of the rows are compared to the values written. A value within
+    0.0049 of the value of a row formats (%.2f) to the same value, the
+    other rows are flagged as changed.
+
+    :return: :class:`numpy.ndarray` of bool
+    '''
+    rows = np.ascontiguousarray(rows.T).T
+    try:
+        values = np.column_stack([
+            lib.parse_fixed(rows[:, 30 + 10 * idx:40 + 10 * idx]) for idx in range(4)
+        ])
+    except ValueError:
+        return np.ones(len(rows), dtype=bool)
+    return ~(np.abs(values - matrix) < 0.0049).all(axis=1)
+
+
+def _get_last_row_time(content):
+    '''
+    Get the time of the last row of a file from its tail
+
+    :return: :class:`obspy.UTCDateTime` or None if the file has no rows
+    '''
+    # a row is 72 characters (with CRLF), the tail holds the last two lines
+    lines = content[max(len(content) - 2 * ROW_WIDTH, 0):].split(b'\n')
+    line = next((line.strip() for line in reversed(lines) if line.strip()), b'')
+    if not line[:1].isdigit():
+        # the column headers (DATE TIME DOY ...)
+        return None
+    return UTCDateTime(line[:23].decode('ascii'))
 
 
 def _write_header(stream, resource, inventory, source):
@@ -213,65 +413,273 @@ def _get_headers(stream, inventory, source):
     ]
 
 
-def _write_body(stream, resource):
+def _write_body(stream, resource, chunk_seconds=None):
     '''
     Body of the IAGA-2002 is in the form of:
 
     DATE       TIME         DOY     OTTX      OTTY      OTTZ      OTTF   |
     2017-11-10 00:00:00.000 314     17845.50  -4328.24  51046.59  54250.70
 
-    We grab the starttime and endtime of all traces and insert them into a trace
-    of identical length.  This way, index 0...x are the same time in all traces.
+    We walk the time axis from the begining of the day to the maximum endtime of
+    all traces.  The traces are aligned in a matrix (see lib.get_matrix) built,
+    formatted and written in windows of chunk_seconds (see lib.iter_windows).
+
+    :return: number of rows written
     '''
-    # make a copy of the stream before changing it
-    # any trace manipulation are done by reference in obspy
-    nstream = stream.copy()
     # The starttime is the begining of the day in the stream
     # IAGA2002 files are always daily files
-    starttime = UTCDateTime(nstream[0].stats.starttime.date)
+    starttime = UTCDateTime(stream[0].stats.starttime.date)
     # The endtime is always the maximum endtime of all the streams
-    # if the trace is a masked array, we convert it to a non-mask array
-    endtime = nstream[0].stats.endtime
-    for trace in nstream:
-        endtime = max(trace.stats.endtime, endtime)
-        if np.ma.is_masked(trace):
-            trace.data = trace.data.filled(fill_value=NULL_VALUE)
+    endtime = max([trace.stats.endtime for trace in stream])
 
     # if the endtime is not for the same day, we have a problem
     if endtime >= starttime + 86400:
         raise ValueError("The obspy data stream does not contain data for the same day")
 
-    # Extract other stats information for later
-    station_code = stream[0].stats.station
-    sampling_rate = stream[0].stats.sampling_rate
-
     # Write the header
-    resource.write(
-        "DATE       TIME         DOY     %3s%1s      %3s%1s      %3s%1s      %3s%1s   |\r\n" % (
-            station_code, COMPONENTS[0],
-            station_code, COMPONENTS[1],
-            station_code, COMPONENTS[2],
-            station_code, COMPONENTS[3]
-        )
+    resource.write(_get_column_headers(stream[0].stats.station))
+
+    # build the columns of the body for each window of rows at once
+    sampling_rate = stream[0].stats.sampling_rate
+    written = 0
+    for start, rows in lib.iter_windows(
+            stream[:4], starttime, endtime, NULL_VALUE, lib.get_window_size(sampling_rate, chunk_seconds)):
+        rows = lib.get_values(rows, NULL_VALUE)
+        resource.write(_format_rows(
+            lib.get_times(starttime, sampling_rate, len(rows), offset=start),
+            [rows[:, idx] for idx in range(4)]))
+        written += len(rows)
+    return written
+
+
+def _get_column_headers(station_code):
+    '''Get the column headers of the body'''
+    return "DATE       TIME         DOY     %3s%1s      %3s%1s      %3s%1s      %3s%1s   |\r\n" % (
+        station_code, COMPONENTS[0],
+        station_code, COMPONENTS[1],
+        station_code, COMPONENTS[2],
+        station_code, COMPONENTS[3]
     )
 
-    # Trim/Pad the data for our query
-    nstream.trim(starttime, endtime, pad=True, fill_value=NULL_VALUE)
 
-    # print the information by time starting at starttime
-    for offset in range(len(nstream[0])):
-        timestamp = starttime + offset/sampling_rate
-        components = []
-        for idx in range(4):
-            if nstream[idx][offset] and nstream[idx][offset] < NULL_VALUE:
-                components.append(nstream[idx][offset])
-            else:
-                components.append(NULL_VALUE)
-        resource.write("%s %s    %9.2f %9.2f %9.2f %9.2f\r\n" % (
-            timestamp.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3],
-            timestamp.strftime("%j"),
-            components[0],
-            components[1],
-            components[2],
-            components[3]
-        ))
+def _iter_body(matrix, starttime, sampling_rate, offset, chunk_seconds=None):
+    '''
+    Format the rows of the matrix of XYZF values in windows of chunk_seconds
+
+    :type offset: int
+    :param offset: offset of the first row of the matrix from starttime (in samples)
+
+    :return: generator of str
+    '''
+    for start, rows in lib.iter_rows(matrix, lib.get_window_size(sampling_rate, chunk_seconds)):
+        yield _format_rows(
+            lib.get_times(starttime, sampling_rate, len(rows), offset=offset + start),
+            [rows[:, idx] for idx in range(4)])
+
+
+def _format_rows(times, values):
+    '''
+    Format the rows of the body
+
+    All columns are fixed width so the rows are assembled as a character matrix.
+    If a value does not fit its column, we fallback to printf-style formatting.
+
+    :type times: :class:`numpy.ndarray`
+    :param times: datetime64 timestamps of the rows
+
+    :type values: list
+    :param values: list of :class:`numpy.ndarray` of the XYZF values
+
+    :return: str
+    '''
+    dates = lib.join_chars([
+        lib.format_days(times, '%Y-%m-%d '),
+        lib.format_clock(times, precision=3),
+        lib.format_days(times, ' %j    ')
+    ])
+    columns = [lib.format_fixed(value, 9, 2) for value in values]
+    if any(column is None for column in columns):
+        return lib.format_rows(
+            "%s%9.2f %9.2f %9.2f %9.2f\r\n",
+            [lib.as_strings(dates)] + values)
+    return lib.join_chars([
+        dates, columns[0], b' ', columns[1], b' ', columns[2], b' ', columns[3], b'\r\n'
+    ]).tobytes().decode('ascii')
+
+
+def read(filename, network='', starttime=None, endtime=None, **kwargs):
+    '''
+    Read an IAGA-2002 file
+
+    The header records are kept in the stats (iaga2002) of the traces.  The
+    location code is the data type (R - variation, D - definitive, ...) and
+    the channel is the sampling code, F and the component (see get_filename).
+
+    Files are memory-mapped, only the rows of the requested time slice are
+    decoded (see _read_body).
+
+    :type filename: str or resource
+    :param filename: filename to read from
+
+    :type network: str
+    :param network: network code of the traces (not part of the format)
+
+    :type starttime: :class:`obspy.UTCDateTime`
+    :param starttime: start of the time slice (default: first row)
+
+    :type endtime: :class:`obspy.UTCDateTime`
+    :param endtime: end of the time slice, inclusive (default: last row)
+
+    :return: :class:`pygeomag.data.stream.Stream`
+    '''
+    if hasattr(filename, "read") or not os.path.getsize(filename):
+        return _read(lib.read_content(filename), network, starttime, endtime)
+    with open(filename, "rb") as resource:
+        content = mmap.mmap(resource.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return _read(content, network, starttime, endtime)
+        finally:
+            content.close()
+
+
+def _read(content, network, starttime, endtime):
+    '''
+    See read, parse the content (bytes or memory-mapped file) of the file
+    '''
+    # The header records end with the column headers (DATE TIME DOY ...)
+    headers = {}
+    position = 0
+    while True:
+        end = content.find(b'\n', position)
+        if end < 0:
+            raise ValueError("IAGA-2002 column headers not found")
+        line = content[position:end].rstrip(b'\r').decode('ascii')
+        position = end + 1
+        if line.startswith('DATE'):
+            break
+        if line.startswith(' #') or not line.strip():
+            continue
+        headers[line[1:24].strip()] = line[24:69].strip()
+    labels = line.rstrip('|').split()[3:]
+
+    station_code = headers.get('IAGA CODE', '')
+    components = [
+        label[len(station_code):] if label.startswith(station_code) else label[-1]
+        for label in labels
+    ]
+    data_type = headers.get('Data Type', '')
+    location = dict([(value, key) for key, value in DATA_TYPES.items()]).get(
+        data_type.lower(), data_type[:1].upper())
+
+    times, columns = _read_body(
+        content, position, len(components),
+        starttime=None if starttime is None else np.datetime64(starttime.ns // 1000, 'us'),
+        endtime=None if endtime is None else np.datetime64(endtime.ns // 1000, 'us'))
+
+    # the sampling interval is given by the rows, unless there is a single row
+    sampling_code = dict([
+        (value, key) for key, value in DATA_INTERVAL_TYPES.items()
+    ]).get(headers.get('Data Interval Type'), 'U')
+    return lib.build_stream(
+        times, columns, components, NULL_VALUE, {
+            'network': network,
+            'station': station_code,
+            'location': location,
+            'iaga2002': headers
+        },
+        delta=DATA_INTERVALS[sampling_code])
+
+
+def _read_body(content, position, ncomponents, starttime=None, endtime=None):
+    '''
+    Parse the body of the IAGA-2002 (see _write_body) in bulk
+
+    The rows of a body written to specification are fixed width, the columns
+    are parsed from a character matrix of the rows (a view of the content).
+    The rows of the time slice are found from their byte offsets given the
+    time of the first row and the sampling interval.  Otherwise, the fields of
+    every row are split at once.
+
+    :type content: bytes or :class:`mmap.mmap`
+    :param content: content of the file
+
+    :type position: int
+    :param position: position of the body in the content
+
+    :type starttime: :class:`numpy.datetime64`
+    :param starttime: start of the time slice
+
+    :type endtime: :class:`numpy.datetime64`
+    :param endtime: end of the time slice
+
+    :return: datetime64 timestamps and values with a column per component
+    '''
+    rows = lib.split_rows(content, position)
+    if rows is not None and rows.shape[1] >= 32 + 10 * ncomponents:
+        try:
+            rows = rows[_get_slice(rows, starttime, endtime)]
+            # the columns are parsed from the transposed matrix (contiguous columns)
+            rows = np.ascontiguousarray(rows.T).T
+            times = _parse_times(rows)
+            columns = np.column_stack([
+                lib.parse_fixed(rows[:, 30 + 10 * idx:40 + 10 * idx]) for idx in range(ncomponents)
+            ])
+            return _select(times, columns, starttime, endtime)
+        except ValueError:
+            logging.info("IAGA-2002 body is not fixed width, splitting the fields")
+
+    fields = np.array(content[position:].split())
+    if len(fields) % (3 + ncomponents):
+        raise ValueError("IAGA-2002 body does not contain %d fields per row" % (3 + ncomponents))
+    fields = fields.reshape(-1, 3 + ncomponents)
+    times = lib.parse_date(lib.as_chars(fields[:, 0])) + lib.parse_clock(lib.as_chars(fields[:, 1]))
+    return _select(times, fields[:, 3:].astype(np.float64), starttime, endtime)
+
+
+def _parse_times(rows):
+    '''Parse the timestamps of fixed width rows'''
+    return lib.parse_date(rows[:, 0:10]) + lib.parse_clock(rows[:, 11:23])
+
+
+def _get_slice(rows, starttime, endtime):
+    '''
+    Get the slice of the fixed width rows covering the time range
+
+    The rows are expected every sampling interval (the step of the first
+    rows), the slice is verified and all the rows are used if some are missing.
+
+    :return: slice
+    '''
+    if (starttime is None and endtime is None) or len(rows) < 2:
+        return slice(None)
+    first, second = _parse_times(rows[:2])
+    delta = (second - first).astype(np.int64)
+    if delta <= 0:
+        return slice(None)
+    start = 0
+    if starttime is not None:
+        start = min(max(-(-(starttime - first).astype(np.int64) // delta), 0), len(rows))
+    stop = len(rows)
+    if endtime is not None:
+        stop = min(max((endtime - first).astype(np.int64) // delta + 1, start), len(rows))
+    selected = slice(int(start), int(stop))
+    # verify the first and last row of the slice and their neighbours
+    edges = [idx for idx in [start - 1, start, stop - 1, stop] if 0 <= idx < len(rows)]
+    times = _parse_times(rows[edges])
+    expected = first + np.array(edges, dtype=np.int64) * delta.astype('timedelta64[us]')
+    if not (times == expected).all():
+        logging.info("IAGA-2002 rows are not regularly sampled, reading all the rows")
+        return slice(None)
+    return selected
+
+
+def _select(times, columns, starttime, endtime):
+    '''Select the rows of the time range'''
+    selected = np.ones(len(times), dtype=bool)
+    if starttime is not None:
+        selected &= times >= starttime
+    if endtime is not None:
+        selected &= times <= endtime
+    if selected.all():
+        return times, columns
+    return times[selected], columns[selected]
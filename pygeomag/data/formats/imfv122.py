@@ -26,9 +26,12 @@ R = hard coded (reported = variation)
 ..  codeauthor:: Charles Blais
 '''
 
+import datetime
+
 import numpy as np
 from obspy import UTCDateTime
 import pygeomag.data.formats.lib as lib
+from pygeomag.data.stream import Stream
 
 # constants
 MONTHS_STR = [
@@ -118,15 +121,7 @@ def _write_body(stream, resource, inventory):
     %7d %7d %7d %6d  %7d %7d %7d %6d
     '''
 
-    # make a copy of the stream before changing it
-    # any trace manipulation are done by reference in obspy
-    nstream = stream.copy()
-    for trace in nstream:
-        # for each trace, if its a masked array, convert it to an array
-        if np.ma.is_masked(trace):
-            trace.data = trace.data.filled(fill_value=NULL_VALUE)
-
-    station_code = nstream[0].stats.station
+    station_code = stream[0].stats.station
     # we don't need any network information so lets dumb down the inventory
     # to the station object
     station = inventory.networks[0].stations[0] if inventory else None
@@ -135,16 +130,26 @@ def _write_body(stream, resource, inventory):
 
     # The starttime is the begining of the day in the stream
     # IAGA2002 files are always daily files
-    starttime = UTCDateTime(nstream[0].stats.starttime.date)
-    endtime = starttime + 86400.0 - nstream[0].stats.delta
-    nstream.trim(starttime, endtime, pad=True, fill_value=NULL_VALUE)
+    starttime = UTCDateTime(stream[0].stats.starttime.date)
+    endtime = starttime + 86400.0 - stream[0].stats.delta
+    matrix, starttime, _ = lib.get_matrix(stream[:4], starttime, endtime, NULL_VALUE)
 
-    if len(nstream[0]) != 1440:
+    if len(matrix) != 1440:
         raise ValueError("Error, the trace does not contain a full day worth of data")
 
     date = MONTHS_STR[starttime.month-1] + starttime.strftime("%d%y")
     doy = starttime.strftime("%j")
 
+    # nT*10 values of all components reshaped to the hour blocks of
+    # 30 lines with 2 minutes (XYZFXYZF) each, the values are scaled in the
+    # precision of the samples (e.g. float32)
+    matrix = np.where(matrix < NULL_VALUE, matrix, NULL_VALUE)
+    values = np.column_stack([
+        np.trunc(matrix[:, idx].astype(
+            trace.data.dtype if np.issubdtype(trace.data.dtype, np.floating) else np.float64) * 10)
+        for idx, trace in enumerate(stream[:4])
+    ]).astype(np.int64).reshape(24, 30, 8)
+
     # for each hour block, add a header
     for hour in range(24):
         resource.write(
@@ -152,14 +157,57 @@ def _write_body(stream, resource, inventory):
                 station_code,
                 date, doy, hour,
                 colatitude10, longitude10
-            )
+            ) + ("%7d %7d %7d %6d  %7d %7d %7d %6d\n" * 30) % tuple(values[hour].ravel().tolist())
         )
-        for minute in range(60):
-            idx = hour*60 + minute
-            resource.write("%7d %7d %7d %6d" % (
-                (nstream[0].data[idx] if nstream[0].data[idx] < NULL_VALUE else NULL_VALUE)*10,
-                (nstream[1].data[idx] if nstream[1].data[idx] < NULL_VALUE else NULL_VALUE)*10,
-                (nstream[2].data[idx] if nstream[2].data[idx] < NULL_VALUE else NULL_VALUE)*10,
-                (nstream[3].data[idx] if nstream[3].data[idx] < NULL_VALUE else NULL_VALUE)*10,
-            ))
-            resource.write("\n" if minute % 2 else "  ")
+
+
+def read(filename, network='', **kwargs):
+    '''
+    Read an IMFv1.22 file
+
+    The header information (colatitude, longitude, ...) is kept in the stats
+    (imfv122) of the traces.  The location code is the data type (R) and the
+    channel is U, F and the component.
+
+    :type filename: str or resource
+    :param filename: filename to read from
+
+    :type network: str
+    :param network: network code of the traces (not part of the format)
+
+    :return: :class:`pygeomag.data.stream.Stream`
+    '''
+    lines = [line for line in lib.read_content(filename).splitlines() if line.strip()]
+    if len(lines) % 31:
+        raise ValueError("IMFv1.22 hour blocks must contain a header and 30 lines")
+    # the hour headers are removed, all the values of the body are parsed at once
+    headers = [line.decode('ascii').split() for line in lines[::31]]
+    del lines[::31]
+    if not headers:
+        return Stream()
+    components = list(headers[0][4])
+    values = np.array(b' '.join(lines).split()).astype(np.int64)
+    if len(values) != len(headers) * 60 * len(components):
+        raise ValueError("IMFv1.22 hour blocks must contain 60 minutes of %s" % headers[0][4])
+
+    # start of each hour block (day of the header and hour)
+    starts = np.array([
+        np.datetime64(datetime.datetime.strptime(header[1][3:], '%d%y').replace(
+            month=MONTHS_STR.index(header[1][:3]) + 1), 'us') + np.timedelta64(int(header[3]), 'h')
+        for header in headers
+    ])
+    times = (starts[:, np.newaxis] + np.arange(60).astype('timedelta64[m]')).ravel()
+
+    # the values are nT*10 and the null values are written as 999999 (see _write_body)
+    values = values.reshape(-1, len(components))
+    columns = np.where(values < int(NULL_VALUE * 10), values / 10.0, NULL_VALUE)
+    return lib.build_stream(times, columns, components, NULL_VALUE, {
+        'network': network,
+        'station': headers[0][0],
+        'location': headers[0][5],
+        'imfv122': {
+            'colatitude': int(headers[0][7][:4]) / 10.0,
+            'longitude': int(headers[0][7][4:]) / 10.0,
+            'gin': headers[0][6]
+        }
+    })
@@ -20,13 +20,14 @@ No StationXML (Inventory) requirements
 
 import numpy as np
 import pygeomag.data.formats.lib as lib
+from pygeomag.data.stream import Stream
 
 # constants
 NULL_VALUE = 99999.00
 COMPONENTS = ['X', 'Y', 'Z', 'F']
 
 
-def write(stream, filename, **kwargs):
+def write(stream, filename, chunk_seconds=None, **kwargs):
     '''
     Write data in internet format
 
@@ -39,6 +40,9 @@ def write(stream, filename, **kwargs):
 
     :type filename: str or resource
     :param filename: filename to write too
+
+    :type chunk_seconds: float
+    :param chunk_seconds: length of the windows formatted at once (default: lib.CHUNK_SECONDS)
     '''
 
     # If the filename is a resource with write command
@@ -58,51 +62,116 @@ def write(stream, filename, **kwargs):
     stream = lib.order_stream(stream, components=COMPONENTS)
 
     # Write the body
-    _write_body(stream, resource)
+    _write_body(stream, resource, chunk_seconds)
 
     if file_opened:
         resource.close()
 
 
-def _write_body(stream, resource):
+def _write_body(stream, resource, chunk_seconds=None):
     '''
     Write body of the format
 
-    We grab the starttime and endtime of all traces and insert them into a trace
-    of identical length.  This way, index 0...x are the same time in all traces.
+    We walk the time axis from the minimum starttime to the maximum endtime of all
+    traces.  The traces are aligned in a matrix (see lib.get_matrix) built,
+    formatted and written in windows of chunk_seconds (see lib.iter_windows).
+    '''
+    starttime = min([trace.stats.starttime for trace in stream])
+    endtime = max([trace.stats.endtime for trace in stream])
+    sampling_rate = stream[0].stats.sampling_rate
+    station_code = stream[0].stats.station
+
+    # sub-second timestamps are only written when sampling faster than 1 Hz
+    precision = 0 if sampling_rate < 1 else 3
+
+    # build the columns of the body for each window of rows at once
+    for start, rows in lib.iter_windows(
+            stream[:4], starttime, endtime, NULL_VALUE, lib.get_window_size(sampling_rate, chunk_seconds)):
+        rows = lib.get_values(rows, NULL_VALUE)
+        resource.write(_format_rows(
+            station_code,
+            lib.get_times(starttime, sampling_rate, len(rows), offset=start),
+            [rows[:, idx] for idx in range(4)],
+            precision))
+
+
+def _format_rows(station_code, times, values, precision):
+    '''
+    Format the rows of the body
+
+    The values are not padded, they are formatted in a fixed width using a
+    NUL fill character which is then stripped from the rows.  If a value does
+    not fit the width, we fallback to printf-style formatting.
+
+    :type station_code: str
+    :param station_code: station code starting each row
+
+    :type times: :class:`numpy.ndarray`
+    :param times: datetime64 timestamps of the rows
+
+    :type values: list
+    :param values: list of :class:`numpy.ndarray` of the XYZF values
+
+    :type precision: int
+    :param precision: number of decimals of the second in the timestamps
+
+    :return: str
+    '''
+    timestamps = lib.join_chars([
+        ('%s ' % station_code).encode('ascii'),
+        lib.format_days(times, '%Y %j:'),
+        lib.format_clock(times, precision=precision)
+    ])
+    columns = [lib.format_fixed(value, 12, 2, fill='\0') for value in values]
+    if any(column is None for column in columns):
+        return lib.format_rows(
+            "%s %.2f %.2f %.2f %.2f\n", [lib.as_strings(timestamps)] + values)
+    return lib.join_chars([
+        timestamps, b' ', columns[0], b' ', columns[1], b' ', columns[2], b' ', columns[3], b'\n'
+    ]).tobytes().replace(b'\0', b'').decode('ascii')
+
+
+def read(filename, network='', location='', **kwargs):
+    '''
+    Read an internet format file
+
+    A stream of the traces of each station in the file is returned.  The
+    channel is the sampling code, F and the component.
+
+    :type filename: str or resource
+    :param filename: filename to read from
+
+    :type network: str
+    :param network: network code of the traces (not part of the format)
+
+    :type location: str
+    :param location: location code of the traces (not part of the format)
+
+    :return: :class:`pygeomag.data.stream.Stream`
     '''
-    # make a copy of the stream before changing it
-    # any trace manipulation are done by reference in obspy
-    nstream = stream.copy()
-    starttime = nstream[0].stats.starttime
-    endtime = nstream[0].stats.endtime
-    sampling_rate = nstream[0].stats.sampling_rate
-    station_code = nstream[0].stats.station
-
-    for trace in nstream:
-        starttime = min(trace.stats.starttime, starttime)
-        endtime = max(trace.stats.endtime, endtime)
-        # for each trace, if its a masked array, convert it to an array
-        if np.ma.is_masked(trace):
-            trace.data = trace.data.filled(fill_value=NULL_VALUE)
-
-    nstream.trim(starttime, endtime, pad=True, fill_value=NULL_VALUE)
-    # print the information by time starting at starttime
-    for offset in range(len(nstream[0])):
-        timestamp = starttime + offset/sampling_rate
-        timestamp = timestamp.strftime("%Y %j:%H:%M:%S") if sampling_rate < 1 else \
-            timestamp.strftime("%Y %j:%H:%M:%S.%f")[:-3]
-        components = []
-        for idx in range(4):
-            if nstream[idx][offset] and nstream[idx][offset] < NULL_VALUE:
-                components.append(nstream[idx][offset])
-            else:
-                components.append(NULL_VALUE)
-        resource.write("{station} {timestamp} {X} {Y} {Z} {F}\n".format(
-            station=station_code,
-            timestamp=timestamp,
-            X="%.2f" % components[0],
-            Y="%.2f" % components[1],
-            Z="%.2f" % components[2],
-            F="%.2f" % components[3]
-        ))
+    # The fields of every row are split at once
+    fields = np.array(lib.read_content(filename).split())
+    if len(fields) % (3 + len(COMPONENTS)):
+        raise ValueError("Internet format rows must contain %d fields" % (3 + len(COMPONENTS)))
+    fields = fields.reshape(-1, 3 + len(COMPONENTS))
+
+    # YYYY DDD:HH:MM:SS[.fff]
+    clocks = lib.as_chars(fields[:, 2])
+    if len(fields) and (clocks[:, 3] != ord(':')).any():
+        raise ValueError("Invalid time, expected DDD:HH:MM:SS")
+    years = lib.parse_digits(lib.as_chars(fields[:, 1])) - 1970
+    times = years.astype('datetime64[Y]').astype('datetime64[us]') + \
+        (lib.parse_digits(clocks[:, 0:3]) - 1).astype('timedelta64[D]') + \
+        lib.parse_clock(clocks[:, 4:])
+    columns = fields[:, 3:].astype(np.float64)
+
+    stream = Stream()
+    codes = fields[:, 0]
+    for station_code in sorted(set(codes.tolist())):
+        selected = codes == station_code
+        stream += lib.build_stream(times[selected], columns[selected], COMPONENTS, NULL_VALUE, {
+            'network': network,
+            'station': station_code.decode('ascii'),
+            'location': location
+        })
+    return stream
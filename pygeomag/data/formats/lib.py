@@ -1,12 +1,20 @@
 '''
 :author: Charles Blais
 '''
-from pkg_resources import resource_filename
+import itertools
 
 # Third-party library
-from obspy import Trace
+from obspy import Trace, UTCDateTime
+from obspy.core.compatibility import round_away
 import numpy as np
 
+# User-contributed library
+from pygeomag.data.stream import Stream
+
+# constants
+# default length in seconds of the windows formatted and written at once
+CHUNK_SECONDS = 3600
+
 
 def is_common_traces(stream, stats_matches=None):
     '''
@@ -30,29 +38,37 @@ def is_common_traces(stream, stats_matches=None):
     if stats_matches is None:
         stats_matches = ['network', 'station']
 
-    prev_match = {}
+    # compare the tuple of attributes of each trace to the first one
+    first = None
     for trace in stream:
-        for stats_match in stats_matches:
-            if stats_match not in prev_match:
-                prev_match[stats_match] = getattr(trace.stats, stats_match)
-            else:
-                if prev_match[stats_match] != getattr(trace.stats, stats_match):
-                    return False
+        stats = trace.stats
+        values = tuple([stats[stats_match] for stats_match in stats_matches])
+        if first is None:
+            first = values
+        elif values != first:
+            return False
     return True
 
 
 def order_stream(stream, components=['X', 'Y', 'Z', 'F']):
     '''
     Order all traces in the stream by the orientation
+
+    The traces are grouped by component in a single pass of the stream.
     '''
     from obspy import Stream
 
     if len(stream) == 0:
         raise ValueError("We cannot reorder the components of an empty stream object")
 
+    # the component is the last character of the channel
+    by_component = {}
+    for trace in stream:
+        by_component.setdefault(trace.stats.channel[-1:].upper(), []).append(trace)
+
     nstream = Stream()
     for component in components:
-        tstream = stream.select(component=component)
+        tstream = by_component.get(component.upper(), [])
         if not tstream:
             # Copy the header of another trace and change the component
             # The following assumes the channel is always three characters
@@ -63,5 +79,636 @@ def order_stream(stream, components=['X', 'Y', 'Z', 'F']):
         elif len(tstream) != 1:
             raise ValueError("The obspy Stream can not have mutliple identical components.  Recommend merging by component.")
         else:
-            nstream += tstream
+            nstream.append(tstream[0])
     return nstream
+
+
+def get_offset(trace, starttime):
+    '''
+    Get the offset (in samples) of the first sample of the trace from starttime
+
+    The offset is rounded to the nearest sample exactly like a trim with padding.
+
+    :type trace: :class:`obspy.Trace`
+    :param trace: trace of data
+
+    :type starttime: :class:`obspy.UTCDateTime`
+    :param starttime: reference time
+
+    :return: int
+    '''
+    sampling_rate = trace.stats.sampling_rate
+    delta = round_away((starttime - trace.stats.starttime) * sampling_rate)
+    if delta < 0:
+        # like obspy, round from a reference left of starttime
+        npts = abs(delta) + 10
+        delta = round_away((starttime - (trace.stats.starttime - npts / float(sampling_rate))) * sampling_rate) - npts
+    return -int(delta)
+
+
+def get_trim_offsets(stream, starttime, endtime):
+    '''
+    Get the offsets of the traces and the number of samples of the stream trimmed
+    with padding from starttime to endtime, without trimming (copying) the data.
+
+    Like :meth:`obspy.Stream.trim`, the starttime and endtime are first moved to
+    the nearest sample of the first trace.
+
+    :type stream: :class:`obspy.Stream`
+    :param stream: Stream of data
+
+    :type starttime: :class:`obspy.UTCDateTime`
+    :param starttime: start of the trim
+
+    :type endtime: :class:`obspy.UTCDateTime`
+    :param endtime: end of the trim
+
+    :return: list of offsets (see :func:`get_offset`) and number of samples of
+        the first trace
+    '''
+    stats = stream[0].stats
+    starttime = stats.starttime + round_away((starttime - stats.starttime) * stats.sampling_rate) * stats.delta
+    endtime = stats.endtime + round_away((endtime - stats.endtime) * stats.sampling_rate) * stats.delta
+    offsets = [get_offset(trace, starttime) for trace in stream]
+    first = stats.starttime - offsets[0] * stats.delta
+    return offsets, max(int(round_away((endtime - first) * stats.sampling_rate)) + 1, 0)
+
+
+def get_window_size(sampling_rate, chunk_seconds=None):
+    '''
+    Get the number of samples in a window of chunk_seconds
+
+    :type sampling_rate: float
+    :param sampling_rate: sampling rate of the samples
+
+    :type chunk_seconds: float
+    :param chunk_seconds: length of the window (default: CHUNK_SECONDS)
+
+    :return: int
+    '''
+    if chunk_seconds is None:
+        chunk_seconds = CHUNK_SECONDS
+    return max(int(round(chunk_seconds * sampling_rate)), 1)
+
+
+def get_matrix(stream, starttime, endtime, null_value):
+    '''
+    Get the samples of the traces from starttime to endtime as a single
+    contiguous matrix with a column per trace (e.g. XYZF)
+
+    Each trace is aligned on the time axis by its offset (see :func:`get_trim_offsets`)
+    like a trim with padding.  Gaps and masked samples are filled with the null
+    value.  This way, row 0...x of the matrix are the same time in all traces and
+    the traces are copied once.
+
+    :type stream: :class:`obspy.Stream`
+    :param stream: Stream of data ordered by component (see :func:`order_stream`)
+
+    :type starttime: :class:`obspy.UTCDateTime`
+    :param starttime: time of the first row
+
+    :type endtime: :class:`obspy.UTCDateTime`
+    :param endtime: time of the last row
+
+    :type null_value: float
+    :param null_value: value representing missing samples
+
+    :return: :class:`numpy.ndarray` of float64 with shape (npts, len(stream)),
+        the time of the first row and the sampling interval
+    '''
+    offsets, npts = get_trim_offsets(stream, starttime, endtime)
+    return _fill_matrix(stream, offsets, 0, npts, null_value), starttime, stream[0].stats.delta
+
+
+def iter_windows(stream, starttime, endtime, null_value, window_size):
+    '''
+    Walk the rows of the matrix of the traces from starttime to endtime (see
+    :func:`get_matrix`) in windows of window_size rows
+
+    Only the matrix of a window is built at a time, the memory is bounded by
+    the window whatever the time span.
+
+    :type stream: :class:`obspy.Stream`
+    :param stream: Stream of data ordered by component (see :func:`order_stream`)
+
+    :type starttime: :class:`obspy.UTCDateTime`
+    :param starttime: time of the first row
+
+    :type endtime: :class:`obspy.UTCDateTime`
+    :param endtime: time of the last row
+
+    :type null_value: float
+    :param null_value: value representing missing samples
+
+    :type window_size: int
+    :param window_size: number of rows per window
+
+    :return: generator of (start, matrix) where start is the offset of the
+        first row of the window from starttime
+    '''
+    offsets, npts = get_trim_offsets(stream, starttime, endtime)
+    for start in range(0, npts, window_size):
+        yield start, _fill_matrix(stream, offsets, start, min(start + window_size, npts), null_value)
+
+
+def _fill_matrix(stream, offsets, start, stop, null_value):
+    '''
+    Build the rows start to stop of the matrix of the traces aligned by their
+    offsets (see get_matrix)
+    '''
+    matrix = np.full((stop - start, len(stream)), null_value, dtype=np.float64)
+    for column, (trace, offset) in enumerate(zip(stream, offsets)):
+        extract = trace.data[max(start - offset, 0):max(stop - offset, 0)]
+        position = max(offset - start, 0)
+        matrix[position:position + len(extract), column] = np.ma.filled(extract, null_value)
+    return matrix
+
+
+def iter_rows(matrix, window_size):
+    '''
+    Walk the rows of a matrix in windows of window_size rows
+
+    :type matrix: :class:`numpy.ndarray`
+    :param matrix: matrix of the samples (see :func:`get_matrix`)
+
+    :type window_size: int
+    :param window_size: number of rows per window
+
+    :return: generator of (start, rows) where start is the offset of the
+        first row and rows a view of the window
+    '''
+    for start in range(0, len(matrix), window_size):
+        yield start, matrix[start:start + window_size]
+
+
+def get_times(starttime, sampling_rate, npts, offset=0):
+    '''
+    Get the timestamp of every sample of a trace as a numpy datetime64 array
+
+    The timestamps are computed exactly like ``starttime + offset/sampling_rate``
+    with :class:`obspy.UTCDateTime` (nanosecond offsets rounded to the microsecond)
+    so that the formatted strings match the per-sample representation.
+
+    :type starttime: :class:`obspy.UTCDateTime`
+    :param starttime: time of the first sample
+
+    :type sampling_rate: float
+    :param sampling_rate: sampling rate of the samples
+
+    :type npts: int
+    :param npts: number of samples
+
+    :type offset: int
+    :param offset: offset of the first sample from starttime (in samples)
+
+    :return: :class:`numpy.ndarray` of datetime64[us]
+    '''
+    offsets = np.round(np.arange(offset, offset + npts) / sampling_rate * 1e9).astype(np.int64)
+    quotient, remainder = np.divmod(starttime.ns + offsets, 1000)
+    # round half to even like UTCDateTime does when converting to datetime
+    quotient += (remainder > 500) | ((remainder == 500) & (quotient % 2 == 1))
+    return quotient.astype('datetime64[us]')
+
+
+def get_values(data, null_value):
+    '''
+    Get the values of a trace where missing samples (masked, NaN, zero or
+    above the null value) are replaced by the null value
+
+    :type data: :class:`numpy.ndarray`
+    :param data: trace data
+
+    :type null_value: float
+    :param null_value: value representing missing samples
+    '''
+    data = np.ma.filled(data, null_value)
+    return np.where((data != 0) & (data < null_value), data, null_value)
+
+
+def format_rows(row_format, columns):
+    '''
+    Format rows with a printf-style format, a value from each column is
+    used for each row.
+
+    :type row_format: str
+    :param row_format: printf-style format of a single row
+
+    :type columns: list
+    :param columns: list of :class:`numpy.ndarray` of identical length
+
+    :return: str
+    '''
+    npts = len(columns[0]) if columns else 0
+    values = zip(*[column.tolist() for column in columns])
+    return (row_format * npts) % tuple(itertools.chain.from_iterable(values))
+
+
+def as_strings(chars):
+    '''
+    Convert a character matrix to an array of str (one per row)
+
+    :type chars: :class:`numpy.ndarray`
+    :param chars: uint8 character matrix
+
+    :return: :class:`numpy.ndarray` of str
+    '''
+    chars = np.ascontiguousarray(chars)
+    return chars.view('S%d' % chars.shape[1]).ravel().astype(str)
+
+
+def format_days(times, day_format):
+    '''
+    Format the day of each timestamp into a character matrix
+
+    Only the days between the first and last timestamp are formatted by python
+    (strftime), they are then repeated for each timestamp.
+
+    :type times: :class:`numpy.ndarray`
+    :param times: datetime64 array
+
+    :type day_format: str
+    :param day_format: strftime format with fixed width day codes only (%Y, %m, %d, %j)
+
+    :return: :class:`numpy.ndarray` of uint8 with shape (len(times), width)
+    '''
+    days = times.astype('datetime64[D]').astype(np.int64)
+    if not len(days):
+        return np.empty((0, 0), dtype=np.uint8)
+    first = days.min()
+    formatted = [
+        np.datetime64(day, 'D').item().strftime(day_format).encode('ascii')
+        for day in range(first, days.max() + 1)
+    ]
+    width = len(formatted[0])
+    return np.frombuffer(b''.join(formatted), dtype=np.uint8).reshape(-1, width)[days - first]
+
+
+def format_clock(times, precision=0):
+    '''
+    Format the time of day of each timestamp into a character matrix
+    in the form HH:MM:SS with optional (truncated) decimals of the second
+
+    :type times: :class:`numpy.ndarray`
+    :param times: datetime64 array
+
+    :type precision: int
+    :param precision: number of decimals of the second (0 to 6)
+
+    :return: :class:`numpy.ndarray` of uint8 with shape (len(times), width)
+    '''
+    microseconds = times.astype('datetime64[us]').astype(np.int64) % 86400000000
+    seconds, microseconds = np.divmod(microseconds, 1000000)
+    columns = [
+        format_digits(seconds // 3600, 2), b':',
+        format_digits(seconds // 60 % 60, 2), b':',
+        format_digits(seconds % 60, 2)
+    ]
+    if precision:
+        columns.extend([b'.', format_digits(microseconds // 10**(6 - precision), precision)])
+    return join_chars(columns)
+
+
+def format_digits(values, width):
+    '''
+    Format positive integers as zero padded digits (%0{width}d) into a character matrix
+
+    :type values: :class:`numpy.ndarray`
+    :param values: positive integers smaller than 10**width
+
+    :type width: int
+    :param width: number of digits
+
+    :return: :class:`numpy.ndarray` of uint8 with shape (len(values), width)
+    '''
+    # digits are computed in rows (contiguous) and transposed at the end
+    chars = np.empty((width, len(values)), dtype=np.uint8)
+    remaining = np.asarray(values)
+    for position in range(width - 1, -1, -1):
+        quotient = remaining // 10
+        chars[position] = remaining - quotient * 10 + ord('0')
+        remaining = quotient
+    return chars.T
+
+
+def format_fixed(values, width, precision, fill=' '):
+    '''
+    Format values as %{width}.{precision}f into a character matrix
+
+    The digits are computed with integer arithmetic for all the values at once.
+    The few values where the scaled value lands on a rounding tie are formatted
+    by python to keep the exact same rounding.
+
+    :type values: :class:`numpy.ndarray`
+    :param values: values to format
+
+    :type width: int
+    :param width: width of the formatted values
+
+    :type precision: int
+    :param precision: number of decimals
+
+    :type fill: str
+    :param fill: character padding the values to the width, a fill character
+        absent from the format can be removed afterward for unpadded values
+
+    :return: :class:`numpy.ndarray` of uint8 with shape (len(values), width) or
+        None if some values do not fit the width
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    scaled = values * 10**precision
+    if not np.isfinite(scaled).all():
+        return None
+    rounded = np.rint(scaled)
+    # Rounding ties are decided by the exact binary value, not by the product
+    ambiguous = np.flatnonzero(np.abs(np.abs(scaled - rounded) - 0.5) < 1e-6)
+    remaining = np.abs(rounded)
+    # integer divisions are much faster on 32 bits
+    remaining = remaining.astype(np.uint32 if remaining.max(initial=0) < 2**32 else np.int64)
+
+    # digits are computed in rows (contiguous) and transposed at the end
+    chars = np.empty((width, len(values)), dtype=np.uint8)
+    position = width - 1
+    if precision:
+        if position - precision < 1:
+            return None
+        quotient = remaining // 10**precision
+        chars[position - precision + 1:] = format_digits(remaining - quotient * 10**precision, precision).T
+        remaining = quotient
+        position -= precision
+        chars[position] = ord('.')
+        position -= 1
+    # There is always a digit before the decimal point, the others are padded
+    quotient = remaining // 10
+    chars[position] = remaining - quotient * 10 + ord('0')
+    remaining = quotient
+    sign = np.full(len(values), position - 1)
+    for position in range(position - 1, -1, -1):
+        present = remaining > 0
+        quotient = remaining // 10
+        chars[position] = np.where(present, remaining - quotient * 10 + ord('0'), ord(fill))
+        remaining = quotient
+        sign -= present
+    negative = np.flatnonzero(np.signbit(values))
+    if remaining.any() or (sign[negative] < 0).any():
+        return None
+    chars[sign[negative], negative] = ord('-')
+
+    chars = chars.T
+    for idx in ambiguous:
+        formatted = ('%.*f' % (precision, values[idx])).rjust(width, fill).encode('ascii')
+        if len(formatted) != width:
+            return None
+        chars[idx] = np.frombuffer(formatted, dtype=np.uint8)
+    return chars
+
+
+def join_chars(columns):
+    '''
+    Join character matrices and constant separators into rows of text
+
+    :type columns: list
+    :param columns: list of bytes (repeated on each row) or character matrices
+
+    :return: :class:`numpy.ndarray` of uint8 with shape (rows, width)
+    '''
+    npts = max([len(column) for column in columns if isinstance(column, np.ndarray)])
+    widths = [len(column) if isinstance(column, bytes) else column.shape[1] for column in columns]
+    rows = np.empty((npts, sum(widths)), dtype=np.uint8)
+    position = 0
+    for column, width in zip(columns, widths):
+        if isinstance(column, bytes):
+            column = np.frombuffer(column, dtype=np.uint8)
+        rows[:, position:position + width] = column
+        position += width
+    return rows
+
+
+def read_content(filename):
+    '''
+    Read the content of a file or resource as bytes
+
+    :type filename: str or resource
+    :param filename: filename or resource with a read method
+
+    :return: bytes
+    '''
+    if not hasattr(filename, "read"):
+        with open(filename, "rb") as resource:
+            return resource.read()
+    content = filename.read()
+    return content.encode('ascii') if isinstance(content, str) else content
+
+
+def as_chars(strings):
+    '''
+    Convert an array of bytes to a character matrix, shorter strings are
+    padded with NUL characters
+
+    :type strings: :class:`numpy.ndarray`
+    :param strings: array of bytes (dtype S)
+
+    :return: :class:`numpy.ndarray` of uint8 with shape (len(strings), width)
+    '''
+    width = np.char.str_len(strings).max() if len(strings) else 0
+    strings = np.ascontiguousarray(strings, dtype='S%d' % max(width, 1))
+    return strings.view(np.uint8).reshape(len(strings), strings.dtype.itemsize)
+
+
+def parse_digits(chars):
+    '''
+    Parse the digits of a character matrix as positive integers (inverse of format_digits)
+
+    :type chars: :class:`numpy.ndarray`
+    :param chars: uint8 character matrix of digits only
+
+    :return: :class:`numpy.ndarray` of int64
+    '''
+    values = np.zeros(len(chars), dtype=np.int64)
+    # digits are parsed in rows (contiguous) of the transposed matrix
+    for column in np.ascontiguousarray(chars.T):
+        digits = column - np.uint8(ord('0'))
+        if (digits > 9).any():
+            raise ValueError("Invalid digits in fixed width column")
+        values *= 10
+        values += digits
+    return values
+
+
+def split_rows(content, offset=0):
+    '''
+    Split the lines of a fixed width body into a character matrix
+
+    The matrix is a view of the content (e.g. a memory-mapped file), no line
+    is copied.
+
+    :type content: bytes or :class:`mmap.mmap`
+    :param content: lines of text
+
+    :type offset: int
+    :param offset: position of the first line in the content
+
+    :return: :class:`numpy.ndarray` of uint8 with shape (lines, width) including
+        the line terminator or None if the lines are not of identical width
+    '''
+    if len(content) <= offset:
+        return np.empty((0, 0), dtype=np.uint8)
+    if content[-1:] != b'\n':
+        # the last line is not terminated, the content is copied
+        content = bytes(content[offset:]) + b'\n'
+        offset = 0
+    width = content.find(b'\n', offset) + 1 - offset
+    if (len(content) - offset) % width:
+        return None
+    rows = np.frombuffer(content, dtype=np.uint8, offset=offset).reshape(-1, width)
+    if (rows[:, -1] != ord('\n')).any():
+        return None
+    return rows
+
+
+def parse_date(chars):
+    '''
+    Parse dates in the form YYYY-MM-DD
+
+    :type chars: :class:`numpy.ndarray`
+    :param chars: uint8 character matrix
+
+    :return: :class:`numpy.ndarray` of datetime64[D]
+    '''
+    if chars.shape[1] != 10 or (chars[:, [4, 7]] != ord('-')).any():
+        raise ValueError("Invalid date, expected YYYY-MM-DD")
+    months = (parse_digits(chars[:, 0:4]) - 1970) * 12 + parse_digits(chars[:, 5:7]) - 1
+    return months.astype('datetime64[M]').astype('datetime64[D]') + \
+        (parse_digits(chars[:, 8:10]) - 1).astype('timedelta64[D]')
+
+
+def parse_clock(chars):
+    '''
+    Parse times of day in the form HH:MM:SS with optional decimals of the
+    second (inverse of format_clock)
+
+    :type chars: :class:`numpy.ndarray`
+    :param chars: uint8 character matrix
+
+    :return: :class:`numpy.ndarray` of timedelta64[us] of the day
+    '''
+    if chars.shape[1] < 8 or (chars[:, [2, 5]] != ord(':')).any():
+        raise ValueError("Invalid time of day, expected HH:MM:SS")
+    seconds = (parse_digits(chars[:, 0:2]) * 60 + parse_digits(chars[:, 3:5])) * 60 + parse_digits(chars[:, 6:8])
+    microseconds = seconds * 1000000
+    decimals = chars[:, 9:15]
+    if decimals.shape[1]:
+        microseconds += parse_digits(decimals) * 10**(6 - decimals.shape[1])
+    return microseconds.astype('timedelta64[us]')
+
+
+def parse_fixed(chars):
+    '''
+    Parse right aligned decimal values of a fixed width column (inverse of format_fixed)
+
+    Values with the decimal point in the same column for all rows are parsed
+    with integer arithmetic, otherwise each value is converted by numpy.
+
+    :type chars: :class:`numpy.ndarray`
+    :param chars: uint8 character matrix
+
+    :return: :class:`numpy.ndarray` of float64
+    '''
+    # digits are parsed in rows (contiguous) of the transposed matrix
+    columns = np.ascontiguousarray(chars.T)
+    points = [idx for idx, column in enumerate(columns) if (column == ord('.')).all()]
+    integers = np.zeros(len(chars), dtype=np.int64)
+    negative = np.zeros(len(chars), dtype=bool)
+    invalid = np.zeros(len(chars), dtype=bool) if len(points) == 1 else np.ones(len(chars), dtype=bool)
+    found = np.zeros(len(chars), dtype=bool)
+    for idx, column in enumerate(columns):
+        if len(points) != 1 or idx == points[0]:
+            continue
+        digits = column - np.uint8(ord('0'))
+        isdigit = digits <= 9
+        # each digit is weighted by the number of digit columns on its right
+        integers += np.where(isdigit, digits, 0).astype(np.int64) * 10**(len(columns) - idx - 1 - (idx < points[0]))
+        negative |= column == ord('-')
+        invalid |= ~isdigit & (column != ord(' ')) & (column != ord('-')) & (column != ord('+'))
+        found |= isdigit
+    if invalid.any() or not found.all():
+        # irregular column, each value is converted
+        strings = np.char.strip(np.ascontiguousarray(chars).view('S%d' % chars.shape[1]).ravel())
+        return strings.astype(np.float64)
+    integers[negative] *= -1
+    return integers / 10.0**(len(columns) - points[0] - 1)
+
+
+def get_sampling_code(delta):
+    '''
+    Get the sampling code (first letter of the channel) of a sampling interval
+
+    :type delta: float
+    :param delta: sampling interval in seconds
+
+    :return: str (M, L or U)
+    '''
+    if delta < 1:
+        return 'M'
+    if delta < 60:
+        return 'L'
+    return 'U'
+
+
+def build_stream(times, columns, components, null_value, stats, delta=60.0):
+    '''
+    Build the traces of the columns of a body (inverse of get_matrix)
+
+    A trace is created for each component and each segment of regularly
+    sampled rows.  The samples at or above the null value (or not finite) are
+    masked.
+
+    :type times: :class:`numpy.ndarray`
+    :param times: datetime64[us] timestamps of the rows
+
+    :type columns: :class:`numpy.ndarray`
+    :param columns: values with a column per component
+
+    :type components: list
+    :param components: components of the columns (last letter of the channel)
+
+    :type null_value: float
+    :param null_value: value representing missing samples
+
+    :type stats: dict
+    :param stats: common stats of the traces (network, station, location, ...)
+
+    :type delta: float
+    :param delta: sampling interval in seconds if it can not be deduced (single row)
+
+    :return: :class:`pygeomag.data.stream.Stream`
+    '''
+    if not len(times):
+        return Stream()
+    times = times.astype('datetime64[us]').astype(np.int64)
+    steps = np.diff(times)
+    if len(steps):
+        # the sampling interval is the most common step between the rows
+        values, counts = np.unique(steps, return_counts=True)
+        delta = values[counts.argmax()]
+    else:
+        delta = int(round(delta * 1e6))
+    if delta <= 0:
+        raise ValueError("The rows are not in increasing time")
+    breaks = np.flatnonzero(steps != delta) + 1
+
+    stream = Stream()
+    channel = get_sampling_code(delta / 1e6) + 'F'
+    for start, stop in zip(np.concatenate([[0], breaks]), np.concatenate([breaks, [len(times)]])):
+        for component, data in zip(components, columns[start:stop].T):
+            data = np.ascontiguousarray(data)
+            missing = ~(data < null_value)
+            header = dict(stats)
+            header.update({
+                'channel': channel + component,
+                'starttime': UTCDateTime(ns=int(times[start]) * 1000),
+                'delta': delta / 1e6,
+            })
+            stream.append(Trace(
+                data=np.ma.masked_array(data, mask=missing) if missing.any() else data,
+                header=header))
+    return stream
@@ -2,7 +2,7 @@
 Magnetic data stream
 ====================
 
-Wrapper for an obspy stream that handles writing in geomagnetic formats.
+Wrapper for an obspy stream that handles reading and writing in geomagnetic formats.
 
 Supported formats are listed in the formats directors.  These include:
 
@@ -15,14 +15,44 @@ Supported formats are listed in the formats directors.  These include:
 
 import os
 import copy
+import fnmatch
+import logging
 import importlib
+
+import numpy as np
 from obspy import Stream as ObspyStream
+from obspy.core.util import AttribDict
+from obspy import Trace
+from obspy import read as obspy_read
+
+# constants
+# fraction of the sampling interval tolerated between the samples of merged traces
+MISALIGNMENT_THRESHOLD = 1e-2
 
 
 class Stream(ObspyStream):
     '''
     Overwrite Stream write routine to add additional formats
     '''
+    @classmethod
+    def read(cls, filename, **kwargs):
+        '''
+        Read a geomagnetic format file into a stream
+
+        See read routine of formats for list of keywords.
+        All read routines take the filename and keyword and return a stream.
+
+        The missing samples (null values of the format) are masked.
+        Other formats are read by obspy.
+        '''
+        try:
+            read_format = importlib.import_module(
+                'pygeomag.data.formats.%s' % kwargs.get('format', 'iaga2002').lower()
+            )
+        except ImportError:
+            return cls(obspy_read(filename, **kwargs))
+        return read_format.read(filename, **kwargs)
+
     def write(self, filename, **kwargs):
         '''
         Write information from geomag database to geomag specified format
@@ -30,6 +60,11 @@ class Stream(ObspyStream):
         See write routine of formats for list of keywords.
         All write routines take this object as first argument and then
         the filename and keyword.
+
+        The geomagnetic formats write the data in windows of ``chunk_seconds``
+        (default: one hour) walking the time axis of the traces, only a
+        window of padded data is copied at any time (the daily IMFV1.22 body
+        is copied at once).
         '''
         try:
             write_format = importlib.import_module(
@@ -37,35 +72,283 @@ class Stream(ObspyStream):
             )
             return write_format.write(self, filename, **kwargs)
         except ImportError:
-            super(Stream, self).write(self, filename, **kwargs)
+            return super(Stream, self).write(filename, **kwargs)
+
+    def group_by(self, keys):
+        '''
+        Partition the traces in a single pass by the values of stats attributes
+
+        The traces are not copied, the sub-streams hold the same traces.
+
+        :type keys: list
+        :param keys: stats attributes (e.g. ['network', 'station'])
 
-    def merge_by_location(self, locations=None, replace_location=''):
+        :return: dict of :class:`Stream` by tuple of the values of the keys,
+            the traces keep the order of the stream
         '''
-        We reorder the traces in the stream by renaming the location code
-        with a numeric value and then merging the streams.
+        groups = {}
+        for trace in self:
+            stats = trace.stats
+            key = tuple([stats[key] for key in keys])
+            if key not in groups:
+                groups[key] = Stream()
+            groups[key].traces.append(trace)
+        return groups
 
-        The trace with the ascending name result be taken last in the merge.
-        Obspy merge=1 will take the last trace in the stream as the final result.
+    def merge_by_location(self, locations=None, replace_location='', fill=False):
+        '''
+        We reorder the traces in the stream by the priority of their location
+        code and then merge the traces of each channel with the location code
+        replaced.
+
+        The merge follows obspy merge=1: the traces are taken by starttime
+        (then endtime and priority), a trace overlapping the end of the
+        previous ones overwrites them while a contained trace only fills
+        their masked samples.
 
         Not specifying the location results in a merging by ascending location
-        code.
+        code.  Otherwise, only the traces of the locations (or wildcards) are
+        merged with the priority of their order.
+
+        The traces of a channel are overlaid on an aligned array, the data of
+        channels with a single trace is not copied.  Traces that can not be
+        aligned (sampling rate, data type or misaligned samples) are merged
+        by obspy.
+
+        With ``fill``, the samples of the traces are instead taken by priority
+        sample by sample: the masked (or NaN) samples of a location are filled
+        by the lower priority locations.  The location supplying each sample
+        is kept in ``stats.provenance``: the ``locations`` codes and the
+        ``samples`` index (int8) in these codes from ``starttime``, -1 for
+        missing samples.  The samples are not trimmed with the trace, see
+        :func:`get_provenance` for the samples of a trimmed (or sliced) trace.
+
+        :type fill: bool
+        :param fill: fill the missing samples from the lower priority locations
         '''
-        if locations is not None:
-            # if we specify location codes to order, we extract them
-            # and rename them
-            new_stream = Stream()
-            for idx in range(len(locations)):
-                temp_stream = self.select(location=locations[idx])
-                for trace in temp_stream:
-                    trace.stats.location = "%02d" % idx
-                new_stream += temp_stream
+        if locations is None:
+            locations = sorted(set([trace.stats.location for trace in self]))
+
+        # group the traces of each channel with the priority of their location
+        groups = {}
+        for idx, trace in enumerate(self):
+            priority = next((
+                rank for rank, location in enumerate(locations)
+                if fnmatch.fnmatch(trace.stats.location.upper(), location.upper())
+            ), None)
+            if priority is None or not trace.stats.npts:
+                continue
+            key = (trace.stats.network, trace.stats.station, trace.stats.channel)
+            groups.setdefault(key, []).append((priority, idx, trace))
+
+        new_stream = Stream()
+        for key in sorted(groups):
+            traces = [trace for _, _, trace in sorted(groups[key], key=lambda item: item[:2])]
+            if fill:
+                new_stream.extend(_merge_fill(traces, replace_location))
+            elif len(traces) == 1:
+                new_stream.append(_relabel(traces[0], traces[0].data, replace_location))
+            else:
+                new_stream.extend(_merge_overlay(traces, replace_location))
+        return new_stream
+
+
+def _merge_overlay(traces, replace_location):
+    '''
+    Merge the traces of a channel ordered by priority like obspy merge=1
+
+    The traces are aligned as segments (offset, values, missing samples,
+    masked array) on the samples of the first trace.  Like obspy, the
+    segments are first cleaned up (adjacent segments and segments with
+    identical overlaps are joined) and then overlaid.
+
+    :return: list of :class:`obspy.Trace`
+    '''
+    # order of the obspy merge (stable for the priority)
+    traces = sorted(traces, key=lambda trace: (trace.stats.starttime, trace.stats.endtime))
+    first = traces[0]
+    segments = []
+    for trace in traces:
+        offset = (trace.stats.starttime - first.stats.starttime) * first.stats.sampling_rate
+        if trace.stats.sampling_rate != first.stats.sampling_rate or \
+                trace.data.dtype != first.data.dtype or \
+                trace.stats.calib != first.stats.calib or \
+                abs(offset - round(offset)) > MISALIGNMENT_THRESHOLD:
+            return _merge_obspy(traces, replace_location)
+        segments.append((
+            int(round(offset)), np.ma.getdata(trace.data), np.ma.getmaskarray(trace.data),
+            isinstance(trace.data, np.ma.MaskedArray)))
+
+    segments = sorted(_cleanup_segments(segments), key=lambda segment: (segment[0], segment[0] + len(segment[1])))
+    npts = max([segment[0] + len(segment[1]) for segment in segments])
+    data = np.empty(npts, dtype=first.data.dtype)
+    # samples not covered by any trace are masked
+    mask = np.ones(npts, dtype=bool)
+    end = 0
+    for offset, values, missing, masked in segments:
+        window = slice(offset, offset + len(values))
+        if window.stop > end:
+            # gap, adjacent or overlapping the end, the segment overwrites
+            data[window] = values
+            mask[window] = missing
+            end = window.stop
         else:
-            new_stream = self.copy()
-
-        # Reorder in reverse order (but will result in a ascending merge with
-        # method 1).
-        new_stream.sort(keys=['location'])
-        # Erase the location code from all the streams
-        for trace in new_stream:
-            trace.stats.location = replace_location
-        return new_stream.merge(method=1)
+            # contained segment, its samples only fill the masked samples if
+            # all the other samples are the same
+            _fill_contained(data[window], mask[window], values, missing, masked or mask[:end].any())
+    if mask.any():
+        data = np.ma.masked_array(data, mask=mask)
+    return [_relabel(first, data, replace_location)]
+
+
+def _fill_contained(data, mask, values, missing, masked):
+    '''
+    Fill (in place) the masked samples of the data with the values of a
+    contained segment if all the valid samples are the same
+
+    Like obspy, invalid values (NaN) are then masked when the comparison
+    involved masked arrays.
+    '''
+    valid = ~mask & ~missing
+    if not (data[valid] == values[valid]).all():
+        return
+    if masked:
+        fill = mask & ~missing
+        data[fill] = values[fill]
+        mask &= missing
+        if data.dtype.kind == 'f':
+            mask |= np.isnan(data)
+
+
+def _merge_fill(traces, replace_location):
+    '''
+    Merge the traces of a channel ordered by priority sample by sample
+
+    Each sample is taken from the first trace with a valid (not masked and
+    not NaN) sample.
+
+    :return: list of :class:`obspy.Trace`
+    '''
+    first = min(traces, key=lambda trace: trace.stats.starttime)
+    locations = []
+    windows = []
+    for trace in traces:
+        offset = (trace.stats.starttime - first.stats.starttime) * first.stats.sampling_rate
+        if trace.stats.sampling_rate != first.stats.sampling_rate or \
+                trace.stats.calib != first.stats.calib or \
+                abs(offset - round(offset)) > MISALIGNMENT_THRESHOLD:
+            logging.warning("Unable to align the traces of %s, merging without filling", first.id)
+            return _merge_obspy(traces, replace_location)
+        if trace.stats.location not in locations:
+            locations.append(trace.stats.location)
+        windows.append(slice(int(round(offset)), int(round(offset)) + trace.stats.npts))
+
+    npts = max([window.stop for window in windows])
+    data = np.zeros(npts, dtype=np.result_type(*[trace.data.dtype for trace in traces]))
+    samples = np.full(npts, -1, dtype=np.int8)
+    for trace, window in zip(traces, windows):
+        values = np.ma.getdata(trace.data)
+        selected = (samples[window] < 0) & ~np.ma.getmaskarray(trace.data)
+        if values.dtype.kind == 'f':
+            selected &= ~np.isnan(values)
+        data[window][selected] = values[selected]
+        samples[window][selected] = locations.index(trace.stats.location)
+        if (samples >= 0).all():
+            break
+    if (samples < 0).any():
+        data = np.ma.masked_array(data, mask=samples < 0)
+    new_trace = _relabel(first, data, replace_location)
+    new_trace.stats.provenance = AttribDict({
+        'locations': locations, 'samples': samples, 'starttime': new_trace.stats.starttime})
+    return [new_trace]
+
+
+def get_provenance(trace):
+    '''
+    Get the provenance of the samples of a trace merged with fill (see
+    :meth:`Stream.merge_by_location`)
+
+    The provenance is aligned on the samples of the trace from its offset to
+    the starttime of the merge, a trace trimmed (or sliced) after the merge
+    keeps the provenance of its remaining samples.  The samples padded by
+    a trim are missing (-1).
+
+    :type trace: :class:`obspy.Trace`
+    :param trace: merged trace
+
+    :return: :class:`numpy.ndarray` of int8 with the index of the location
+        (in ``stats.provenance.locations``) of each sample or None if the trace
+        has no provenance
+    '''
+    provenance = trace.stats.get('provenance')
+    if provenance is None:
+        return None
+    offset = int(round((trace.stats.starttime - provenance.starttime) * trace.stats.sampling_rate))
+    samples = np.full(trace.stats.npts, -1, dtype=np.int8)
+    start = max(offset, 0)
+    stop = min(offset + trace.stats.npts, len(provenance.samples))
+    if stop > start:
+        samples[start - offset:stop - offset] = provenance.samples[start:stop]
+    return samples
+
+
+def _cleanup_segments(segments):
+    '''
+    Join the adjacent segments and the segments with identical overlaps
+    (see obspy Stream._cleanup), the segments are sorted by starttime.
+
+    :return: list of segments (offset, values, missing samples, masked array)
+    '''
+    cleaned = []
+    current = segments[0]
+    for segment in segments[1:]:
+        offset, values, missing, masked = current
+        end = offset + len(values)
+        start = segment[0]
+        stop = min(end, start + len(segment[1]))
+        if start < end and np.array_equal(values[start - offset:stop - offset], segment[1][:stop - start]):
+            if start + len(segment[1]) > end:
+                # an overlap without any valid sample to compare is masked
+                overlap = missing[start - offset:] | segment[2][:stop - start]
+                missing = np.concatenate([
+                    missing[:start - offset], overlap.all() | segment[2][:stop - start],
+                    segment[2][stop - start:]])
+                values = np.concatenate([values[:start - offset], segment[1]])
+            else:
+                values = values.copy()
+                missing = missing.copy()
+                _fill_contained(
+                    values[start - offset:stop - offset], missing[start - offset:stop - offset],
+                    segment[1], segment[2], masked or segment[3])
+        elif start == end:
+            values = np.concatenate([values, segment[1]])
+            missing = np.concatenate([missing, segment[2]])
+        else:
+            cleaned.append(current)
+            current = segment
+            continue
+        # obspy keeps a masked array only if samples are masked
+        current = (offset, values, missing, missing.any())
+    cleaned.append(current)
+    return cleaned
+
+
+def _merge_obspy(traces, replace_location):
+    '''
+    Merge the traces of a channel ordered by priority with obspy merge=1
+    '''
+    stream = ObspyStream([trace.copy() for trace in traces])
+    for trace in stream:
+        trace.stats.location = replace_location
+    return stream.merge(method=1).traces
+
+
+def _relabel(trace, data, replace_location):
+    '''
+    Create a trace with the stats of the trace and the location code replaced
+    (the data is not copied)
+    '''
+    stats = trace.stats.copy()
+    stats.location = replace_location
+    stats.npts = len(data)
+    return Trace(data=data, header=stats)
@@ -0,0 +1,172 @@
+'''
+Metrics
+=======
+
+Instrumentation of the stages of the command-line pipeline.
+
+The wall time of each stage (e.g. the waveform fetch, the merge or the
+format write) and counters (bytes downloaded, traces, samples and rows
+written) of a run are written as a machine-readable summary:
+
+- json: a JSON line per run appended to the file
+- prometheus: a textfile for the textfile collector of the node exporter,
+  replaced at each run
+
+..  codeauthor:: Charles Blais
+'''
+import os
+import json
+import time
+import datetime
+import contextlib
+
+# constants
+FORMATS = ['json', 'prometheus']
+PREFIX = 'pygeomag'
+# description of the counters (prometheus HELP)
+COUNTERS = {
+    'bytes_downloaded': 'Bytes downloaded from the FDSN-WS',
+    'waveform_traces': 'Traces fetched',
+    'waveform_samples': 'Samples fetched',
+    'merged_traces': 'Traces after the merge by location',
+    'merged_samples': 'Samples after the merge by location',
+    'files_written': 'Files written',
+    'files_failed': 'Files that could not be written',
+    'rows_written': 'Rows of the files written',
+}
+
+
+class Metrics(object):
+    '''
+    Wall time of the stages and counters of a run
+    '''
+    def __init__(self, command, filename=None, metrics_format='json'):
+        '''
+        :type command: str
+        :param command: command of the run
+
+        :type filename: str
+        :param filename: file of the summary (default: not written)
+
+        :type metrics_format: str
+        :param metrics_format: format of the summary (json or prometheus)
+        '''
+        if metrics_format not in FORMATS:
+            raise ValueError("Unknown metrics format %s" % metrics_format)
+        self.command = command
+        self.filename = filename
+        self.metrics_format = metrics_format
+        self.starttime = time.time()
+        self._start = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+        self.error = None
+        self.written = False
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        '''
+        Time a stage, the time of a repeated stage is accumulated
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.) + time.perf_counter() - start
+
+    def add(self, name, value=1):
+        '''
+        Add to a counter
+        '''
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_stream(self, name, stream):
+        '''
+        Count the traces and samples of a stream (name_traces and name_samples)
+        '''
+        self.add('%s_traces' % name, len(stream))
+        self.add('%s_samples' % name, sum([trace.stats.npts for trace in stream]))
+
+    def get_summary(self):
+        '''
+        :return: dict of the run
+        '''
+        return {
+            'command': self.command,
+            'time': datetime.datetime.fromtimestamp(self.starttime, datetime.timezone.utc).isoformat(),
+            'seconds': time.perf_counter() - self._start,
+            'stages': dict(self.stages),
+            'counters': dict(self.counters),
+            'error': self.error,
+        }
+
+    def write(self):
+        '''
+        Write the summary of the run once (nothing without filename)
+        '''
+        if self.filename is None or self.written:
+            return
+        self.written = True
+        summary = self.get_summary()
+        if self.metrics_format == 'json':
+            with open(self.filename, 'a') as resource:
+                resource.write(json.dumps(summary, sort_keys=True) + '\n')
+            return
+        # the collector must never read a partial file
+        with open(self.filename + '.tmp', 'w') as resource:
+            resource.write(format_prometheus(summary, self.starttime))
+        os.replace(self.filename + '.tmp', self.filename)
+
+
+def format_prometheus(summary, timestamp):
+    '''
+    Format a summary in the prometheus text format (gauges of the last run)
+
+    :type summary: dict
+    :param summary: summary of a run (see :meth:`Metrics.get_summary`)
+
+    :type timestamp: float
+    :param timestamp: time of the run (unix)
+
+    :return: str
+    '''
+    labels = 'command="%s"' % summary['command']
+    metrics = [
+        ('run_timestamp_seconds', 'Time of the last run', [(labels, timestamp)]),
+        ('run_seconds', 'Wall time of the last run', [(labels, summary['seconds'])]),
+        ('run_error', 'Last run ended with an error', [(labels, int(summary['error'] is not None))]),
+        ('stage_seconds', 'Wall time of the stages of the last run', [
+            ('%s,stage="%s"' % (labels, name), seconds) for name, seconds in sorted(summary['stages'].items())]),
+    ]
+    metrics.extend([
+        (name, COUNTERS.get(name, name.replace('_', ' ').capitalize()), [(labels, value)])
+        for name, value in sorted(summary['counters'].items())
+    ])
+    lines = []
+    for name, description, samples in metrics:
+        if not samples:
+            continue
+        lines.extend([
+            '# HELP %s_%s %s' % (PREFIX, name, description),
+            '# TYPE %s_%s gauge' % (PREFIX, name),
+        ])
+        lines.extend(['%s_%s{%s} %r' % (PREFIX, name, sample, value) for sample, value in samples])
+    return '\n'.join(lines) + '\n'
+
+
+@contextlib.contextmanager
+def summary(command, filename=None, metrics_format='json'):
+    '''
+    Record the metrics of a run, the summary is written at the end of the
+    run (with the error if the run raised)
+
+    :return: :class:`Metrics`
+    '''
+    metrics = Metrics(command, filename, metrics_format)
+    try:
+        yield metrics
+    except BaseException as err:
+        metrics.error = type(err).__name__
+        raise
+    finally:
+        metrics.write()
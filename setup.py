@@ -179,6 +179,8 @@ setup(
         'console_scripts': [
             'fdsnws2geomag=pygeomag.command_line:fdsnws2geomag',
             'fdsnws2directory=pygeomag.command_line:fdsnws2directory',
+            'seedlink2directory=pygeomag.command_line:seedlink2directory',
+            'fdsnws2batch=pygeomag.command_line:fdsnws2batch',
         ],
     },
 
@@ -0,0 +1,185 @@
+'''
+Shared fixtures, a minimal FDSN-WS HTTP server and a stand-in SeedLink
+server serving the example data
+
+..  codeauthor:: Charles Blais
+'''
+import os
+import io
+import time
+import threading
+import fnmatch
+import socketserver
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Third-party library
+import pytest
+import numpy as np
+from obspy import read, Stream, Trace, UTCDateTime
+from obspy.core.inventory import Inventory, Network, Station
+
+
+STATIONS = ['OTT', 'SNK']
+
+
+class FDSNHandler(BaseHTTPRequestHandler):
+    '''
+    Minimal FDSN-WS serving the example data for the stations
+    '''
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        if url.path == '/fdsnws/station/1/query':
+            return self._send_inventory(query)
+        self._send_waveforms([(
+            query['network'], query['station'], query['location'], query['channel'],
+            query['starttime'], query['endtime'])])
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode()
+        self._send_waveforms([line.split() for line in body.splitlines() if '=' not in line])
+
+    def _send_waveforms(self, bulk):
+        self.server.requests.append(bulk)
+        if len(self.server.requests) <= self.server.failures:
+            self.send_response(self.server.failure_code)
+            self.end_headers()
+            return
+        stream = Stream()
+        for network, station, location, channel, starttime, endtime in bulk:
+            for trace in self.server.stream:
+                codes = [trace.stats.network, trace.stats.station, trace.stats.location, trace.stats.channel]
+                if all([_match(code, patterns) for code, patterns in zip(codes, [network, station, location, channel])]):
+                    extract = trace.slice(UTCDateTime(starttime), UTCDateTime(endtime))
+                    if extract.stats.npts:
+                        stream += extract
+        if not stream:
+            self.send_response(204)
+            self.end_headers()
+            return
+        buffer = io.BytesIO()
+        stream.write(buffer, format='MSEED')
+        self._send(buffer.getvalue(), 'application/vnd.fdsn.mseed')
+
+    def _send_inventory(self, query):
+        self.server.station_requests.append(query)
+        inventory = Inventory(networks=[Network('C2', stations=[
+            Station(code, 45., -75., 100.)
+            for code in STATIONS if fnmatch.fnmatch(code, query.get('station', '*'))
+        ])], source='test')
+        buffer = io.BytesIO()
+        inventory.write(buffer, format='STATIONXML')
+        self._send(buffer.getvalue(), 'application/xml')
+
+    def _send(self, content, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class SeedLinkHandler(socketserver.BaseRequestHandler):
+    '''
+    Stand-in SeedLink server (multi-station mode) replaying the example data
+    as 512 bytes records of the selected stations, the stream is terminated
+    by END once all records are sent.  The server pauses (server.pause
+    seconds) after the first record.
+    '''
+    capabilities = b'<?xml version="1.0"?><seedlink><capability name="multistation"/></seedlink>'
+
+    def handle(self):
+        stations = []
+        buffer = b''
+        while True:
+            data = self.request.recv(1024)
+            if not data:
+                return
+            buffer += data
+            while b'\r' in buffer:
+                command, buffer = buffer.split(b'\r', 1)
+                command = command.strip().decode()
+                verb = command.split(' ')[0].upper() if command else ''
+                if verb == 'HELLO':
+                    self.request.sendall(b'SeedLink v3.1 (stand-in)\r\npygeomag\r\n')
+                elif verb == 'STATION':
+                    stations.append(command.split()[1])
+                    self.request.sendall(b'OK\r\n')
+                elif verb in ['SELECT', 'DATA', 'FETCH', 'TIME']:
+                    self.request.sendall(b'OK\r\n')
+                elif verb == 'INFO':
+                    self._send_info(self.capabilities)
+                elif verb == 'END':
+                    return self._send_records(stations)
+                elif verb:
+                    self.request.sendall(b'ERROR\r\n')
+
+    def _send_info(self, content):
+        trace = Trace(data=np.frombuffer(content, dtype='|S1'))
+        trace.stats.station = 'INFO'
+        buffer = io.BytesIO()
+        trace.write(buffer, format='MSEED', encoding='ASCII', reclen=512)
+        self.request.sendall(b'SLINFO  ' + buffer.getvalue()[:512])
+
+    def _send_records(self, stations):
+        sequence = 0
+        for trace in self.server.stream:
+            if trace.stats.station not in stations:
+                continue
+            buffer = io.BytesIO()
+            trace.write(buffer, format='MSEED', reclen=512)
+            content = buffer.getvalue()
+            for position in range(0, len(content), 512):
+                self.request.sendall(b'SL%06X' % sequence + content[position:position + 512])
+                if not sequence:
+                    time.sleep(self.server.pause)
+                sequence += 1
+        self.request.sendall(b'END')
+
+
+def _match(code, patterns):
+    return any([fnmatch.fnmatch(code, pattern) for pattern in patterns.split(',')])
+
+
+@pytest.fixture
+def server():
+    stream = Stream()
+    for code in STATIONS:
+        extract = read(os.path.join("tests", "example", "20200119.C2.OTT.mseed"))
+        for trace in extract:
+            trace.stats.station = code
+        stream += extract
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), FDSNHandler)
+    httpd.stream = stream
+    httpd.requests = []
+    httpd.station_requests = []
+    httpd.failures = 0
+    httpd.failure_code = 500
+    thread = threading.Thread(target=httpd.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def seedlink():
+    stream = Stream()
+    for code in STATIONS:
+        extract = read(os.path.join("tests", "example", "20200119.C2.OTT.mseed"))
+        for trace in extract:
+            trace.stats.station = code
+        stream += extract
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), SeedLinkHandler)
+    server.daemon_threads = True
+    server.stream = stream
+    server.pause = 0
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,108 @@
+'''
+..  codeauthor:: Charles Blais
+'''
+# Third-party library
+from obspy import UTCDateTime
+
+# User-contributed library
+import pygeomag.clients.cache
+import pygeomag.clients.fdsn
+
+DAY = UTCDateTime(2020, 1, 19)
+
+
+def get_client(server, cache, inventory_cache=None):
+    return pygeomag.clients.fdsn.Client(
+        'http://127.0.0.1:%d' % server.server_address[1], _discover_services=False,
+        cache=cache, inventory_cache=inventory_cache)
+
+
+def test_cache(server, tmpdir):
+    '''
+    Repeated requests of past days are served from the cache
+    '''
+    cache = pygeomag.clients.cache.WaveformCache(str(tmpdir))
+    client = get_client(server, cache)
+    stream = client.get_waveforms('C2', 'OTT', 'R?', 'UFX,UFY,UFZ,UFF', DAY, DAY + 86400 - 0.000001)
+    assert len(server.requests) == 1
+    assert tmpdir.join('2020', '20200119.C2.OTT.R0.UFX.mseed').check()
+
+    cached = client.get_waveforms('C2', 'OTT', 'R?', 'UFX,UFY,UFZ,UFF', DAY, DAY + 86400 - 0.000001)
+    assert len(server.requests) == 1
+    assert len(cached) == len(stream) == 12
+    for trace in stream:
+        assert (cached.select(id=trace.id)[0].data == trace.data).all()
+
+
+def test_cache_range(server, tmpdir):
+    '''
+    Only the days missing from the cache are requested
+    '''
+    cache = pygeomag.clients.cache.WaveformCache(str(tmpdir))
+    client = get_client(server, cache)
+    client.get_waveforms('C2', 'OTT', 'R0', 'UFX', DAY, DAY + 86400 - 0.000001)
+    stream = client.get_waveforms('C2', 'OTT', 'R0', 'UFX', DAY - 86400, DAY + 2 * 86400 - 0.000001)
+    assert len(server.requests) == 3
+    assert [UTCDateTime(t) for t in server.requests[1][0][4:]] == [DAY - 86400, DAY - 0.000001]
+    assert [UTCDateTime(t) for t in server.requests[2][0][4:]] == [DAY + 86400, DAY + 2 * 86400 - 0.000001]
+    assert len(stream) == 1 and len(stream[0]) == 1440
+
+
+def test_cache_not_complete(server, tmpdir):
+    '''
+    A day fetched before it was complete is refetched
+    '''
+    cache = pygeomag.clients.cache.WaveformCache(str(tmpdir))
+    stream = get_client(server, None).get_waveforms('C2', 'OTT', 'R0', 'UFX', DAY, DAY + 86400 - 0.000001)
+    cache.put('C2', 'OTT', 'R0', 'UFX', DAY, stream, fetched=DAY + 3600)
+    assert cache.get('C2', 'OTT', 'R0', 'UFX', DAY) is None
+    cache.put('C2', 'OTT', 'R0', 'UFX', DAY, stream, fetched=DAY + 2 * 86400)
+    assert len(cache.get('C2', 'OTT', 'R0', 'UFX', DAY)) == 1
+
+
+def test_cache_no_data(server, tmpdir):
+    '''
+    Days without data are also cached
+    '''
+    cache = pygeomag.clients.cache.WaveformCache(str(tmpdir))
+    client = get_client(server, cache)
+    day = UTCDateTime(2021, 1, 19)
+    assert not client.get_waveforms('C2', 'OTT', 'R0', 'UFX', day, day + 86400 - 0.000001)
+    assert not client.get_waveforms('C2', 'OTT', 'R0', 'UFX', day, day + 86400 - 0.000001)
+    assert len(server.requests) == 1
+
+
+def test_cache_eviction(server, tmpdir):
+    '''
+    The least recently used files are evicted when the cache is full
+    '''
+    stream = get_client(server, None).get_waveforms('C2', 'OTT', 'R?', 'UFX', DAY, DAY + 86400 - 0.000001)
+    cache = pygeomag.clients.cache.WaveformCache(str(tmpdir), max_size=0)
+    cache.put('C2', 'OTT', 'R?', 'UFX', DAY, stream)
+    assert not tmpdir.join('2020').listdir('*.mseed')
+    assert cache.get('C2', 'OTT', 'R?', 'UFX', DAY) is None
+
+
+def test_inventory_cache(server, tmpdir):
+    '''
+    The inventory is requested at the station level and cached in memory
+    and on disk until it expires
+    '''
+    inventory_cache = pygeomag.clients.cache.InventoryCache(str(tmpdir))
+    client = get_client(server, None, inventory_cache)
+    inventory = client.get_inventory('C2', 'OTT')
+    assert client.get_inventory('C2', 'OTT') is inventory
+    assert len(server.station_requests) == 1
+    assert server.station_requests[0]['level'] == 'station'
+    assert len(tmpdir.join('stations').listdir()) == 1
+
+    # a new client (run) is served from disk
+    client = get_client(server, None, inventory_cache)
+    assert client.get_inventory('C2', 'OTT').networks[0].stations[0].code == 'OTT'
+    assert len(server.station_requests) == 1
+
+    # expired
+    inventory_cache.ttl = -1
+    client = get_client(server, None, inventory_cache)
+    client.get_inventory('C2', 'OTT')
+    assert len(server.station_requests) == 2
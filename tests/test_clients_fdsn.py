@@ -0,0 +1,147 @@
+'''
+..  codeauthor:: Charles Blais
+'''
+import socket
+
+# Third-party library
+import pytest
+from obspy import UTCDateTime
+from obspy.clients.fdsn.header import FDSNException, FDSNBadRequestException
+
+# User-contributed library
+import pygeomag.clients.fdsn
+
+
+def get_client(server, **kwargs):
+    return pygeomag.clients.fdsn.Client(
+        'http://127.0.0.1:%d' % server.server_address[1], _discover_services=False, retry_wait=0, **kwargs)
+
+
+def test_get_windows():
+    '''
+    Test the split of a time range in windows
+    '''
+    starttime = UTCDateTime(2020, 1, 18)
+    assert pygeomag.clients.fdsn.get_windows(starttime, starttime + 3600, 86400) == [(starttime, starttime + 3600)]
+    assert pygeomag.clients.fdsn.get_windows(starttime, starttime + 2.5 * 86400, 86400) == [
+        (starttime, starttime + 86400),
+        (starttime + 86400, starttime + 2 * 86400),
+        (starttime + 2 * 86400, starttime + 2.5 * 86400)]
+
+
+def test_get_waveforms_single(server):
+    '''
+    Without concurrency, a single request is made
+    '''
+    client = get_client(server)
+    stream = client.get_waveforms(
+        'C2', '*', 'R?', 'UFX,UFY,UFZ,UFF', UTCDateTime(2020, 1, 18), UTCDateTime(2020, 1, 20, 23, 59, 59))
+    assert len(server.requests) == 1
+    assert isinstance(stream, pygeomag.data.stream.Stream)
+    assert len(stream) == 24
+
+
+@pytest.mark.parametrize('bulk', [False, True])
+def test_get_waveforms_concurrent(server, bulk):
+    '''
+    The requests are split by station and day and reassembled
+    '''
+    client = get_client(server, concurrency=4, bulk=bulk)
+    starttime = UTCDateTime(2020, 1, 18)
+    endtime = UTCDateTime(2020, 1, 20, 23, 59, 59)
+    stream = client.get_waveforms('C2', '*', 'R?', 'UFX,UFY,UFZ,UFF', starttime, endtime)
+    # one request per station and day (or per day in bulk)
+    assert len(server.requests) == (3 if bulk else 6)
+    # The days are merged back to the traces of the example
+    assert len(stream) == 24
+    expected = server.stream.slice(starttime, endtime)
+    for trace in expected:
+        merged = stream.select(id=trace.id)
+        assert len(merged) == 1
+        assert merged[0].stats.starttime == trace.stats.starttime
+        assert (merged[0].data == trace.data).all()
+
+
+def test_get_waveforms_retries(server):
+    '''
+    Failed requests are retried
+    '''
+    server.failures = 2
+    client = get_client(server, concurrency=2, retries=2)
+    stream = client.get_waveforms(
+        'C2', 'OTT', 'R0', 'UFX', UTCDateTime(2020, 1, 19), UTCDateTime(2020, 1, 19, 23, 59, 59))
+    assert len(server.requests) == 3
+    assert len(stream) == 1 and len(stream[0]) == 1440
+
+
+def test_get_waveforms_retries_exhausted(server):
+    '''
+    The error is raised when all the retries failed
+    '''
+    server.failures = 10
+    client = get_client(server, retries=1)
+    with pytest.raises(Exception):
+        client.get_waveforms(
+            'C2', 'OTT', 'R0', 'UFX', UTCDateTime(2020, 1, 19), UTCDateTime(2020, 1, 19, 23, 59, 59))
+    assert len(server.requests) == 2
+
+
+def test_get_waveforms_not_transient(server):
+    '''
+    A bad request is not retried
+    '''
+    server.failures = 10
+    server.failure_code = 400
+    client = get_client(server, retries=2)
+    with pytest.raises(FDSNBadRequestException):
+        client.get_waveforms(
+            'C2', 'OTT', 'R0', 'UFX', UTCDateTime(2020, 1, 19), UTCDateTime(2020, 1, 19, 23, 59, 59))
+    assert len(server.requests) == 1
+
+
+def test_get_waveforms_connection_error():
+    '''
+    A refused connection is retried
+    '''
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    client = pygeomag.clients.fdsn.Client(
+        'http://127.0.0.1:%d' % port, _discover_services=False, retries=1, retry_wait=0)
+    urls = []
+    download = client._download
+
+    def count_download(url, **kwargs):
+        urls.append(url)
+        return download(url, **kwargs)
+
+    client._download = count_download
+    with pytest.raises(FDSNException):
+        client.get_waveforms(
+            'C2', 'OTT', 'R0', 'UFX', UTCDateTime(2020, 1, 19), UTCDateTime(2020, 1, 19, 23, 59, 59))
+    assert len(urls) == 2
+
+
+def test_get_waveforms_no_data(server):
+    '''
+    No data results in an empty stream
+    '''
+    client = get_client(server, concurrency=2)
+    stream = client.get_waveforms(
+        'C2', 'OTT', 'R0', 'UFX', UTCDateTime(2021, 1, 19), UTCDateTime(2021, 1, 20, 23, 59, 59))
+    assert not stream
+
+
+@pytest.mark.parametrize('concurrency', [1, 4])
+def test_bytes_downloaded(server, concurrency):
+    '''
+    The bytes of all the responses are counted
+    '''
+    client = get_client(server, concurrency=concurrency)
+    assert client.bytes_downloaded == 0
+    client.get_waveforms(
+        'C2', '*', 'R?', 'UFX,UFY,UFZ,UFF', UTCDateTime(2020, 1, 18), UTCDateTime(2020, 1, 20, 23, 59, 59))
+    waveforms = client.bytes_downloaded
+    assert waveforms > 0
+    client.get_inventory('C2', 'OTT')
+    assert client.bytes_downloaded > waveforms
@@ -0,0 +1,37 @@
+'''
+..  codeauthor:: Charles Blais
+'''
+import os
+
+# Third-party library
+from obspy import read, UTCDateTime
+
+# User-contributed library
+import pygeomag.clients.filesystem
+
+DAY = UTCDateTime(2020, 1, 19)
+
+
+def test_get_waveforms():
+    '''
+    Select the traces of the local files by code and time
+    '''
+    client = pygeomag.clients.filesystem.Client(os.path.join('tests', 'example', '*.mseed'))
+    stream = client.get_waveforms('C2', 'OTT', 'R?', 'UFX,UFY', DAY, DAY + 86400 - 60)
+    assert sorted(set([trace.stats.channel for trace in stream])) == ['UFX', 'UFY']
+    expected = read(os.path.join('tests', 'example', '20200119.C2.OTT.mseed')).select(
+        channel='UFX', location='R0').trim(DAY, DAY + 86400 - 60)
+    trace = stream.select(channel='UFX', location='R0')[0]
+    assert trace.stats.starttime == DAY
+    assert trace.stats.endtime == DAY + 86400 - 60
+    assert (trace.data == expected[0].data).all()
+
+
+def test_get_waveforms_no_match():
+    '''
+    Nothing is returned when no trace matches the query
+    '''
+    client = pygeomag.clients.filesystem.Client(os.path.join('tests', 'example', '*.mseed'))
+    assert not client.get_waveforms('C2', 'SNK', 'R?', 'UFX', DAY, DAY + 86400 - 60)
+    assert not client.get_waveforms('C2', 'OTT', 'R?', 'UFX', DAY + 10 * 86400, DAY + 11 * 86400)
+    assert not client.get_waveforms('C2', 'OTT', '--', 'UFX', DAY, DAY + 86400 - 60)
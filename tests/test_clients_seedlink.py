@@ -0,0 +1,28 @@
+'''
+..  codeauthor:: Charles Blais
+'''
+# User-contributed library
+import pygeomag.clients.seedlink
+
+
+def test_client_pause(seedlink):
+    '''
+    A pause of the server longer than the timeout does not end the stream
+    '''
+    seedlink.pause = 1.5
+    flushed = []
+    client = pygeomag.clients.seedlink.Client(
+        '127.0.0.1:%d' % seedlink.server_address[1], flushed.append, interval=3600, buffer_seconds=2 * 86400, timeout=1)
+    client.select_stream('C2', 'OTT', 'R0UFX')
+    try:
+        client.run()
+    finally:
+        client.close()
+    assert len(flushed) == 1
+    expected = seedlink.stream.select(station='OTT')
+    assert len(flushed[0]) == len(expected)
+    for trace in expected:
+        received = flushed[0].select(id=trace.id)
+        assert len(received) == 1
+        assert received[0].stats.starttime == trace.stats.starttime
+        assert (received[0].data == trace.data).all()
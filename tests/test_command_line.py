@@ -0,0 +1,444 @@
+'''
+..  codeauthor:: Charles Blais
+'''
+import os
+import sys
+import json
+import subprocess
+
+# Third-party library
+import pytest
+import numpy as np
+from obspy import read, Stream, UTCDateTime
+
+# User-contributed library
+import pygeomag.command_line
+import pygeomag.clients.fdsn
+import pygeomag.data.stream
+
+
+class FakeClient(object):
+    '''
+    FDSN-WS client serving the example data
+    '''
+    requests = []
+    inventory_requests = []
+    stations = ['OTT']
+
+    def __init__(self, url, **kwargs):
+        self.url = url
+
+    def get_waveforms(self, network, station, location, channel, starttime, endtime):
+        FakeClient.requests.append((network, station, location, channel, starttime, endtime))
+        stream = Stream()
+        for code in FakeClient.stations:
+            extract = read(os.path.join("tests", "example", "20200119.C2.OTT.mseed"))
+            for trace in extract:
+                trace.stats.station = code
+            stream += extract
+        return stream
+
+    def get_inventory(self, network, station):
+        FakeClient.inventory_requests.append((network, station))
+        return None
+
+
+@pytest.fixture
+def client(monkeypatch):
+    FakeClient.requests = []
+    FakeClient.inventory_requests = []
+    FakeClient.stations = ['OTT']
+    monkeypatch.setattr(pygeomag.clients.fdsn, 'Client', FakeClient)
+    return FakeClient
+
+
+@pytest.mark.parametrize('command', ['fdsnws2geomag', 'fdsnws2directory', 'seedlink2directory', 'fdsnws2batch'])
+def test_help_imports(command):
+    '''
+    The arguments are parsed (--help) without importing obspy
+    '''
+    code = '''
+import sys
+import pygeomag.command_line
+sys.argv = ['%s', '--help']
+try:
+    pygeomag.command_line.%s()
+except SystemExit:
+    pass
+print(",".join([name for name in ['obspy', 'numpy', 'pkg_resources'] if name in sys.modules]))
+''' % (command, command)
+    result = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, check=True)
+    assert result.stdout.decode().splitlines()[-1] == ''
+
+
+def test_get_days():
+    '''
+    Test the list of days of a request
+    '''
+    assert pygeomag.command_line.get_days('2020-01-19T12:00:00') == [UTCDateTime(2020, 1, 19)]
+    assert pygeomag.command_line.get_days('2020-01-30', days=3) == [
+        UTCDateTime(2020, 1, 30), UTCDateTime(2020, 1, 31), UTCDateTime(2020, 2, 1)]
+    assert pygeomag.command_line.get_days('2020-01-30', endtime='2020-02-01') == [
+        UTCDateTime(2020, 1, 30), UTCDateTime(2020, 1, 31), UTCDateTime(2020, 2, 1)]
+
+
+def test_fdsnws2directory_range(client, monkeypatch, tmpdir):
+    '''
+    A range of days is requested once and split in daily files
+    '''
+    monkeypatch.setattr(sys, 'argv', [
+        'fdsnws2directory', '--directory', str(tmpdir.join('%Y%m%d')),
+        '--starttime', '2020-01-18', '--endtime', '2020-01-20'])
+    pygeomag.command_line.fdsnws2directory()
+    assert len(client.requests) == 1
+    assert client.inventory_requests == [('C2', '*')]
+    assert client.requests[0][4:] == (UTCDateTime(2020, 1, 18), UTCDateTime(2020, 1, 20, 23, 59, 59, 999999))
+    # The example data overlaps on the previous and next day
+    for day in ['20200118', '20200119', '20200120']:
+        assert tmpdir.join(day).listdir() == [tmpdir.join(day, 'ott%svmin.min' % day)]
+    with open(str(tmpdir.join('20200119', 'ott20200119vmin.min'))) as resource:
+        assert "2020-01-19 00:00:00.000 019     17208.00  -4902.70  49973.90  53270.80\n" in resource.read()
+
+
+@pytest.mark.parametrize('workers', ['1', '2'])
+def test_fdsnws2directory_workers(client, monkeypatch, tmpdir, workers):
+    '''
+    The station files are written by a pool of processes, a station that
+    can not be written does not abort the others and leaves no file
+    '''
+    client.stations = ['OTT', 'BAD', 'SNK']
+    # a sampling rate mismatch makes the BAD station fail
+    get_waveforms = client.get_waveforms
+
+    def get_bad_waveforms(self, *args):
+        stream = get_waveforms(self, *args)
+        for trace in stream.select(station='BAD', channel='UFY'):
+            trace.stats.sampling_rate = 1.
+        return stream
+
+    monkeypatch.setattr(client, 'get_waveforms', get_bad_waveforms)
+    monkeypatch.setattr(sys, 'argv', [
+        'fdsnws2directory', '--directory', str(tmpdir), '--date', '2020-01-19', '--workers', workers])
+    assert pygeomag.command_line.fdsnws2directory() == 1
+    assert sorted([path.basename for path in tmpdir.listdir()]) == [
+        'ott20200119vmin.min', 'snk20200119vmin.min']
+    assert tmpdir.join('snk20200119vmin.min').size() == tmpdir.join('ott20200119vmin.min').size()
+
+
+@pytest.mark.parametrize('output_format, inventory_requests', [
+    ('iaga2002', [('C2', 'OTT')]),
+    ('internet', []),
+])
+def test_fdsnws2geomag_inventory(client, monkeypatch, tmpdir, output_format, inventory_requests):
+    '''
+    The inventory is only requested for the formats using it
+    '''
+    monkeypatch.setattr(sys, 'argv', [
+        'fdsnws2geomag', '--station', 'OTT', '--date', '2020-01-19',
+        '--format', output_format, '--output', str(tmpdir.join('output'))])
+    pygeomag.command_line.fdsnws2geomag()
+    assert client.inventory_requests == inventory_requests
+    assert tmpdir.join('output').size()
+
+
+def test_fdsnws2geomag_formats(client, monkeypatch, tmpdir):
+    '''
+    Several formats are written from a single fetch, an output is required
+    for each format
+    '''
+    for output_format in ['iaga2002', 'imfv122']:
+        monkeypatch.setattr(sys, 'argv', [
+            'fdsnws2geomag', '--station', 'OTT', '--date', '2020-01-19',
+            '--format', output_format, '--output', str(tmpdir.join('expected.%s' % output_format))])
+        pygeomag.command_line.fdsnws2geomag()
+    client.requests = []
+    monkeypatch.setattr(sys, 'argv', [
+        'fdsnws2geomag', '--station', 'OTT', '--date', '2020-01-19', '--format', 'iaga2002', 'imfv122',
+        '--output', str(tmpdir.join('output.iaga2002')), str(tmpdir.join('output.imfv122'))])
+    pygeomag.command_line.fdsnws2geomag()
+    assert len(client.requests) == 1
+    for output_format in ['iaga2002', 'imfv122']:
+        assert tmpdir.join('output.%s' % output_format).read() == tmpdir.join('expected.%s' % output_format).read()
+
+    monkeypatch.setattr(sys, 'argv', [
+        'fdsnws2geomag', '--station', 'OTT', '--format', 'iaga2002', 'imfv122', '--output', str(tmpdir.join('output'))])
+    with pytest.raises(SystemExit):
+        pygeomag.command_line.fdsnws2geomag()
+
+
+@pytest.mark.parametrize('workers', ['1', '2'])
+def test_fdsnws2directory_formats(client, monkeypatch, tmpdir, workers):
+    '''
+    The files of each station are written in every format
+    '''
+    client.stations = ['OTT', 'SNK']
+    monkeypatch.setattr(sys, 'argv', [
+        'fdsnws2directory', '--directory', str(tmpdir), '--date', '2020-01-19',
+        '--format', 'iaga2002', 'imfv122', '--workers', workers])
+    pygeomag.command_line.fdsnws2directory()
+    assert len(client.requests) == 1
+    assert sorted([path.basename for path in tmpdir.listdir()]) == [
+        'JAN1920.OTT', 'JAN1920.SNK', 'ott20200119vmin.min', 'snk20200119vmin.min']
+
+
+def test_fdsnws2directory_input(client, monkeypatch, tmpdir):
+    '''
+    Local miniSEED files are converted without the FDSN-WS
+    '''
+    monkeypatch.setattr(sys, 'argv', [
+        'fdsnws2directory', '--directory', str(tmpdir), '--date', '2020-01-19',
+        '--input', os.path.join('tests', 'example', '*.mseed')])
+    pygeomag.command_line.fdsnws2directory()
+    assert not client.requests
+    assert tmpdir.listdir() == [tmpdir.join('ott20200119vmin.min')]
+    with open(str(tmpdir.join('ott20200119vmin.min'))) as resource:
+        assert "2020-01-19 00:00:00.000 019     17208.00  -4902.70  49973.90  53270.80\n" in resource.read()
+
+
+def test_fdsnws2directory_metrics(client, monkeypatch, tmpdir):
+    '''
+    The summary of the run has the time of each stage and the counts of
+    traces, samples, files and rows
+    '''
+    client.stations = ['OTT', 'SNK']
+    monkeypatch.setattr(sys, 'argv', [
+        'fdsnws2directory', '--directory', str(tmpdir.join('%Y%m%d')), '--date', '2020-01-19',
+        '--metrics', str(tmpdir.join('metrics.jsonl'))])
+    pygeomag.command_line.fdsnws2directory()
+    with open(str(tmpdir.join('metrics.jsonl'))) as resource:
+        summary = json.loads(resource.read())
+    assert summary['command'] == 'fdsnws2directory'
+    assert sorted(summary['stages']) == ['inventory', 'merge', 'trim', 'waveforms', 'write']
+    assert summary['counters'] == {
+        'bytes_downloaded': 0,
+        'waveform_traces': 24,
+        'waveform_samples': 34752,
+        'merged_traces': 8,
+        'merged_samples': 11616,
+        'files_written': 2,
+        'files_failed': 0,
+        'rows_written': 2 * 1440,
+    }
+
+
+def test_fdsnws2directory_follow(client, monkeypatch, tmpdir):
+    '''
+    The new samples are polled and appended to the daily files with a
+    rollover at midnight, the files are the same as a single request
+    '''
+    monkeypatch.setattr(sys, 'argv', [
+        'fdsnws2directory', '--directory', str(tmpdir.join('full')), '--date', '2020-01-19', '--fill-gaps'])
+    pygeomag.command_line.fdsnws2directory()
+
+    # only the samples before the time of the poll are available
+    clock = [UTCDateTime(2020, 1, 19, 6)]
+    polls = [UTCDateTime(2020, 1, 19, 12, 0, 30), UTCDateTime(2020, 1, 20, 3)]
+    get_waveforms = client.get_waveforms
+
+    def get_available_waveforms(self, network, station, location, channel, starttime, endtime):
+        stream = get_waveforms(self, network, station, location, channel, starttime, endtime)
+        return stream.slice(starttime, min(endtime, clock[0]))
+
+    def sleep(seconds):
+        if not polls:
+            raise KeyboardInterrupt()
+        clock[0] = polls.pop(0)
+
+    monkeypatch.setattr(client, 'get_waveforms', get_available_waveforms)
+    monkeypatch.setattr(pygeomag.command_line, '_now', lambda: clock[0])
+    monkeypatch.setattr(pygeomag.command_line.time, 'sleep', sleep)
+    monkeypatch.setattr(sys, 'argv', [
+        'fdsnws2directory', '--directory', str(tmpdir.join('%Y%m%d')), '--date', '2020-01-19',
+        '--fill-gaps', '--follow', '--interval', '0', '--metrics', str(tmpdir.join('metrics.jsonl'))])
+    assert pygeomag.command_line.fdsnws2directory() == 0
+    assert len(client.requests) == 4
+    # the polls only count the new rows (without the last row already written)
+    with open(str(tmpdir.join('metrics.jsonl'))) as resource:
+        assert [json.loads(line)['counters']['rows_written'] for line in resource] == [361, 360, 719 + 1]
+    assert client.requests[2][4] == UTCDateTime(2020, 1, 19, 6)
+    assert client.requests[3][4] == UTCDateTime(2020, 1, 19, 12)
+    assert tmpdir.join('20200119', 'ott20200119vmin.min').read() == \
+        tmpdir.join('full', 'ott20200119vmin.min').read()
+    with open(str(tmpdir.join('20200120', 'ott20200120vmin.min')), newline='') as resource:
+        assert resource.read().endswith("\r\n2020-01-20 00:00:00.000 020     17206.80  -4903.00  49974.40  53271.00\r\n")
+
+
+def test_fdsnws2directory_follow_error(client, monkeypatch, tmpdir):
+    '''
+    A poll that fails does not stop following, its samples are requested
+    again at the next poll
+    '''
+    clock = [UTCDateTime(2020, 1, 19, 6)]
+    polls = [UTCDateTime(2020, 1, 19, 12), UTCDateTime(2020, 1, 19, 18)]
+    get_waveforms = client.get_waveforms
+
+    def get_available_waveforms(self, network, station, location, channel, starttime, endtime):
+        stream = get_waveforms(self, network, station, location, channel, starttime, endtime)
+        if len(client.requests) == 2:
+            raise ConnectionError("Timeout of the request")
+        return stream.slice(starttime, min(endtime, clock[0]))
+
+    def sleep(seconds):
+        if not polls:
+            raise KeyboardInterrupt()
+        clock[0] = polls.pop(0)
+
+    monkeypatch.setattr(client, 'get_waveforms', get_available_waveforms)
+    monkeypatch.setattr(pygeomag.command_line, '_now', lambda: clock[0])
+    monkeypatch.setattr(pygeomag.command_line.time, 'sleep', sleep)
+    monkeypatch.setattr(sys, 'argv', [
+        'fdsnws2directory', '--directory', str(tmpdir), '--date', '2020-01-19',
+        '--fill-gaps', '--follow', '--interval', '0'])
+    assert pygeomag.command_line.fdsnws2directory() == 0
+    assert len(client.requests) == 3
+    assert client.requests[1][4] == client.requests[2][4] == UTCDateTime(2020, 1, 19, 6)
+    stream = pygeomag.data.stream.Stream.read(str(tmpdir.join('ott20200119vmin.min')))
+    assert max([trace.stats.endtime for trace in stream]) == UTCDateTime(2020, 1, 19, 18)
+
+
+def test_fdsnws2directory_follow_write_error(client, monkeypatch, tmpdir):
+    '''
+    The samples of a poll that could not be written are requested again at
+    the next poll, no row is left missing
+    '''
+    clock = [UTCDateTime(2020, 1, 19, 6)]
+    polls = [UTCDateTime(2020, 1, 19, 12), UTCDateTime(2020, 1, 19, 18)]
+    get_waveforms = client.get_waveforms
+    write_station = pygeomag.command_line._write_station
+
+    def get_available_waveforms(self, network, station, location, channel, starttime, endtime):
+        stream = get_waveforms(self, network, station, location, channel, starttime, endtime)
+        return stream.slice(starttime, min(endtime, clock[0]))
+
+    def write_station_once(*args, **kwargs):
+        # the write of the first poll fails
+        if len(client.requests) == 2:
+            return None
+        return write_station(*args, **kwargs)
+
+    def sleep(seconds):
+        if not polls:
+            raise KeyboardInterrupt()
+        clock[0] = polls.pop(0)
+
+    monkeypatch.setattr(client, 'get_waveforms', get_available_waveforms)
+    monkeypatch.setattr(pygeomag.command_line, '_write_station', write_station_once)
+    monkeypatch.setattr(pygeomag.command_line, '_now', lambda: clock[0])
+    monkeypatch.setattr(pygeomag.command_line.time, 'sleep', sleep)
+    monkeypatch.setattr(sys, 'argv', [
+        'fdsnws2directory', '--directory', str(tmpdir), '--date', '2020-01-19',
+        '--fill-gaps', '--follow', '--interval', '0'])
+    assert pygeomag.command_line.fdsnws2directory() == 0
+    assert len(client.requests) == 3
+    assert client.requests[1][4] == client.requests[2][4] == UTCDateTime(2020, 1, 19, 6)
+    stream = pygeomag.data.stream.Stream.read(str(tmpdir.join('ott20200119vmin.min')))
+    assert max([trace.stats.endtime for trace in stream]) == UTCDateTime(2020, 1, 19, 18)
+    assert not any([isinstance(trace.data, np.ma.MaskedArray) for trace in stream])
+
+
+@pytest.mark.parametrize('interval', ['0', '60'])
+def test_seedlink2directory(client, seedlink, monkeypatch, tmpdir, interval):
+    '''
+    The packets of the SeedLink server are written in the daily files of the
+    stations, on a schedule or when the server terminates the stream
+    '''
+    monkeypatch.setattr(sys, 'argv', [
+        'fdsnws2directory', '--directory', str(tmpdir.join('fdsnws')), '--date', '2020-01-19', '--fill-gaps'])
+    pygeomag.command_line.fdsnws2directory()
+
+    monkeypatch.setattr(sys, 'argv', [
+        'seedlink2directory', '--server', '127.0.0.1:%d' % seedlink.server_address[1],
+        '--station', 'OTT', 'SNK', '--directory', str(tmpdir.join('%Y%m%d')),
+        '--fill-gaps', '--interval', interval])
+    assert pygeomag.command_line.seedlink2directory() == 0
+    assert sorted([path.basename for path in tmpdir.join('20200119').listdir()]) == [
+        'ott20200119vmin.min', 'snk20200119vmin.min']
+    assert tmpdir.join('20200119', 'ott20200119vmin.min').read() == \
+        tmpdir.join('fdsnws', 'ott20200119vmin.min').read()
+    assert tmpdir.join('20200120', 'snk20200120vmin.min').size()
+
+
+def test_read_jobs(tmpdir):
+    '''
+    The defaults are applied to the jobs and the identical jobs are removed
+    '''
+    filename = tmpdir.join('jobs.json')
+    filename.write(json.dumps({
+        'defaults': {'network': 'C2', 'date': '2020-01-19'},
+        'jobs': [
+            {'station': 'OTT', 'output': 'ott.min', 'location': 'R1,R0'},
+            {'station': 'OTT', 'output': 'ott.min', 'location': ['R1', 'R0']},
+            {'station': 'SNK', 'output': 'snk.txt', 'format': 'internet', 'date': '2020-01-20T12:00:00'},
+        ]
+    }))
+    jobs = pygeomag.command_line.read_jobs(str(filename))
+    assert [(job['station'], job['location'], job['format'], job['day']) for job in jobs] == [
+        ('OTT', ['R1', 'R0'], 'iaga2002', UTCDateTime(2020, 1, 19)),
+        ('SNK', ['R?'], 'internet', UTCDateTime(2020, 1, 20)),
+    ]
+    filename.write(json.dumps([{'station': 'OTT', 'output': 'ott.min', 'directory': '.'}]))
+    with pytest.raises(ValueError):
+        pygeomag.command_line.read_jobs(str(filename))
+
+
+def test_fdsnws2batch(client, monkeypatch, tmpdir):
+    '''
+    The jobs of a day share a single waveform request and the inventory is
+    requested once, the outputs are the same as fdsnws2geomag
+    '''
+    for output_format in ['iaga2002', 'internet']:
+        monkeypatch.setattr(sys, 'argv', [
+            'fdsnws2geomag', '--station', 'OTT', '--date', '2020-01-19',
+            '--format', output_format, '--output', str(tmpdir.join('expected.%s' % output_format))])
+        pygeomag.command_line.fdsnws2geomag()
+
+    client.requests = []
+    client.inventory_requests = []
+    client.stations = ['OTT', 'SNK']
+    tmpdir.join('jobs.json').write(json.dumps({
+        'defaults': {'date': '2020-01-19'},
+        'jobs': [
+            {'station': 'OTT', 'output': str(tmpdir.join('%Y%m%d.OTT.iaga2002'))},
+            {'station': 'OTT', 'output': str(tmpdir.join('%Y%m%d.OTT.internet')), 'format': 'internet'},
+            {'station': 'SNK', 'output': str(tmpdir.join('%Y%m%d.SNK.iaga2002')), 'location': ['R1', 'R0']},
+            {'station': 'SNK', 'output': str(tmpdir.join('%Y%m%d.SNK.iaga2002')), 'location': ['R1', 'R0']},
+            {'station': 'BAD', 'output': str(tmpdir.join('%Y%m%d.BAD.iaga2002'))},
+            {'station': 'OTT', 'output': str(tmpdir.join('%Y%m%d.OTT.iaga2002')), 'date': '2020-01-20'},
+        ]
+    }))
+    monkeypatch.setattr(sys, 'argv', ['fdsnws2batch', str(tmpdir.join('jobs.json'))])
+    assert pygeomag.command_line.fdsnws2batch() == 1
+    assert [request[:4] + (request[4].date,) for request in client.requests] == [
+        ('C2', 'OTT,SNK,BAD', 'R?,R1,R0', 'UFX,UFY,UFZ,UFF', UTCDateTime(2020, 1, 19).date),
+        ('C2', 'OTT', 'R?', 'UFX,UFY,UFZ,UFF', UTCDateTime(2020, 1, 20).date),
+    ]
+    assert client.inventory_requests == [('C2', 'OTT,SNK,BAD')]
+    for output_format in ['iaga2002', 'internet']:
+        assert tmpdir.join('20200119.OTT.%s' % output_format).read() == \
+            tmpdir.join('expected.%s' % output_format).read()
+    assert tmpdir.join('20200119.SNK.iaga2002').size()
+    assert tmpdir.join('20200120.OTT.iaga2002').size()
+    assert not tmpdir.join('20200119.BAD.iaga2002').check()
+
+
+@pytest.mark.parametrize('fill_gaps', [False, True])
+def test_fdsnws2batch_locations(client, monkeypatch, tmpdir, fill_gaps):
+    '''
+    The locations matching the default wildcard are merged by ascending
+    location code whatever the order of the traces, like fdsnws2geomag
+    '''
+    get_waveforms = client.get_waveforms
+
+    def get_reversed_waveforms(self, *args):
+        return Stream(get_waveforms(self, *args)[::-1])
+
+    monkeypatch.setattr(client, 'get_waveforms', get_reversed_waveforms)
+    options = ['--fill-gaps'] if fill_gaps else []
+    monkeypatch.setattr(sys, 'argv', [
+        'fdsnws2geomag', '--station', 'OTT', '--date', '2020-01-19', '--output', str(tmpdir.join('expected'))] + options)
+    pygeomag.command_line.fdsnws2geomag()
+    tmpdir.join('jobs.json').write(json.dumps([
+        {'station': 'OTT', 'date': '2020-01-19', 'output': str(tmpdir.join('output')), 'fill_gaps': fill_gaps}]))
+    monkeypatch.setattr(sys, 'argv', ['fdsnws2batch', str(tmpdir.join('jobs.json'))])
+    assert pygeomag.command_line.fdsnws2batch() == 0
+    assert tmpdir.join('output').read() == tmpdir.join('expected').read()
@@ -214,3 +214,281 @@ def test_imfv122_duplicate(test_data_duplicate):
         buffer = io.StringIO()
         test_data_duplicate.write(buffer, format='imfv122')
     assert "mutliple identical components" in str(excinfo.value)
+
+
+def test_iaga2002_second():
+    '''
+    Test the IAGA2002 data for a full day of second data
+    '''
+    stream = pygeomag.data.stream.Stream(Stream([
+        Trace(
+            np.arange(86400, dtype=np.float64) / 100.,
+            header={
+                'network': 'C2', 'station': 'OTT', 'location': 'R0', 'channel': 'LF%s' % component,
+                'delta': 1, 'starttime': UTCDateTime(2020, 2, 29, 0, 0, 0)
+            }
+        ) for component in 'XYZF'
+    ]))
+    buffer = io.StringIO()
+    stream.write(buffer, format='IAGA2002')
+    content = buffer.getvalue()
+    assert content.count("\r\n2020-02-29 ") == 86400
+    assert "2020-02-29 00:00:00.000 060     99999.00  99999.00  99999.00  99999.00\r\n" in content
+    assert "2020-02-29 13:46:40.000 060       496.00    496.00    496.00    496.00\r\n" in content
+    assert content.endswith("2020-02-29 23:59:59.000 060       863.99    863.99    863.99    863.99\r\n")
+
+
+def test_iaga2002_wide_values(test_data):
+    '''
+    Test the IAGA2002 data with values that do not fit the column width
+    '''
+    test_data[0].data[1] = -123456.789
+    buffer = io.StringIO()
+    test_data.write(buffer, format='IAGA2002')
+    content = buffer.getvalue()
+    assert "2019-01-02 00:01:00.000 002    -123456.79  99999.00  99999.00  99999.00\r\n" in content
+    assert "2019-01-02 00:02:00.000 002         3.00  99999.00  99999.00  99999.00\r\n" in content
+
+
+def test_internet(test_data_begin_missing):
+    '''
+    Test the internet data, minute data has whole second timestamps
+    '''
+    buffer = io.StringIO()
+    test_data_begin_missing.write(buffer, format='internet')
+    content = buffer.getvalue()
+    assert content == (
+        "OTT 2019 002:00:01:00 1.00 99999.00 99999.00 99999.00\n"
+        "OTT 2019 002:00:02:00 2.00 99999.00 99999.00 99999.00\n"
+        "OTT 2019 002:00:03:00 3.00 99999.00 99999.00 99999.00\n"
+    )
+
+
+def test_internet_subsecond():
+    '''
+    Test the internet data, data faster than 1 Hz has sub-second timestamps
+    '''
+    stream = pygeomag.data.stream.Stream(Stream([
+        Trace(
+            np.array([-1.005, 2., 13567.125]),
+            header={
+                'network': 'C2', 'station': 'MEA', 'location': 'R0', 'channel': 'MF%s' % component,
+                'delta': 0.125, 'starttime': UTCDateTime(2017, 11, 21, 23, 59, 59, 875000)
+            }
+        ) for component in 'XYZF'
+    ]))
+    buffer = io.StringIO()
+    stream.write(buffer, format='internet')
+    content = buffer.getvalue()
+    assert content.splitlines() == [
+        "MEA 2017 325:23:59:59.875 %.2f %.2f %.2f %.2f" % ((-1.005,) * 4),
+        "MEA 2017 326:00:00:00.000 2.00 2.00 2.00 2.00",
+        "MEA 2017 326:00:00:00.125 13567.12 13567.12 13567.12 13567.12",
+    ]
+
+
+def test_imfv122_with_data(data):
+    '''
+    Test the IMFv1.22 data layout of a full day, 24 hour blocks of a header
+    and 30 lines of 2 minutes
+    '''
+    cdata = data.merge_by_location().trim(REAL_DATA_STARTTIME, REAL_DATA_ENDTIME)
+
+    buffer = io.StringIO()
+    cdata.write(buffer, format='imfv122')
+    lines = buffer.getvalue().split("\n")
+    assert len(lines) == 24 * 31 + 1
+    assert lines[0] == "OTT JAN1920 019 00 XYZF R OTT 00000000 000000 RRRRRRRRRRRRRRRR"
+    assert lines[31].startswith("OTT JAN1920 019 01 ")
+    assert lines[1].startswith(" 172080  -49027  499739 532708   ")
+    assert all(len(line) == 62 for idx, line in enumerate(lines[:-1]) if idx % 31)
+
+
+@pytest.mark.parametrize('format', ['IAGA2002', 'internet'])
+def test_write_chunk_seconds(data, format):
+    '''
+    The output should not depend on the length of the windows written at once
+    '''
+    cdata = data.merge_by_location().trim(REAL_DATA_STARTTIME, REAL_DATA_ENDTIME)
+
+    buffer = io.StringIO()
+    cdata.write(buffer, format=format)
+    chunked = io.StringIO()
+    cdata.write(chunked, format=format, chunk_seconds=7 * 60)
+    assert chunked.getvalue() == buffer.getvalue()
+
+
+def test_iaga2002_unaligned():
+    '''
+    Traces not starting on the same sample are aligned to the nearest sample
+    '''
+    stream = pygeomag.data.stream.Stream(Stream([
+        Trace(
+            np.array([1., 2., 3.]),
+            header={
+                'network': 'C2', 'station': 'OTT', 'location': 'R1', 'channel': 'UF%s' % component,
+                'delta': 60, 'starttime': UTCDateTime(2019, 1, 2, 0, 1, 0) + offset
+            }
+        ) for component, offset in zip('XYZF', [0, 29, 31, 60])
+    ]))
+    buffer = io.StringIO()
+    stream.write(buffer, format='IAGA2002')
+    content = buffer.getvalue()
+    assert "2019-01-02 00:00:00.000 002     99999.00  99999.00  99999.00  99999.00\r\n" in content
+    assert "2019-01-02 00:01:00.000 002         1.00      1.00  99999.00  99999.00\r\n" in content
+    assert "2019-01-02 00:02:00.000 002         2.00      2.00      1.00      1.00\r\n" in content
+    assert content.endswith("2019-01-02 00:04:00.000 002     99999.00  99999.00      3.00      3.00\r\n")
+
+
+@pytest.mark.parametrize('format', ['iaga2002', 'imfv122', 'internet'])
+def test_read(data, format):
+    '''
+    Reading the written file should give back the data with masked null values
+    '''
+    stream = data.merge_by_location(replace_location='R0').trim(REAL_DATA_STARTTIME, REAL_DATA_ENDTIME)
+    trace = stream.select(channel='UFX')[0]
+    trace.data = np.ma.masked_array(trace.data, mask=np.arange(trace.stats.npts) < 10)
+    buffer = io.StringIO()
+    stream.write(buffer, format=format)
+    buffer.seek(0)
+    result = pygeomag.data.stream.Stream.read(buffer, format=format)
+    assert isinstance(result, pygeomag.data.stream.Stream)
+    assert sorted([trace.stats.channel for trace in result]) == ['UFF', 'UFX', 'UFY', 'UFZ']
+    for trace in result:
+        assert trace.stats.station == 'OTT'
+        assert trace.stats.starttime == REAL_DATA_STARTTIME
+        assert trace.stats.delta == 60
+        expected = stream.select(channel=trace.stats.channel)[0].data
+        assert np.allclose(trace.data[10:], expected[10:], atol=0.1)
+    # the null values are masked
+    assert result.select(channel='UFX')[0].data.mask[:10].all()
+    assert not result.select(channel='UFX')[0].data.mask[10:].any()
+
+
+def test_read_iaga2002_irregular():
+    '''
+    Rows that are not fixed width and gaps in the rows are still read
+    '''
+    content = '\n'.join([
+        " Format                 IAGA-2002                                    |",
+        " IAGA CODE              OTT                                          |",
+        " Data Interval Type     1-second                                     |",
+        " Data Type              definitive                                   |",
+        "DATE       TIME         DOY     OTTX      OTTY      OTTZ      OTTF   |",
+        "2020-01-19 00:00:00.000 019     17208.00  -4902.70  49973.90  53270.80",
+        "2020-01-19 00:00:01.000 019     17208.10  -4902.80  49973.90  99999.00",
+        "2020-01-19 00:00:03.000 019 17208.2 -4902.9 49974 53270.9",
+    ])
+    stream = pygeomag.data.stream.Stream.read(io.StringIO(content), format='IAGA2002')
+    assert len(stream) == 8
+    first = stream.select(channel='LFF')[0]
+    assert first.id == '.OTT.D.LFF'
+    assert first.stats.starttime == REAL_DATA_STARTTIME
+    assert first.stats.npts == 2
+    assert first.data[0] == 53270.8 and first.data.mask.tolist() == [False, True]
+    assert stream.select(channel='LFX')[1].stats.starttime == REAL_DATA_STARTTIME + 3
+    assert stream.select(channel='LFX')[1].data.tolist() == [17208.2]
+    assert stream[0].stats.iaga2002['Data Type'] == 'definitive'
+
+
+def test_read_iaga2002_slice(tmpdir):
+    '''
+    Only the rows of the time slice are read from the file, also when rows are missing
+    '''
+    starttime = UTCDateTime(2020, 1, 19)
+    stream = pygeomag.data.stream.Stream([
+        Trace(np.arange(86400.) + idx, header={
+            'station': 'OTT', 'location': 'R0', 'channel': 'LF' + component,
+            'starttime': starttime, 'delta': 1.
+        }) for idx, component in enumerate('XYZF')
+    ])
+    filename = str(tmpdir.join('ott20200119vsec.sec'))
+    stream.write(filename, format='IAGA2002')
+    result = pygeomag.data.stream.Stream.read(
+        filename, format='IAGA2002', starttime=starttime + 3600.5, endtime=starttime + 7200)
+    assert len(result) == 4
+    assert result[0].stats.starttime == starttime + 3601
+    assert result[0].data.tolist() == np.arange(3601., 7201.).tolist()
+
+    # remove the rows from 00:00:05 to 00:00:14
+    with open(filename, 'rb') as resource:
+        lines = resource.readlines()
+    del lines[20:30]
+    with open(filename, 'wb') as resource:
+        resource.writelines(lines)
+    for endtime, npts in [(starttime + 7200, 7191), (starttime + 9, 5)]:
+        result = pygeomag.data.stream.Stream.read(filename, format='IAGA2002', endtime=endtime)
+        assert sum([trace.stats.npts for trace in result.select(channel='LFX')]) == npts
+
+
+def test_iaga2002_update(data, tmpdir):
+    '''
+    Updating a file only writes the rows that changed or are new, the
+    result is the same as writing the file
+    '''
+    stream = data.merge_by_location().slice(REAL_DATA_STARTTIME, REAL_DATA_ENDTIME)
+    expected = str(tmpdir.join('expected.min'))
+    assert stream.write(expected, format='IAGA2002') == 1440
+    with open(expected, 'rb') as resource:
+        content = resource.read()
+
+    filename = str(tmpdir.join('ott20200119vmin.min'))
+    # a gap filled by late data and the rows after noon are new
+    partial = stream.slice(REAL_DATA_STARTTIME, REAL_DATA_STARTTIME + 43200)
+    for trace in partial:
+        trace.data = np.ma.masked_array(trace.data, mask=np.arange(trace.stats.npts) // 10 == 5)
+    partial.write(filename, format='IAGA2002')
+    # the 10 rows of the gap are patched and the rows after noon appended
+    assert stream.write(filename, format='IAGA2002', update=True) == 10 + 1440 - 721
+    with open(filename, 'rb') as resource:
+        assert resource.read() == content
+
+    # only the rows of the time span are updated, a wide value rewrites the file
+    stream = stream.slice(REAL_DATA_STARTTIME + 72000, REAL_DATA_ENDTIME)
+    stream[0].data[1] = -123456.789
+    stream.write(filename, format='IAGA2002', update=True)
+    with open(filename, 'rb') as resource:
+        lines = resource.read().split(b'\r\n')
+    assert lines[:-1] != content.split(b'\r\n')[:-1]
+    assert len(lines) == len(content.split(b'\r\n'))
+    assert [line for line in lines if line.startswith(b'2020-01-19 20:01')] == [
+        b"2020-01-19 20:01:00.000 019     17225.00  -4915.10  49975.60 -123456.79"]
+
+    # a header that changed rewrites the file with the rows of the file
+    # missing from the stream
+    stream.write(filename, format='IAGA2002', update=True, source='GSC')
+    with open(filename, 'rb') as resource:
+        rewritten = resource.read().split(b'\r\n')
+    assert rewritten[0].startswith(b' Format                  IAGA-2002')
+    assert b'GSC' in rewritten[1]
+    assert len(rewritten) == len(lines)
+    assert rewritten[lines.index(b'DATE       TIME         DOY     OTTX      OTTY      OTTZ      OTTF   |'):] == \
+        lines[lines.index(b'DATE       TIME         DOY     OTTX      OTTY      OTTZ      OTTF   |'):]
+    assert pygeomag.data.stream.Stream.read(filename, format='IAGA2002')[0].stats.starttime == \
+        REAL_DATA_STARTTIME
+
+
+def test_iaga2002_update_width(data, tmpdir):
+    '''
+    A changed row wider than its column in the middle of the day rewrites
+    the file with all its rows
+    '''
+    stream = data.merge_by_location().slice(REAL_DATA_STARTTIME, REAL_DATA_ENDTIME)
+    filename = str(tmpdir.join('ott20200119vmin.min'))
+    stream.write(filename, format='IAGA2002')
+    with open(filename, 'rb') as resource:
+        content = resource.read().split(b'\r\n')
+
+    partial = stream.slice(REAL_DATA_STARTTIME + 600, REAL_DATA_STARTTIME + 600 + 29 * 60)
+    for trace in partial:
+        trace.data = trace.data.copy()
+    partial[3].data[5] = -123456.
+    assert partial.write(filename, format='IAGA2002', update=True) == 1440
+    with open(filename, 'rb') as resource:
+        lines = resource.read().split(b'\r\n')
+    assert len(lines) == len(content)
+    changed = [idx for idx, (line, expected) in enumerate(zip(lines, content)) if line != expected]
+    assert len(changed) == 1
+    assert lines[changed[0]].startswith(b'2020-01-19 00:15:00.000 019 ')
+    assert b' -123456.00 ' in lines[changed[0]]
+    assert lines[-2].startswith(b'2020-01-19 23:59:00.000')
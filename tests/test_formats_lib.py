@@ -0,0 +1,100 @@
+'''
+..  codeauthor:: Charles Blais
+'''
+# Third-party library
+import pytest
+import numpy as np
+from obspy import Stream, Trace, UTCDateTime
+
+# User-contributed library
+import pygeomag.data.formats.lib
+
+
+def test_format_fixed():
+    '''
+    Test the formatting of values against the printf-style formatting,
+    including the values landing on rounding ties
+    '''
+    values = np.array([0.005, 0.015, 1.005, 2.675, -0.001, -0.0, 12.125, -99999.99, 99999.0, 17208.0])
+    chars = pygeomag.data.formats.lib.format_fixed(values, 9, 2)
+    assert [bytes(row).decode() for row in chars] == ['%9.2f' % value for value in values]
+
+
+def test_format_fixed_too_wide():
+    '''
+    Values not fitting in the width can not be formatted
+    '''
+    assert pygeomag.data.formats.lib.format_fixed(np.array([1., -100000.]), 9, 2) is None
+    assert pygeomag.data.formats.lib.format_fixed(np.array([1., np.nan]), 9, 2) is None
+
+
+def test_get_times():
+    '''
+    The timestamps should match the one computed by UTCDateTime
+    '''
+    starttime = UTCDateTime(2020, 1, 19, 0, 0, 0)
+    times = pygeomag.data.formats.lib.get_times(starttime, 1/60., 1440)
+    for offset in [0, 1, 59, 1439]:
+        assert str(times[offset]) == (starttime + offset*60.).strftime("%Y-%m-%dT%H:%M:%S.%f")
+
+
+def test_order_stream():
+    '''
+    The components are ordered, missing components are empty traces
+    '''
+    stream = Stream([
+        Trace(np.array([1.]), header={'station': 'OTT', 'channel': 'UFZ'}),
+        Trace(np.array([2.]), header={'station': 'OTT', 'channel': 'UFX'}),
+        Trace(np.array([3.]), header={'station': 'OTT', 'channel': 'UFF'}),
+    ])
+    ordered = pygeomag.data.formats.lib.order_stream(stream)
+    assert [trace.stats.channel for trace in ordered] == ['UFX', 'UFY', 'UFZ', 'UFF']
+    assert [trace.stats.npts for trace in ordered] == [1, 0, 1, 1]
+    assert pygeomag.data.formats.lib.is_common_traces(ordered, stats_matches=['network', 'station', 'sampling_rate'])
+    stream += Trace(np.array([4.]), header={'station': 'OTT', 'location': 'R1', 'channel': 'UFX'})
+    assert not pygeomag.data.formats.lib.is_common_traces(stream, stats_matches=['location'])
+    with pytest.raises(ValueError):
+        pygeomag.data.formats.lib.order_stream(stream)
+
+
+def test_get_matrix():
+    '''
+    The traces are aligned in the columns of a matrix like a trim with padding
+    '''
+    starttime = UTCDateTime(2020, 1, 19, 0, 0, 0)
+    stream = Stream([
+        Trace(np.array([1., 2., 3.]), header={'starttime': starttime + 60, 'delta': 60.}),
+        Trace(np.ma.array([4., 5., 6., 7.], mask=[False, True, False, False]), header={'starttime': starttime, 'delta': 60.}),
+    ])
+    matrix, first, delta = pygeomag.data.formats.lib.get_matrix(stream, starttime, starttime + 240, 99999.)
+    assert matrix.dtype == np.float64 and matrix.flags.c_contiguous
+    assert first == starttime and delta == 60.
+    assert matrix.tolist() == [[99999., 4.], [1., 99999.], [2., 6.], [3., 7.], [99999., 99999.]]
+    windows = list(pygeomag.data.formats.lib.iter_windows(stream, starttime, starttime + 240, 99999., 2))
+    assert [start for start, _ in windows] == [0, 2, 4]
+    assert np.concatenate([rows for _, rows in windows]).tolist() == matrix.tolist()
+
+
+def test_parse_fixed():
+    '''
+    Parsing the formatted values should give the values of float
+    '''
+    values = np.array([0., 1.25, -4902.7, 17208., 99999., -0.01, 123456.78])
+    chars = pygeomag.data.formats.lib.format_fixed(values, 10, 2)
+    assert pygeomag.data.formats.lib.parse_fixed(chars).tolist() == values.tolist()
+    # irregular columns are converted value by value
+    chars = np.frombuffer(b'   1.5 -2.25  3.00', dtype=np.uint8).reshape(3, 6)
+    assert pygeomag.data.formats.lib.parse_fixed(chars).tolist() == [1.5, -2.25, 3.]
+
+
+def test_parse_clock():
+    '''
+    Parsing the formatted time of day
+    '''
+    starttime = UTCDateTime(2020, 1, 19, 0, 0, 0)
+    times = pygeomag.data.formats.lib.get_times(starttime, 8., 691200)
+    chars = pygeomag.data.formats.lib.format_clock(times, precision=3)
+    parsed = np.datetime64('2020-01-19') + pygeomag.data.formats.lib.parse_clock(chars)
+    assert (parsed == times).all()
+    with pytest.raises(ValueError):
+        pygeomag.data.formats.lib.parse_clock(np.frombuffer(b'00:0a:00', dtype=np.uint8).reshape(1, 8))
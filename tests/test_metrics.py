@@ -0,0 +1,60 @@
+'''
+..  codeauthor:: Charles Blais
+'''
+import json
+
+# Third-party library
+import pytest
+from obspy import read
+
+# User-contributed library
+import pygeomag.metrics
+
+
+def test_metrics():
+    '''
+    The time of repeated stages is accumulated and the counters added
+    '''
+    metrics = pygeomag.metrics.Metrics('test')
+    for _ in range(2):
+        with metrics.stage('merge'):
+            pass
+    metrics.add('files_written')
+    metrics.add('files_written')
+    metrics.add_stream('waveform', read())
+    summary = metrics.get_summary()
+    assert list(summary['stages']) == ['merge']
+    assert summary['counters'] == {'files_written': 2, 'waveform_traces': 3, 'waveform_samples': 9000}
+    assert summary['error'] is None
+
+
+def test_summary_json(tmpdir):
+    '''
+    A JSON line is appended for each run, with the error of a failed run
+    '''
+    filename = str(tmpdir.join('metrics.jsonl'))
+    with pygeomag.metrics.summary('test', filename) as metrics:
+        metrics.add('rows_written', 1440)
+    with pytest.raises(ValueError):
+        with pygeomag.metrics.summary('test', filename):
+            raise ValueError()
+    with open(filename) as resource:
+        lines = [json.loads(line) for line in resource]
+    assert [line['counters'] for line in lines] == [{'rows_written': 1440}, {}]
+    assert [line['error'] for line in lines] == [None, 'ValueError']
+
+
+def test_summary_prometheus(tmpdir):
+    '''
+    The prometheus textfile is replaced at each run
+    '''
+    filename = tmpdir.join('pygeomag.prom')
+    for rows in [1440, 60]:
+        with pygeomag.metrics.summary('test', str(filename), 'prometheus') as metrics:
+            with metrics.stage('write'):
+                metrics.add('rows_written', rows)
+    content = filename.read()
+    assert tmpdir.listdir() == [filename]
+    assert '# TYPE pygeomag_rows_written gauge\npygeomag_rows_written{command="test"} 60\n' in content
+    assert 'pygeomag_stage_seconds{command="test",stage="write"} ' in content
+    assert 'pygeomag_run_error{command="test"} 0\n' in content
@@ -4,7 +4,7 @@
 
 # Third-party library
 import pytest
-from obspy import Trace
+from obspy import Trace, UTCDateTime
 import numpy as np
 
 # User-contributed library
@@ -95,3 +95,104 @@ def test_merge_by_location_order():
     nstream = stream.merge_by_location(locations=['R2', 'R1'])
     assert len(nstream) == 1
     assert nstream[0].data[2] == 4
+
+
+def test_merge_by_location_contained():
+    '''
+    Like obspy merge=1, a contained trace only fills the masked samples and
+    gaps between the traces are masked
+    '''
+    stream = pygeomag.data.stream.Stream([
+        Trace(
+            np.ma.array([1, 2, 0, 4, 5], mask=[False, False, True, False, False], dtype=np.float64),
+            header={'station': 'OTT', 'location': 'R1', 'channel': 'UFX'}),
+        Trace(
+            np.array([2, 3], dtype=np.float64),
+            header={'station': 'OTT', 'location': 'R0', 'channel': 'UFX', 'starttime': 1}),
+        Trace(
+            np.array([8, 9], dtype=np.float64),
+            header={'station': 'OTT', 'location': 'R2', 'channel': 'UFX', 'starttime': 7}),
+    ])
+    nstream = stream.merge_by_location(replace_location='R')
+    assert len(nstream) == 1
+    assert nstream[0].stats.location == 'R'
+    assert nstream[0].stats.npts == 9
+    assert nstream[0].data.tolist() == [1, 2, 3, 4, 5, None, None, 8, 9]
+
+
+def test_merge_by_location_no_copy():
+    '''
+    A channel with a single location is not copied
+    '''
+    stream = pygeomag.data.stream.Stream([
+        Trace(np.array([1, 2, 3]), header={'station': 'OTT', 'location': 'R1', 'channel': 'UFX'}),
+        Trace(np.array([1, 2, 3]), header={'station': 'OTT', 'location': 'R1', 'channel': 'UFY'}),
+    ])
+    nstream = stream.merge_by_location(replace_location='R')
+    assert [trace.id for trace in nstream] == ['.OTT.R.UFX', '.OTT.R.UFY']
+    assert nstream[0].data is stream[0].data
+    assert stream[0].stats.location == 'R1'
+
+
+def test_merge_by_location_fill():
+    '''
+    The missing samples (masked or NaN) of a location are filled by the lower
+    priority locations with the provenance of each sample
+    '''
+    stream = pygeomag.data.stream.Stream([
+        Trace(
+            np.array([10, 20, 30, 40, 50], dtype=np.float64),
+            header={'station': 'OTT', 'location': 'R2', 'channel': 'UFX'}),
+        Trace(
+            np.ma.array([1, 0, 3, np.nan], mask=[False, True, False, False], dtype=np.float64),
+            header={'station': 'OTT', 'location': 'R1', 'channel': 'UFX'}),
+        Trace(
+            np.array([7], dtype=np.float64),
+            header={'station': 'OTT', 'location': 'R1', 'channel': 'UFX', 'starttime': 6}),
+    ])
+    nstream = stream.merge_by_location(replace_location='R', fill=True)
+    assert len(nstream) == 1
+    assert nstream[0].data.tolist() == [1, 20, 3, 40, 50, None, 7]
+    assert nstream[0].stats.provenance.locations == ['R1', 'R2']
+    assert nstream[0].stats.provenance.samples.dtype == np.int8
+    assert nstream[0].stats.provenance.samples.tolist() == [0, 1, 0, 1, 1, -1, 0]
+
+
+def test_get_provenance():
+    '''
+    The provenance of the samples follows the trim (or slice) of a trace
+    merged with fill
+    '''
+    stream = pygeomag.data.stream.Stream([
+        Trace(
+            np.ma.array(np.arange(10, dtype=np.float64), mask=[i % 3 == 0 for i in range(10)]),
+            header={'station': 'OTT', 'location': 'R1', 'channel': 'UFX'}),
+        Trace(
+            np.arange(10, dtype=np.float64) + 100,
+            header={'station': 'OTT', 'location': 'R2', 'channel': 'UFX'}),
+    ])
+    nstream = stream.merge_by_location(fill=True)
+    assert pygeomag.data.stream.get_provenance(nstream[0]).tolist() == [1, 0, 0, 1, 0, 0, 1, 0, 0, 1]
+    sliced = nstream.slice(UTCDateTime(3), UTCDateTime(6))
+    assert sliced[0].data.tolist() == [103, 4, 5, 106]
+    assert pygeomag.data.stream.get_provenance(sliced[0]).tolist() == [1, 0, 0, 1]
+    nstream.trim(UTCDateTime(4), UTCDateTime(11), pad=True)
+    assert nstream[0].stats.npts == 8
+    assert pygeomag.data.stream.get_provenance(nstream[0]).tolist() == [0, 0, 1, 0, 0, 1, -1, -1]
+    assert pygeomag.data.stream.get_provenance(stream[0]) is None
+
+
+def test_group_by():
+    '''
+    The traces are partitioned by station without being copied
+    '''
+    stream = pygeomag.data.stream.Stream([
+        Trace(np.array([1, 2, 3]), header={'station': 'OTT', 'location': 'R1', 'channel': 'UFX'}),
+        Trace(np.array([1, 2, 3]), header={'station': 'SNK', 'location': 'R1', 'channel': 'UFX'}),
+        Trace(np.array([1, 2, 3]), header={'station': 'OTT', 'location': 'R1', 'channel': 'UFY'}),
+    ])
+    groups = stream.group_by(['station'])
+    assert sorted(groups) == [('OTT',), ('SNK',)]
+    assert isinstance(groups[('OTT',)], pygeomag.data.stream.Stream)
+    assert [trace.stats.channel for trace in groups[('OTT',)]] == ['UFX', 'UFY']
+    assert groups[('OTT',)][1] is stream[2]